@@ -43,6 +43,7 @@ import ansible.errors
 import ansible.plugins.connection
 
 import mitogen.core
+import mitogen.select
 import mitogen.utils
 
 import ansible_mitogen.mixins
@@ -55,6 +56,26 @@ import ansible_mitogen.transport_config
 
 LOG = logging.getLogger(__name__)
 
+#: Minimum size of a file transferred with put_file() that is cached and
+#: relayed by contexts between the target and its connection multiplexer,
+#: such as mitogen_via hosts, or 0 to disable relaying.
+RELAY_FILE_SIZE = ansible_mitogen.process.getenv_int(
+    'MITOGEN_RELAY_FILE_SIZE', 0
+)
+
+#: If nonzero, an interrupted fetch_file() keeps its partial output, and a
+#: later fetch_file() to the same path resumes from it.
+RESUMABLE_FETCH = ansible_mitogen.process.getenv_int(
+    'MITOGEN_RESUMABLE_FETCH', 0
+)
+
+#: If nonzero, put_file() of a file over an existing one, or of a file staged
+#: for an action that names an existing destination, transfers only blocks
+#: that differ from it. Both copies are hashed to find them.
+DELTA_TRANSFER = ansible_mitogen.process.getenv_int(
+    'MITOGEN_DELTA_TRANSFER', 0
+)
+
 task_vars_msg = (
     'could not recover task_vars. This means some connection '
     'settings may erroneously be reset to their defaults. '
@@ -427,6 +448,38 @@ CONNECTION_METHOD = {
 }
 
 
+class LineBuffer(object):
+    """
+    Split chunks of command output into lines for
+    :meth:`Connection.exec_command_streaming`.
+    """
+    #: Longest partial line buffered before it is delivered anyway.
+    max_size = 1048576
+
+    def __init__(self, name, on_line):
+        self.name = name
+        self.on_line = on_line
+        self.partial = b''
+
+    def feed(self, data):
+        data = self.partial + data
+        start = 0
+        while True:
+            end = data.find(b'\n', start) + 1
+            if not end:
+                break
+            self.on_line(self.name, data[start:end])
+            start = end
+        self.partial = data[start:]
+        if len(self.partial) >= self.max_size:
+            self.flush()
+
+    def flush(self):
+        if self.partial:
+            self.on_line(self.name, self.partial)
+            self.partial = b''
+
+
 class CallChain(mitogen.parent.CallChain):
     """
     Extend :class:`mitogen.parent.CallChain` to additionally cause the
@@ -447,14 +500,17 @@ class CallChain(mitogen.parent.CallChain):
         #: The connection to reset on CallError.
         self._connection = connection
 
+    def _abort(self, e):
+        self._connection.reset()
+        raise ansible.errors.AnsibleConnectionFailure(
+            self.call_aborted_msg % (e,)
+        )
+
     def _rethrow(self, recv):
         try:
             return recv.get().unpickle()
         except mitogen.core.ChannelError as e:
-            self._connection.reset()
-            raise ansible.errors.AnsibleConnectionFailure(
-                self.call_aborted_msg % (e,)
-            )
+            self._abort(e)
 
     def call(self, func, *args, **kwargs):
         """
@@ -1023,6 +1079,86 @@ class Connection(ansible.plugins.connection.ConnectionBase):
         )
         return rc, stdout, stderr
 
+    def exec_command_streaming(self, cmd, on_output=None, on_line=None,
+                               in_data='', sudoable=True, mitogen_chdir=None):
+        """
+        Like :meth:`exec_command`, but deliver output as the command produces
+        it, without buffering it in the target or the controller. Each chunk
+        is acknowledged by a message to the target, so this suits commands
+        with large or long-running output, which :meth:`exec_command` returns
+        as one message once the command exits.
+
+        :param str cmd:
+            Shell command to execute.
+        :param on_output:
+            If not :data:`None`, function called as `on_output(name, data)`
+            for each chunk of output, where `name` is ``stdout`` or
+            ``stderr``.
+        :param on_line:
+            If not :data:`None`, function called as `on_line(name, line)` for
+            each line of output including its terminator, and for any
+            unterminated remainder once the command exits. Lines longer than
+            :attr:`LineBuffer.max_size` are delivered in pieces.
+        :param bytes in_data:
+            Data to supply on ``stdin`` of the process.
+        :returns:
+            Return code.
+        """
+        chain = self.get_chain()
+        recv = mitogen.core.Receiver(self.context.router,
+                                     respondent=self.context)
+        call_recv = chain.call_async(
+            ansible_mitogen.target.exec_command_streaming,
+            cmd=mitogen.utils.cast(cmd),
+            sender=recv.to_sender(),
+            in_data=mitogen.utils.cast(in_data),
+            chdir=mitogen_chdir or self.get_default_cwd(),
+            emulate_tty=(not in_data and sudoable),
+        )
+
+        buffer_by_name = {}
+        if on_line is not None:
+            for name in 'stdout', 'stderr':
+                buffer_by_name[name] = LineBuffer(name, on_line)
+
+        ack_sender = None
+        dead = None
+        select = mitogen.select.Select([recv, call_recv], oneshot=False)
+        try:
+            while True:
+                try:
+                    msg = select.get()
+                except mitogen.core.ChannelError as e:
+                    # Either the target closed recv once output ended, or the
+                    # context was lost and both receivers will die. Which one
+                    # raised is unknown, so only a second death is fatal.
+                    if dead is not None:
+                        chain._abort(e)
+                    dead = e
+                    continue
+                if msg.receiver is call_recv:
+                    # The target replies only after closing recv, unless an
+                    # earlier pipelined call failed and the command never ran,
+                    # in which case recv is never closed.
+                    rc = msg.unpickle()
+                    break
+                if ack_sender is None:
+                    ack_sender = msg.unpickle()
+                    continue
+                name, data = msg.unpickle()
+                data = bytes(data)
+                if on_output is not None:
+                    on_output(name, data)
+                if on_line is not None:
+                    buffer_by_name[name].feed(data)
+                ack_sender.send(len(data))
+        finally:
+            select.close()
+
+        for line_buffer in buffer_by_name.values():
+            line_buffer.flush()
+        return rc
+
     def fetch_file(self, in_path, out_path):
         """
         Implement fetch_file() by calling the corresponding
@@ -1040,7 +1176,8 @@ class Connection(ansible.plugins.connection.ConnectionBase):
             context=self.context,
             # in_path may be AnsibleUnicode
             in_path=mitogen.utils.cast(in_path),
-            out_path=out_path
+            out_path=out_path,
+            resumable=bool(RESUMABLE_FETCH),
         )
 
     def put_data(self, out_path, data, mode=None, utimes=None):
@@ -1074,7 +1211,27 @@ class Connection(ansible.plugins.connection.ConnectionBase):
             s = 'file or module does not exist: ' + path
             raise ansible.errors.AnsibleFileNotFound(s)
 
-    def put_file(self, in_path, out_path):
+    def _get_relay_ids(self, context, size):
+        """
+        Return IDs of the contexts that should relay a file of `size` bytes
+        from the FileService in `context` to the target, or :data:`None`.
+        The login account of a become connection runs on the target itself,
+        so relaying through it saves nothing.
+        """
+        if not (0 < RELAY_FILE_SIZE <= size):
+            return None
+
+        parent_ids = self.init_child_result.get('parent_ids') or []
+        if context.context_id not in parent_ids:
+            return None
+
+        return [
+            context_id
+            for context_id in parent_ids[:parent_ids.index(context.context_id)]
+            if context_id != self.login_context.context_id
+        ] or None
+
+    def put_file(self, in_path, out_path, base_path=None):
         """
         Implement put_file() by streamily transferring the file via
         FileService.
@@ -1083,6 +1240,10 @@ class Connection(ansible.plugins.connection.ConnectionBase):
             Local filesystem path to read.
         :param str out_path:
             Remote filesystem path to write.
+        :param str base_path:
+            Remote path of an existing file likely to resemble `in_path`,
+            defaulting to `out_path`. With :data:`DELTA_TRANSFER` set, only
+            blocks differing from it are transferred.
 
         Ansible connection plugin method.
         """
@@ -1122,13 +1283,21 @@ class Connection(ansible.plugins.connection.ConnectionBase):
             path=mitogen.utils.cast(in_path)
         )
 
+        if DELTA_TRANSFER:
+            base_path = mitogen.utils.cast(base_path or out_path)
+        else:
+            base_path = None
+
         # For now this must remain synchronous, as the action plug-in may have
         # passed us a temporary file to transfer. A future FileService could
         # maintain an LRU list of open file descriptors to keep the temporary
         # file alive, but that requires more work.
+        context = self.binding.get_child_service_context()
         self.get_chain().call(
             ansible_mitogen.target.transfer_file,
-            context=self.binding.get_child_service_context(),
+            context=context,
             in_path=in_path,
-            out_path=out_path
+            out_path=out_path,
+            relay_ids=self._get_relay_ids(context, st.st_size),
+            base_path=base_path,
         )
@@ -45,15 +45,19 @@ from ansible.parsing.utils.jsonify import jsonify
 
 import ansible
 import ansible.constants
+import ansible.errors
 import ansible.plugins
 import ansible.plugins.action
 
 import mitogen.core
 import mitogen.select
+import mitogen.service
 import mitogen.utils
 
 import ansible_mitogen.connection
+import ansible_mitogen.parsing
 import ansible_mitogen.planner
+import ansible_mitogen.process
 import ansible_mitogen.target
 import ansible_mitogen.utils
 
@@ -78,6 +82,19 @@ except ImportError:
 
 LOG = logging.getLogger(__name__)
 
+#: If nonzero, shell commands issued by action plug-ins that consist only of
+#: simple file operations are performed in-process by
+#: :func:`ansible_mitogen.target.run_file_ops` rather than by a shell.
+EMULATE_COMMANDS = ansible_mitogen.process.getenv_int(
+    'MITOGEN_EMULATE_COMMANDS', default=0
+)
+
+#: If nonzero, :meth:`ActionModuleMixin._execute_remote_stat` examines files
+#: using :func:`ansible_mitogen.target.stat_paths` rather than running the
+#: stat module. Its results lack the ``mimetype``, ``charset``,
+#: ``attributes`` and ``version`` keys the stat module returns.
+FAST_STAT = ansible_mitogen.process.getenv_int('MITOGEN_FAST_STAT', default=0)
+
 
 class ActionModuleMixin(ansible.plugins.action.ActionBase):
     """
@@ -179,6 +196,24 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
 
         return dct
 
+    def _run_file_ops(self, ops):
+        """
+        Perform file operations in the target using
+        :func:`ansible_mitogen.target.run_file_ops`, formatting the result as
+        :meth:`_low_level_execute_command` would.
+        """
+        rc, stdout, stderr = self._connection.get_chain().call(
+            ansible_mitogen.target.run_file_ops,
+            mitogen.utils.cast(ops),
+        )
+        stdout = to_text(stdout)
+        return {
+            'rc': rc,
+            'stdout': stdout,
+            'stdout_lines': stdout.splitlines(),
+            'stderr': to_text(stderr),
+        }
+
     def _remote_file_exists(self, path):
         """
         Determine if `path` exists by directly invoking os.path.exists() in the
@@ -190,6 +225,65 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
             mitogen.utils.cast(path)
         )
 
+    def _execute_remote_stat(self, path, all_vars, follow, tmp=None,
+                             checksum=True):
+        """
+        With :data:`FAST_STAT` set, replace the base implementation's
+        invocation of the stat module with a call to
+        :func:`ansible_mitogen.target.stat_paths`. Otherwise run the stat
+        module as usual, since some actions depend on keys only it returns.
+        """
+        if FAST_STAT:
+            dct = self._execute_remote_stat_batch([path], all_vars, follow,
+                                                  checksum)[0]
+        else:
+            dct = super(ActionModuleMixin, self)._execute_remote_stat(
+                path, all_vars, follow, tmp=tmp, checksum=checksum,
+            )
+
+        # The copy action examines its destination just before staging the
+        # new content, see _transfer_file().
+        if dct.get('exists') and dct.get('isreg'):
+            self._delta_base_path = path
+        else:
+            self._delta_base_path = None
+        return dct
+
+    def _execute_remote_stat_batch(self, paths, all_vars, follow,
+                                   checksum=True):
+        """
+        Like :meth:`_execute_remote_stat`, but examine every path in `paths`
+        in one roundtrip, returning a list of results in the same order.
+        Action plug-ins operating on many files may use this to avoid one
+        roundtrip per file. Results are produced by
+        :func:`ansible_mitogen.target.stat_paths` whether or not
+        :data:`FAST_STAT` is set, so they lack the keys listed there.
+        """
+        LOG.debug('_execute_remote_stat_batch(%d paths, follow=%r, '
+                  'checksum=%r)', len(paths), follow, checksum)
+        results = self._connection.get_chain().call(
+            ansible_mitogen.target.stat_paths,
+            mitogen.utils.cast(list(paths)),
+            follow=bool(follow),
+            checksum=bool(checksum),
+        )
+
+        stats = []
+        for path, result in zip(paths, results):
+            if result.get('failed'):
+                raise ansible.errors.AnsibleError(
+                    'Failed to get information on remote file (%s): %s' % (
+                        path, result.get('msg'),
+                    )
+                )
+            # Mimic ActionBase._execute_remote_stat().
+            dct = result['stat']
+            if not dct['exists']:
+                dct['checksum'] = '1'
+            dct.setdefault('checksum', '')
+            stats.append(dct)
+        return stats
+
     def _configure_module(self, module_name, module_args, task_vars=None):
         """
         Mitogen does not use the Ansiballz framework. This call should never
@@ -239,6 +333,26 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
             )
         self._connection._shell.tmpdir = None
 
+    #: Path of the existing regular file last examined by
+    #: :meth:`_execute_remote_stat`, or :data:`None`.
+    _delta_base_path = None
+
+    def _transfer_file(self, local_path, remote_path):
+        """
+        Like the base implementation, but pass the file last examined by
+        :meth:`_execute_remote_stat` to :meth:`Connection.put_file` as the
+        base of a delta transfer. The copy action examines its destination
+        just before staging the new content at a temporary path, so with
+        :data:`ansible_mitogen.connection.DELTA_TRANSFER` set, only blocks
+        differing from the destination are transferred.
+        """
+        base_path, self._delta_base_path = self._delta_base_path, None
+        LOG.debug('_transfer_file(%r, %r, base_path=%r)',
+                  local_path, remote_path, base_path)
+        self._connection.put_file(local_path, remote_path,
+                                  base_path=base_path)
+        return remote_path
+
     def _transfer_data(self, remote_path, data):
         """
         Used by the base _execute_module(), and in <2.4 also by the template
@@ -273,17 +387,14 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
 
     def _remote_chmod(self, paths, mode, sudoable=False):
         """
-        Issue an asynchronous set_file_mode() call for every path in `paths`,
-        then format the resulting return value list with fake_shell().
+        Issue one :func:`ansible_mitogen.target.run_file_ops` call changing
+        the mode of every path in `paths`.
         """
         LOG.debug('_remote_chmod(%r, mode=%r, sudoable=%r)',
                   paths, mode, sudoable)
-        return self.fake_shell(lambda: mitogen.select.Select.all(
-            self._connection.get_chain().call_async(
-                ansible_mitogen.target.set_file_mode, path, mode
-            )
-            for path in paths
-        ))
+        return self._run_file_ops([
+            (';', False, 'chmod', (mode, list(paths))),
+        ])
 
     def _remote_chown(self, paths, user, sudoable=False):
         """
@@ -355,13 +466,11 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
                 self._connection.get_good_temp_dir()
             )
 
-    def _execute_module(self, module_name=None, module_args=None, tmp=None,
-                        task_vars=None, persist_files=False,
-                        delete_remote_tmp=True, wrap_async=False):
+    def _make_invocation(self, module_name, module_args, task_vars,
+                         wrap_async):
         """
-        Collect up a module's execution environment then use it to invoke
-        target.run_module() or helpers.run_module_async() in the target
-        context.
+        Collect up a module's execution environment into a
+        :class:`ansible_mitogen.planner.Invocation`.
         """
         if module_name is None:
             module_name = self._task.action
@@ -382,26 +491,23 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
         if module_name == 'ansible.legacy.ping' and type(self).__name__ == 'wait_for_connection':
             self._connection.context = None
 
-        self._connection._connect()
-        result = ansible_mitogen.planner.invoke(
-            ansible_mitogen.planner.Invocation(
-                action=self,
-                connection=self._connection,
-                module_name=mitogen.core.to_text(module_name),
-                module_args=mitogen.utils.cast(module_args),
-                task_vars=task_vars,
-                templar=self._templar,
-                env=mitogen.utils.cast(env),
-                wrap_async=wrap_async,
-                timeout_secs=self.get_task_timeout_secs(),
-            )
+        return ansible_mitogen.planner.Invocation(
+            action=self,
+            connection=self._connection,
+            module_name=mitogen.core.to_text(module_name),
+            module_args=mitogen.utils.cast(module_args),
+            task_vars=task_vars,
+            templar=self._templar,
+            env=mitogen.utils.cast(env),
+            wrap_async=wrap_async,
+            timeout_secs=self.get_task_timeout_secs(),
         )
 
-        if tmp and delete_remote_tmp and ansible_mitogen.utils.ansible_version[:2] < (2, 5):
-            # Built-in actions expected tmpdir to be cleaned up automatically
-            # on _execute_module().
-            self._remove_tmp_path(tmp)
-
+    def _finish_module_result(self, result):
+        """
+        Strip internal keys from a module result and merge in any interpreter
+        discovery results and warnings, as ActionBase._execute_module() does.
+        """
         # prevents things like discovered_interpreter_* or ansible_discovered_interpreter_* from being set
         # handle ansible 2.3.3 that has remove_internal_keys in a different place
         check = remove_internal_keys(result)
@@ -432,6 +538,94 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
 
         return wrap_var(result)
 
+    #: Module names answered by :meth:`_get_async_status` when possible.
+    ASYNC_STATUS_MODULES = frozenset([
+        'async_status',
+        'ansible.builtin.async_status',
+        'ansible.legacy.async_status',
+    ])
+
+    def _get_async_status(self, module_args):
+        """
+        Answer an ``async_status`` module invocation from the results pushed
+        to :class:`ansible_mitogen.services.AsyncJobService` by async tasks.
+
+        :returns:
+            Module result dict, or :data:`None` if the module must run in the
+            target, because the job is unknown, its connection was lost, or it
+            is being cleaned up.
+        """
+        jid = mitogen.core.to_text(module_args.get('jid', ''))
+        kwargs = {
+            'call_context': self._connection.get_binding().get_service_context(),
+            'service_name': 'ansible_mitogen.services.AsyncJobService',
+            'job_id': jid,
+        }
+        if module_args.get('mode') == 'cleanup':
+            # Let the module delete the job file.
+            mitogen.service.call(method_name='forget', **kwargs)
+            return None
+
+        status = mitogen.service.call(method_name='get', **kwargs)
+        if status is None:
+            return None
+        if not status['finished']:
+            return {
+                'ansible_job_id': jid,
+                'started': 1,
+                'finished': 0,
+            }
+        return dict(status['result'], ansible_job_id=jid)
+
+    def _execute_module(self, module_name=None, module_args=None, tmp=None,
+                        task_vars=None, persist_files=False,
+                        delete_remote_tmp=True, wrap_async=False):
+        """
+        Collect up a module's execution environment then use it to invoke
+        target.run_module() or helpers.run_module_async() in the target
+        context.
+        """
+        invocation = self._make_invocation(module_name, module_args,
+                                           task_vars, wrap_async)
+        self._connection._connect()
+        if invocation.module_name in self.ASYNC_STATUS_MODULES:
+            result = self._get_async_status(invocation.module_args)
+            if result is not None:
+                return self._finish_module_result(result)
+
+        result = ansible_mitogen.planner.invoke(invocation)
+
+        if tmp and delete_remote_tmp and ansible_mitogen.utils.ansible_version[:2] < (2, 5):
+            # Built-in actions expected tmpdir to be cleaned up automatically
+            # on _execute_module().
+            self._remove_tmp_path(tmp)
+
+        return self._finish_module_result(result)
+
+    def _execute_module_batch(self, batch, task_vars=None):
+        """
+        Run several modules back to back in one pipelined unit, waiting only
+        for the final result. Each module is started regardless of the
+        previous module's result, so the batch must only contain modules whose
+        arguments are known in advance, e.g. a copy followed by a stat of its
+        destination.
+
+        :param list batch:
+            List of `(module_name, module_args)` tuples.
+        :returns:
+            List of module results, in the order of `batch`.
+        """
+        invocations = [
+            self._make_invocation(module_name, module_args, task_vars,
+                                  wrap_async=False)
+            for module_name, module_args in batch
+        ]
+        self._connection._connect()
+        return [
+            self._finish_module_result(result)
+            for result in ansible_mitogen.planner.invoke_batch(invocations)
+        ]
+
     def _postprocess_response(self, result):
         """
         Apply fixups mimicking ActionBase._execute_module(); this is copied
@@ -446,8 +640,15 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
                     "stdout": "stdout data",
                     "stderr": "stderr data"
                 }
+
+            If the target already decoded the module's output, it appears in
+            an additional `parsed` key, and `stdout` is empty.
         """
-        data = self._parse_returned_data(result)
+        data = result.pop('parsed', None)
+        if data is None:
+            data = self._parse_returned_data(result)
+        else:
+            data['_ansible_parsed'] = True
 
         # Cutpasted from the base implementation.
         if 'stdout' in data and 'stdout_lines' not in data:
@@ -468,6 +669,12 @@ class ActionModuleMixin(ansible.plugins.action.ActionBase):
         LOG.debug('_low_level_execute_command(%r, in_data=%r, exe=%r, dir=%r)',
                   cmd, type(in_data), executable, chdir)
 
+        if EMULATE_COMMANDS and in_data is None and chdir is None:
+            ops = ansible_mitogen.parsing.parse_file_ops(cmd)
+            if ops is not None:
+                LOG.debug('_low_level_execute_command(): emulating %r', ops)
+                return self._run_file_ops(ops)
+
         if executable is None:  # executable defaults to False
             executable = self._play_context.executable
         if executable:
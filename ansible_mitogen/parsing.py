@@ -30,6 +30,9 @@ from __future__ import absolute_import, division, print_function
 from __future__ import unicode_literals
 __metaclass__ = type
 
+import re
+import shlex
+
 import mitogen.core
 
 
@@ -75,3 +78,149 @@ def parse_hashbang(source):
         return None, None
 
     return parse_script_interpreter(source[2:])
+
+
+#: Characters with special meaning to the shell outside single quotes, other
+#: than command separators, that cause :func:`parse_file_ops` to give up.
+_SHELL_SPECIAL_CHARS = set('$`"\\*?[]{}()|<>!#~&\n')
+
+#: The redirection the "sh" shell plug-in appends to ``rm`` commands.
+_QUIET_SUFFIX = ' > /dev/null 2>&1'
+
+_OCTAL_MODE_RE = re.compile(r'^[0-7]{3,4}$')
+_MODE_SPEC_RE = re.compile(r'^([ugoa]*[-+=][rwxXstugo]*)(,[ugoa]*[-+=][rwxXstugo]*)*$')
+_ECHO_TILDE_RE = re.compile(r'^echo (~[-_.A-Za-z0-9]*)$')
+
+
+def _split_commands(cmd):
+    """
+    Split `cmd` into a list of `(connector, quiet, text)` tuples on unquoted
+    ``&&`` and ``;``, where `connector` is the separator preceding the command,
+    and `quiet` indicates its output was redirected to ``/dev/null``.
+
+    :returns:
+        List of tuples, or :data:`None` if `cmd` uses any other shell syntax.
+    """
+    commands = []
+    connector = ';'
+    quiet = False
+    start = 0
+    quoted = False
+    i = 0
+    while i < len(cmd):
+        c = cmd[i]
+        if c == "'":
+            quoted = not quoted
+        elif quoted:
+            pass
+        elif cmd.startswith(_QUIET_SUFFIX, i):
+            commands.append((connector, True, cmd[start:i]))
+            i += len(_QUIET_SUFFIX)
+            rest = cmd[i:].lstrip()
+            if rest and not (rest.startswith('&&') or rest.startswith(';')):
+                return None
+            start = None
+            continue
+        elif cmd.startswith('&&', i) or c == ';':
+            if start is not None:
+                commands.append((connector, quiet, cmd[start:i]))
+            connector = cmd[i:i + 2] if c == '&' else ';'
+            i += len(connector)
+            start = i
+            continue
+        elif c in _SHELL_SPECIAL_CHARS:
+            return None
+        i += 1
+
+    if quoted:
+        return None
+    if start is not None:
+        commands.append((connector, quiet, cmd[start:]))
+    return commands
+
+
+def _parse_flags(words, allowed):
+    """
+    Remove leading option words from `words`, returning the set of option
+    letters, or :data:`None` if any is not in `allowed`.
+    """
+    flags = set()
+    while words and words[0].startswith('-') and words[0] != '-':
+        word = words.pop(0)
+        if word == '--':
+            break
+        for letter in word[1:]:
+            if letter not in allowed:
+                return None
+            flags.add(letter)
+    return flags
+
+
+def _is_absolute(paths):
+    return bool(paths) and all(path.startswith('/') for path in paths)
+
+
+def _parse_file_op(words):
+    """
+    Convert a simple command's words into a `(name, args)` tuple for
+    :func:`ansible_mitogen.target.run_file_ops`, or :data:`None`.
+    """
+    name, words = words[0], words[1:]
+    if name == 'rm':
+        flags = _parse_flags(words, 'frR')
+        if flags is not None and _is_absolute(words):
+            return 'rm', (words, bool(flags & set('rR')), 'f' in flags)
+    elif name == 'chmod':
+        mode, paths = words[:1], words[1:]
+        if mode and (_OCTAL_MODE_RE.match(mode[0]) or
+                     _MODE_SPEC_RE.match(mode[0])) and _is_absolute(paths):
+            return 'chmod', (mode[0], paths)
+    elif name == 'mkdir':
+        parents = words[:1] == ['-p']
+        if parents:
+            words = words[1:]
+        mode = None
+        if words[:1] == ['-m'] and len(words) > 1:
+            mode = words[1]
+            words = words[2:]
+        if (mode is None or _OCTAL_MODE_RE.match(mode)) and _is_absolute(words):
+            return 'mkdir', (words, mode, parents)
+    elif name == 'test':
+        if len(words) == 2 and words[0] == '-e' and _is_absolute(words[1:]):
+            return 'exists', (words[1],)
+    return None
+
+
+def parse_file_ops(cmd):
+    """
+    Parse a command line generated by the "sh" shell plug-in for a simple
+    file operation, such as ``rm -f -r '/tmp/x' > /dev/null 2>&1`` or
+    ``chmod u+x '/tmp/x'``, into operations
+    :func:`ansible_mitogen.target.run_file_ops` can perform without starting
+    a shell. Commands joined by ``&&`` or ``;`` are supported. Only absolute
+    paths are accepted, since the shell's working directory may differ from
+    the target's.
+
+    :param str cmd:
+        Shell command line.
+    :returns:
+        List of `(connector, quiet, name, args)` tuples, or :data:`None` if
+        `cmd` needs a real shell.
+    """
+    match = _ECHO_TILDE_RE.match(cmd)
+    if match:
+        return [(';', False, 'expanduser', (match.group(1),))]
+
+    commands = _split_commands(cmd)
+    if not commands:
+        return None
+
+    ops = []
+    for connector, quiet, text in commands:
+        words = shlex.split(text)
+        op = words and _parse_file_op(words)
+        if not op:
+            return None
+        name, args = op
+        ops.append((connector, quiet, name, args))
+    return ops
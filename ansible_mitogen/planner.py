@@ -43,6 +43,7 @@ import logging
 import os
 import random
 import re
+import zlib
 
 import ansible.collections.list
 import ansible.errors
@@ -50,9 +51,11 @@ import ansible.executor.module_common
 
 import mitogen.core
 import mitogen.select
+import mitogen.service
 
 import ansible_mitogen.loaders
 import ansible_mitogen.parsing
+import ansible_mitogen.process
 import ansible_mitogen.target
 
 
@@ -61,6 +64,31 @@ NO_METHOD_MSG = 'Mitogen: no invocation method found for: '
 NO_INTERPRETER_MSG = 'module (%s) is missing interpreter line'
 # NOTE: Ansible 2.10 no longer has a `.` at the end of NO_MODULE_MSG error
 NO_MODULE_MSG = 'The module %s was not found in configured module paths'
+FACTS_LOST_MSG = 'Mitogen: facts cache lost the base of the delta from %r'
+
+#: If nonzero, module output at least this many bytes long is compressed by
+#: the target before it is returned.
+RESULT_COMPRESS_SIZE = ansible_mitogen.process.getenv_int(
+    'MITOGEN_RESULT_COMPRESS_SIZE', default=0
+)
+
+#: If nonzero, module output that is a lone JSON object is decoded by the
+#: target and returned as a dict, rather than decoded by the worker.
+PARSE_RESULTS = ansible_mitogen.process.getenv_int(
+    'MITOGEN_PARSE_RESULTS', default=0
+)
+
+#: If nonzero, modules in :data:`FACTS_MODULES` that run in the target's main
+#: interpreter return only the facts that changed since their last run.
+FACTS_DELTA = ansible_mitogen.process.getenv_int(
+    'MITOGEN_FACTS_DELTA', default=0
+)
+
+FACTS_MODULES = frozenset([
+    'setup',
+    'ansible.builtin.setup',
+    'ansible.legacy.setup',
+])
 
 _planner_by_path = {}
 
@@ -368,6 +396,12 @@ class NewStylePlanner(ScriptPlanner):
             )
         return self._module_map
 
+    #: If nonzero, in-process runs reuse hooks installed by earlier runs
+    #: rather than reinstalling them for every task.
+    RECYCLE_RUNNERS = ansible_mitogen.process.getenv_int(
+        'MITOGEN_RECYCLE_RUNNERS', default=0
+    )
+
     def get_kwargs(self):
         return super(NewStylePlanner, self).get_kwargs(
             module_map=self.get_module_map(),
@@ -375,6 +409,7 @@ class NewStylePlanner(ScriptPlanner):
                 self._inv.module_name,
                 self._inv.module_path,
             ),
+            recycle=bool(self.RECYCLE_RUNNERS) and not self.should_fork(),
         )
 
 
@@ -463,10 +498,16 @@ def read_file(path):
     return mitogen.core.b('').join(bits)
 
 
-def _propagate_deps(invocation, planner, context):
+def _propagate_deps_async(invocation, planner, context):
+    """
+    Ask PushFileService to deliver the module's files to `context` without
+    waiting for it to finish.
+
+    :returns:
+        :class:`mitogen.core.Receiver` that will receive the call's result.
+    """
     binding = invocation.connection.get_binding()
-    mitogen.service.call(
-        call_context=binding.get_service_context(),
+    return binding.get_service_context().call_service_async(
         service_name='mitogen.service.PushFileService',
         method_name='propagate_paths_and_modules',
 
@@ -479,11 +520,26 @@ def _propagate_deps(invocation, planner, context):
     )
 
 
+def _propagate_deps(invocation, planner, context):
+    _propagate_deps_async(invocation, planner, context).get().unpickle()
+
+
 def _invoke_async_task(invocation, planner):
     job_id = '%016x' % random.randint(0, 2**64)
     context = invocation.connection.spawn_isolated_child()
     _propagate_deps(invocation, planner, context)
 
+    # Have the target push the job's result to the controller on completion,
+    # so async_status need not poll the job file. The job itself detaches and
+    # cannot, so it is watched from the connection's context instead.
+    result_sender = mitogen.service.call(
+        call_context=invocation.connection.get_binding().get_service_context(),
+        service_name='ansible_mitogen.services.AsyncJobService',
+        method_name='register',
+        job_id=mitogen.core.to_text(job_id),
+        context=invocation.connection.context,
+    )
+
     with mitogen.core.Receiver(context.router) as started_recv:
         call_recv = context.call_async(
             ansible_mitogen.target.run_module_async,
@@ -501,6 +557,12 @@ def _invoke_async_task(invocation, planner):
                 raise msg.unpickle()
             break
 
+        invocation.connection.get_chain().call_no_reply(
+            ansible_mitogen.target.watch_async_job,
+            job_id=job_id,
+            result_sender=result_sender,
+        )
+
         return {
             'stdout': json.dumps({
                 # modules/utilities/logic/async_wrapper.py::_run_module().
@@ -512,6 +574,98 @@ def _invoke_async_task(invocation, planner):
         }
 
 
+def _get_facts_cache_call_context(invocation):
+    return invocation.connection.get_binding().get_service_context()
+
+
+def _get_facts_cache_host(invocation):
+    # The delegated-to host when delegate_to is active.
+    return mitogen.core.to_text(
+        invocation.connection.get_task_var('inventory_hostname')
+    )
+
+
+def _get_result_options(invocation, isolated):
+    """
+    Return keyword arguments for :func:`ansible_mitogen.target.run_module`
+    selecting how it encodes the module's result. Facts deltas are only
+    requested from the connection's main context, since an isolated child
+    holds no facts from earlier runs.
+    """
+    options = {}
+    if RESULT_COMPRESS_SIZE:
+        options['compress_size'] = RESULT_COMPRESS_SIZE
+    if PARSE_RESULTS:
+        options['parse_result'] = True
+    if FACTS_DELTA and (not isolated) and \
+            invocation.module_name in FACTS_MODULES:
+        options['facts_delta'] = True
+        options['facts_digest'] = mitogen.service.call(
+            call_context=_get_facts_cache_call_context(invocation),
+            service_name='ansible_mitogen.services.FactsCacheService',
+            method_name='get_digest',
+            host=_get_facts_cache_host(invocation),
+        )
+    return options
+
+
+def _apply_facts_delta(invocation, data, info):
+    """
+    Reconstruct the parsed module output `data` encoded by
+    :func:`ansible_mitogen.target._encode_facts`, and record its facts in
+    :class:`ansible_mitogen.services.FactsCacheService`.
+
+    :returns:
+        :data:`True` if `data` was modified.
+    """
+    call_context = _get_facts_cache_call_context(invocation)
+    if info['base'] is not None:
+        base = mitogen.service.call(
+            call_context=call_context,
+            service_name='ansible_mitogen.services.FactsCacheService',
+            method_name='get',
+            host=_get_facts_cache_host(invocation),
+            digest=mitogen.core.to_text(info['base']),
+        )
+        if base is None:
+            raise ansible.errors.AnsibleError(
+                FACTS_LOST_MSG % (invocation.connection.context,)
+            )
+        for key in info['removed']:
+            base.pop(key, None)
+        base.update(data['ansible_facts'])
+        data['ansible_facts'] = base
+
+    mitogen.service.call(
+        call_context=call_context,
+        service_name='ansible_mitogen.services.FactsCacheService',
+        method_name='put',
+        host=_get_facts_cache_host(invocation),
+        digest=mitogen.core.to_text(info['digest']),
+        facts=data['ansible_facts'],
+    )
+    return info['base'] is not None
+
+
+def _decode_result(invocation, result):
+    """
+    Undo any encoding requested by :func:`_get_result_options`.
+    """
+    stdout_zlib = result.pop('stdout_zlib', None)
+    if stdout_zlib is not None:
+        result['stdout'] = zlib.decompress(stdout_zlib).decode('utf-8')
+    info = result.pop('facts_delta', None)
+    if info is not None:
+        data = result.get('parsed')
+        if data is not None:
+            _apply_facts_delta(invocation, data, info)
+        else:
+            data = json.loads(result['stdout'])
+            if _apply_facts_delta(invocation, data, info):
+                result['stdout'] = json.dumps(data)
+    return result
+
+
 def _invoke_isolated_task(invocation, planner):
     context = invocation.connection.spawn_isolated_child()
     _propagate_deps(invocation, planner, context)
@@ -519,6 +673,7 @@ def _invoke_isolated_task(invocation, planner):
         return context.call(
             ansible_mitogen.target.run_module,
             kwargs=planner.get_kwargs(),
+            **_get_result_options(invocation, isolated=True)
         )
     finally:
         context.shutdown()
@@ -567,14 +722,56 @@ def _load_collections(invocation):
         invocation._extra_sys_paths.add(collection_path.decode('utf-8'))
 
 
-def invoke(invocation):
+def _invoke_pipelined(pairs):
     """
-    Find a Planner subclass corresponding to `invocation` and use it to invoke
-    the module.
+    Run each `(invocation, planner)` pair in the connection's target context
+    as one pipelined unit: every PushFileService request and
+    :func:`ansible_mitogen.target.run_module` call is sent before any reply is
+    awaited. The target serializes the calls, and blocks in
+    :meth:`mitogen.service.PushFileService.get` until any file it needs
+    arrives, so only the final result costs a round trip.
 
-    :param Invocation invocation:
     :returns:
-        Module return dict.
+        List of module return dicts, in the order of `pairs`.
+    """
+    connection = pairs[0][0].connection
+    deps_recvs = []
+    for invocation, planner in pairs:
+        recv = _propagate_deps_async(invocation, planner, connection.context)
+        if invocation._extra_sys_paths:
+            # The multiplexer must see the new sys.path before the target
+            # asks it for any module found there.
+            recv.get().unpickle()
+        else:
+            deps_recvs.append(recv)
+
+    chain = connection.get_chain()
+    call_recvs = [
+        chain.call_async(
+            ansible_mitogen.target.run_module,
+            kwargs=planner.get_kwargs(),
+            **_get_result_options(invocation, isolated=False)
+        )
+        for invocation, planner in pairs
+    ]
+
+    try:
+        for recv in deps_recvs:
+            recv.get().unpickle()
+    except mitogen.core.CallError:
+        # The target may be blocked forever waiting for a file that will now
+        # never arrive.
+        connection.reset()
+        raise
+
+    return [chain._rethrow(recv) for recv in call_recvs]
+
+
+def _get_planner_for(invocation):
+    """
+    Resolve the module's path and return an instance of the matching Planner
+    subclass.
+
     :raises ansible.errors.AnsibleError:
         Unrecognized/unsupported module type.
     """
@@ -599,16 +796,58 @@ def invoke(invocation):
             module_source
         )
 
-    planner = _planner_by_path[invocation.module_path](invocation)
-    if invocation.wrap_async:
-        response = _invoke_async_task(invocation, planner)
-    elif planner.should_fork():
-        response = _invoke_isolated_task(invocation, planner)
-    else:
-        _propagate_deps(invocation, planner, invocation.connection.context)
-        response = invocation.connection.get_chain().call(
-            ansible_mitogen.target.run_module,
-            kwargs=planner.get_kwargs(),
-        )
+    return _planner_by_path[invocation.module_path](invocation)
+
+
+def invoke(invocation):
+    """
+    Find a Planner subclass corresponding to `invocation` and use it to invoke
+    the module.
 
-    return invocation.action._postprocess_response(response)
+    :param Invocation invocation:
+    :returns:
+        Module return dict.
+    :raises ansible.errors.AnsibleError:
+        Unrecognized/unsupported module type.
+    """
+    return invoke_batch([invocation])[0]
+
+
+def invoke_batch(invocations):
+    """
+    Like :func:`invoke`, but run several modules back to back against the
+    same connection. Consecutive invocations that run in the target's main
+    interpreter are pipelined, so only the last result of each run is waited
+    on. Modules are started regardless of earlier results, so the batch must
+    not depend on an earlier module succeeding.
+
+    :param list invocations:
+        :class:`Invocation` instances sharing one connection.
+    :returns:
+        List of module return dicts, in the order of `invocations`.
+    """
+    responses = []
+    pending = []
+    for invocation in invocations:
+        planner = _get_planner_for(invocation)
+        if not planner.should_fork():
+            pending.append((invocation, planner))
+            continue
+
+        if pending:
+            responses.extend(_invoke_pipelined(pending))
+            pending = []
+        if invocation.wrap_async:
+            responses.append(_invoke_async_task(invocation, planner))
+        else:
+            responses.append(_invoke_isolated_task(invocation, planner))
+
+    if pending:
+        responses.extend(_invoke_pipelined(pending))
+
+    return [
+        invocation.action._postprocess_response(
+            _decode_result(invocation, response)
+        )
+        for invocation, response in zip(invocations, responses)
+    ]
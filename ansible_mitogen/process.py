@@ -37,6 +37,7 @@ import resource
 import socket
 import signal
 import sys
+import zlib
 
 try:
     import faulthandler
@@ -53,6 +54,7 @@ import mitogen.core
 import mitogen.debug
 import mitogen.fork
 import mitogen.master
+import mitogen.minify
 import mitogen.parent
 import mitogen.service
 import mitogen.unix
@@ -173,10 +175,14 @@ def setup_pool(pool):
     Configure a connection multiplexer's :class:`mitogen.service.Pool` with
     services accessed by clients and WorkerProcesses.
     """
-    pool.add(mitogen.service.FileService(router=pool.router))
+    file_service = mitogen.service.FileService(router=pool.router)
+    file_service.zero_copy = getenv_int('MITOGEN_ZERO_COPY') > 0
+    pool.add(file_service)
     pool.add(mitogen.service.PushFileService(router=pool.router))
     pool.add(ansible_mitogen.services.ContextService(router=pool.router))
     pool.add(ansible_mitogen.services.ModuleDepService(pool.router))
+    pool.add(ansible_mitogen.services.AsyncJobService(pool.router))
+    pool.add(ansible_mitogen.services.FactsCacheService(pool.router))
     LOG.debug('Service pool configured: size=%d', pool.size)
 
 
@@ -293,6 +299,9 @@ def common_setup(enable_affinity=True, _init_logging=True):
     if MuxProcess.profiling:
         mitogen.core.enable_profiling()
 
+    # Shared by every MuxProcess, and by later runs.
+    mitogen.minify.cache_dir = os.environ.get('MITOGEN_MINIFY_CACHE_DIR')
+
     MuxProcess.cls_original_env = dict(os.environ)
     increase_open_file_limit()
 
@@ -391,6 +400,30 @@ class WorkerModel(object):
         """
         raise NotImplementedError()
 
+    def prewarm(self, stack_by_name, concurrency):
+        """
+        Called from the top-level process prior to strategy start to request
+        that connections described by `stack_by_name`, a dict mapping
+        inventory names to ContextService stacks, be established in the
+        background, with at most `concurrency` connection attempts in flight
+        per connection multiplexer. The default does nothing.
+        """
+
+    def assign(self, group_by_name):
+        """
+        Called from the top-level process prior to strategy start with a dict
+        mapping inventory names to a group key. Hosts sharing a group key, such
+        as those reached via the same ``mitogen_via`` host, must be placed on
+        the same connection multiplexer. The default does nothing.
+        """
+
+    def get_stats(self):
+        """
+        Return a list of dicts describing the load on each connection
+        multiplexer. The default returns an empty list.
+        """
+        return []
+
 
 class ClassicBinding(Binding):
     """
@@ -472,6 +505,12 @@ class ClassicWorkerModel(WorkerModel):
             MuxProcess(self, index)
             for index in range(get_cpu_count(default=1))
         ]
+        #: Mapping of inventory name -> multiplexer index, populated by
+        #: :meth:`assign` in the top-level process prior to each play, and
+        #: inherited by every WorkerProcess forked after it.
+        self._index_by_name = {}
+        #: Count of inventory names assigned to each multiplexer index.
+        self._count_by_index = [0] * len(self._muxes)
         for mux in self._muxes:
             mux.start()
 
@@ -482,13 +521,104 @@ class ClassicWorkerModel(WorkerModel):
     def _listener_for_name(self, name):
         """
         Given an inventory hostname, return the UNIX listener that should
-        communicate with it. This is a simple hash of the inventory name.
-        """
-        mux = self._muxes[abs(hash(name)) % len(self._muxes)]
+        communicate with it. Hosts placed by :meth:`assign` use their recorded
+        multiplexer, any other name falls back to a stable hash of the name.
+        """
+        index = self._index_by_name.get(name)
+        if index is None:
+            index = zlib.crc32(mitogen.core.to_text(name).encode('utf-8'))
+            index = (index & 0xffffffff) % len(self._muxes)
+        mux = self._muxes[index]
         LOG.debug('will use multiplexer %d (%s) to connect to "%s"',
                   mux.index, mux.path, name)
         return mux.path
 
+    def _call_muxes(self, method_name, kwargs_by_path):
+        """
+        From the top-level process, call a ContextService method on each
+        multiplexer whose listener path appears in `kwargs_by_path`, passing
+        the corresponding keyword arguments.
+
+        :returns:
+            Dict mapping listener path to the call's result.
+        """
+        if self.broker is None:
+            self.broker = Broker()
+
+        try:
+            result_by_path = {}
+            for path, kwargs in sorted(kwargs_by_path.items()):
+                if path != self.listener_path:
+                    self._reconnect(path)
+                result_by_path[path] = mitogen.service.call(
+                    call_context=self.parent,
+                    service_name='ansible_mitogen.services.ContextService',
+                    method_name=method_name,
+                    **kwargs
+                )
+            return result_by_path
+        finally:
+            self.on_binding_close()
+
+    def get_stats(self):
+        """
+        See WorkerModel.get_stats().
+        """
+        stats_by_path = self._call_muxes(
+            'get_stats', dict((mux.path, {}) for mux in self._muxes)
+        )
+        stats_list = []
+        for mux in self._muxes:
+            stats = stats_by_path[mux.path]
+            stats['index'] = mux.index
+            stats['hosts'] = self._count_by_index[mux.index]
+            stats_list.append(stats)
+        return stats_list
+
+    def assign(self, group_by_name):
+        """
+        See WorkerModel.assign().
+
+        Unplaced groups are handed out largest first, each to the multiplexer
+        with the lowest load, where load is the count of live contexts plus
+        hosts placed by this call, with routed bytes breaking ties. Hosts
+        already placed never move, since their multiplexer may hold their
+        cached interpreters.
+        """
+        members_by_group = {}
+        index_by_group = {}
+        for name, group in group_by_name.items():
+            index = self._index_by_name.get(name, self._index_by_name.get(group))
+            if index is not None:
+                # A member placed by an earlier play, or the via host itself,
+                # pins the whole group to its multiplexer.
+                index_by_group[group] = index
+            if name not in self._index_by_name:
+                members_by_group.setdefault(group, []).append(name)
+        if not members_by_group:
+            return
+
+        if len(self._muxes) > 1:
+            load = [
+                [stats['contexts'], stats['routed_bytes']]
+                for stats in self.get_stats()
+            ]
+        else:
+            load = [[0, 0]]
+
+        groups = sorted(members_by_group.items(),
+                        key=lambda item: (-len(item[1]), item[0]))
+        for group, names in groups:
+            index = index_by_group.get(group)
+            if index is None:
+                index = min(range(len(load)), key=lambda i: load[i])
+            if group not in self._index_by_name and group not in names:
+                names.append(group)
+            load[index][0] += len(names)
+            for name in names:
+                self._index_by_name[name] = index
+                self._count_by_index[index] += 1
+
     def _reconnect(self, path):
         if self.router is not None:
             # Router can just be overwritten, but the previous parent
@@ -577,6 +707,20 @@ class ClassicWorkerModel(WorkerModel):
 
         return ClassicBinding(self)
 
+    def prewarm(self, stack_by_name, concurrency):
+        """
+        See WorkerModel.prewarm().
+        """
+        kwargs_by_path = {}
+        for name, stack in stack_by_name.items():
+            kwargs = kwargs_by_path.setdefault(
+                self._listener_for_name(name),
+                {'stacks': [], 'concurrency': concurrency},
+            )
+            kwargs['stacks'].append(mitogen.utils.cast(stack))
+
+        self._call_muxes('prewarm', kwargs_by_path)
+
     def on_binding_close(self):
         if not self.broker:
             return
@@ -707,6 +851,15 @@ class MuxProcess(object):
             max_message_size=MAX_MESSAGE_SIZE,
         )
         _setup_responder(self.router.responder)
+        self._load_module_bundle()
+        self._load_module_profiles()
+        if getenv_int('MITOGEN_SHARED_MODULE_STORE'):
+            self.router.responder.enable_module_store()
+        if getenv_int('MITOGEN_SHIP_BYTECODE'):
+            self.router.responder.enable_bytecode()
+        if getenv_int('MITOGEN_PREFETCH_IMPORTS'):
+            self.router.responder.enable_prefetch()
+        self.router.lazy_imports = getenv_int('MITOGEN_LAZY_IMPORTS') > 0
         mitogen.core.listen(self.broker, 'shutdown', self._on_broker_shutdown)
         mitogen.core.listen(self.broker, 'exit', self._on_broker_exit)
         self.listener = mitogen.unix.Listener.build_stream(
@@ -717,6 +870,62 @@ class MuxProcess(object):
         self._enable_router_debug()
         self._enable_stack_dumps()
 
+    def _load_module_bundle(self):
+        """
+        Serve module responses from the bundle named by
+        ``MITOGEN_MODULE_BUNDLE``, if it exists.
+        """
+        self.bundle_path = os.environ.get('MITOGEN_MODULE_BUNDLE')
+        if self.bundle_path and os.path.exists(self.bundle_path):
+            try:
+                self.router.responder.load_bundle(self.bundle_path)
+            except Exception:
+                LOG.warning('Could not load module bundle %r: %s',
+                            self.bundle_path, sys.exc_info()[1])
+
+    def _save_module_bundle(self):
+        """
+        Merge every module served during this run into the bundle named by
+        ``MITOGEN_MODULE_BUNDLE``, if any were missing from it or stale.
+        """
+        responder = self.router.responder
+        if not (self.bundle_path and responder.good_load_module_count):
+            return
+        if responder.bundle_hit_count and not responder.bundle_miss_count:
+            return  # Bundle was loaded and complete.
+        try:
+            responder.save_bundle(self.bundle_path)
+        except Exception:
+            LOG.warning('Could not save module bundle %r: %s',
+                        self.bundle_path, sys.exc_info()[1])
+
+    def _load_module_profiles(self):
+        """
+        Forward modules recorded in the profile file named by
+        ``MITOGEN_MODULE_PROFILE`` to new targets, if it exists.
+        """
+        self.profile_path = os.environ.get('MITOGEN_MODULE_PROFILE')
+        if self.profile_path and os.path.exists(self.profile_path):
+            try:
+                self.router.responder.load_profiles(self.profile_path)
+            except Exception:
+                LOG.warning('Could not load module profiles %r: %s',
+                            self.profile_path, sys.exc_info()[1])
+
+    def _save_module_profiles(self):
+        """
+        Merge the modules targets requested during this run into the profile
+        file named by ``MITOGEN_MODULE_PROFILE``.
+        """
+        responder = self.router.responder
+        if not (self.profile_path and responder.get_module_count):
+            return
+        try:
+            responder.save_profiles(self.profile_path)
+        except Exception:
+            LOG.warning('Could not save module profiles %r: %s',
+                        self.profile_path, sys.exc_info()[1])
+
     def _setup_services(self):
         """
         Construct a ContextService and a thread to service requests for it
@@ -745,3 +954,5 @@ class MuxProcess(object):
         begins.
         """
         self.pool.join()
+        self._save_module_bundle()
+        self._save_module_profiles()
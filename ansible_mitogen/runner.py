@@ -47,6 +47,7 @@ import shlex
 import shutil
 import sys
 import tempfile
+import time
 import traceback
 import types
 
@@ -127,23 +128,44 @@ class TempFileWatcher(object):
     :func:`tempfile.mkstemp` (ansible/ansible#57327). Handle this and all
     similar cases by recording descriptors produced by mkstemp during module
     execution, and cleaning up any leaked descriptors on completion.
+
+    Only descriptors created by the thread running the module are recorded,
+    since other threads in the target (e.g. file transfers) may use mkstemp
+    concurrently and still hold their descriptors when the run completes.
     """
     def __init__(self):
         self._real_mkstemp = tempfile.mkstemp
         # (fd, st.st_dev, st.st_ino)
         self._fd_dev_inode = []
+        self.watch()
         tempfile.mkstemp = self._wrap_mkstemp
 
+    def watch(self):
+        """
+        Record descriptors created by the calling thread until :meth:`check`.
+        """
+        self._thread = mitogen.core.threading__current_thread()
+
     def _wrap_mkstemp(self, *args, **kwargs):
         fd, path = self._real_mkstemp(*args, **kwargs)
-        st = os.fstat(fd)
-        self._fd_dev_inode.append((fd, st.st_dev, st.st_ino))
+        if mitogen.core.threading__current_thread() is self._thread:
+            st = os.fstat(fd)
+            self._fd_dev_inode.append((fd, st.st_dev, st.st_ino))
         return fd, path
 
     def revert(self):
         tempfile.mkstemp = self._real_mkstemp
+        self.check()
+
+    def check(self):
+        """
+        Close any descriptors leaked by the last run, forget them, and stop
+        recording until :meth:`watch` is called again.
+        """
+        self._thread = None
         for tup in self._fd_dev_inode:
             self._revert_one(*tup)
+        del self._fd_dev_inode[:]
 
     def _revert_one(self, fd, st_dev, st_ino):
         try:
@@ -273,6 +295,30 @@ _pam_env_watcher = EnvironmentFileWatcher('~/.pam_environment')
 _etc_env_watcher = EnvironmentFileWatcher('/etc/environment')
 
 
+class PhaseTimer(object):
+    """
+    Record the time taken by each phase of a runner invocation, for logging
+    once it completes.
+    """
+    def __init__(self):
+        self.phases = []
+        self._last = time.time()
+
+    def mark(self, name):
+        """
+        Record the time since the last call as the duration of phase `name`.
+        """
+        now = time.time()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def format(self):
+        return ', '.join([
+            '%s=%.2fms' % (name, 1000 * secs)
+            for name, secs in self.phases
+        ])
+
+
 def utf8(s):
     """
     Coerce an object to bytes if it is Unicode.
@@ -349,6 +395,8 @@ class Runner(object):
         #: directory for this run, because we're in an asynchronous task, or
         #: because the originating action did not create a directory.
         self._temp_dir = None
+        #: Time spent in each phase of :meth:`run`, logged on completion.
+        self.timer = PhaseTimer()
 
     def get_temp_dir(self):
         path = self.args.get('_ansible_tmpdir')
@@ -376,6 +424,7 @@ class Runner(object):
         """
         self._setup_cwd()
         self._setup_environ()
+        self.timer.mark('environ')
 
     def _setup_cwd(self):
         """
@@ -445,9 +494,14 @@ class Runner(object):
             self.econtext.detach()
 
         try:
-            return self._run()
+            try:
+                return self._run()
+            finally:
+                self.timer.mark('run')
+                self.revert()
         finally:
-            self.revert()
+            self.timer.mark('revert')
+            LOG.debug('%r: phase timings: %s', self, self.timer.format())
 
 
 class AtExitWrapper(object):
@@ -505,13 +559,26 @@ class ModuleUtilsImporter(object):
         List of `(fullname, path, is_pkg)` tuples.
     """
     def __init__(self, context, module_utils):
-        self._context = context
-        self._by_fullname = dict(
+        self._by_fullname = {}
+        self._loaded = set()
+        self.update(context, module_utils)
+        sys.meta_path.insert(0, self)
+
+    def update(self, context, module_utils):
+        """
+        Replace the module map of a recycled importer, discarding any
+        previously loaded module whose source path changed in the new map.
+        """
+        by_fullname = dict(
             (fullname, (path, is_pkg))
             for fullname, path, is_pkg in module_utils
         )
-        self._loaded = set()
-        sys.meta_path.insert(0, self)
+        for fullname in list(self._loaded):
+            if by_fullname.get(fullname) != self._by_fullname.get(fullname):
+                sys.modules.pop(fullname, None)
+                self._loaded.discard(fullname)
+        self._context = context
+        self._by_fullname = by_fullname
 
     def revert(self):
         sys.meta_path.remove(self)
@@ -561,9 +628,16 @@ class TemporaryEnvironment(object):
         Revert changes made by the module to the process environment. This must
         always run, as some modules (e.g. git.py) set variables like GIT_SSH
         that must be cleared out between runs.
+
+        Only keys that differ from the snapshot are touched, avoiding a
+        putenv() for every variable after each run.
         """
-        os.environ.clear()
-        os.environ.update(self.original)
+        for key in list(os.environ):
+            if key not in self.original:
+                del os.environ[key]
+        for key, value in iteritems(self.original):
+            if os.environ.get(key) != value:
+                os.environ[key] = value
 
 
 class TemporaryArgv(object):
@@ -625,6 +699,7 @@ class ProgramRunner(Runner):
     def setup(self):
         super(ProgramRunner, self).setup()
         self._setup_program()
+        self.timer.mark('program')
 
     def _get_program_filename(self):
         """
@@ -798,18 +873,91 @@ class ScriptRunner(ProgramRunner):
         return b('\n').join(new)
 
 
+class RecycledHooks(object):
+    """
+    Process hooks kept installed between :class:`NewStyleRunner` invocations
+    when recycling is enabled, so each run only resets state the previous run
+    actually changed, rather than tearing down and reinstalling every hook.
+
+    :class:`NewStyleStdio`, :class:`TemporaryArgv`,
+    :class:`TemporaryEnvironment` and :class:`AtExitWrapper` are still
+    installed and reverted for every run: each holds that run's arguments,
+    environment or deferred callbacks, and leaving them installed would
+    redirect the stdio, argv, environment and atexit handlers of everything
+    else the target runs between tasks. Each costs only a few attribute
+    assignments.
+    """
+    resolv_conf_path = '/etc/resolv.conf'
+
+    def __init__(self):
+        self.temp_watcher = None
+        self.importer = None
+        self._resolv_conf_stat = None
+
+    def _stat_resolv_conf(self):
+        try:
+            st = os.stat(self.resolv_conf_path)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+    def get_temp_watcher(self):
+        """
+        Return the shared :class:`TempFileWatcher`, after closing any
+        descriptors leaked by the previous run, recording descriptors created
+        by the calling thread.
+        """
+        if self.temp_watcher is None:
+            self.temp_watcher = TempFileWatcher()
+        else:
+            self.temp_watcher.check()
+            self.temp_watcher.watch()
+        return self.temp_watcher
+
+    def get_importer(self, context, module_utils):
+        """
+        Return the shared :class:`ModuleUtilsImporter`, updated to reflect
+        `module_utils`.
+        """
+        if self.importer is None:
+            self.importer = ModuleUtilsImporter(context, module_utils)
+        else:
+            self.importer.update(context, module_utils)
+        return self.importer
+
+    def res_init(self):
+        """
+        Reload resolver configuration only when :attr:`resolv_conf_path`
+        changed since the last run.
+        """
+        st = self._stat_resolv_conf()
+        if st != self._resolv_conf_stat:
+            self._resolv_conf_stat = st
+            if libc__res_init:
+                libc__res_init()
+
+
+_recycled_hooks = RecycledHooks()
+
+
 class NewStyleRunner(ScriptRunner):
     """
     Execute a new-style Ansible module, where Module Replacer-related tricks
     aren't required.
+
+    :param bool recycle:
+        If :data:`True`, reuse hooks installed by a previous run in this
+        process via :class:`RecycledHooks`, rather than installing and
+        reverting them for every run.
     """
     #: path => new-style module bytecode.
     _code_by_path = {}
 
-    def __init__(self, module_map, py_module_name, **kwargs):
+    def __init__(self, module_map, py_module_name, recycle=False, **kwargs):
         super(NewStyleRunner, self).__init__(**kwargs)
         self.module_map = module_map
         self.py_module_name = py_module_name
+        self.recycle = recycle
 
     def _setup_imports(self):
         """
@@ -858,23 +1006,38 @@ class NewStyleRunner(ScriptRunner):
         # module, but this has never been a bug report. Instead act like an
         # interpreter that had its script piped on stdin.
         self._argv = TemporaryArgv([''])
-        self._temp_watcher = TempFileWatcher()
-        self._importer = ModuleUtilsImporter(
-            context=self.service_context,
-            module_utils=self.module_map['custom'],
-        )
+        if self.recycle:
+            self._temp_watcher = _recycled_hooks.get_temp_watcher()
+            self._importer = _recycled_hooks.get_importer(
+                context=self.service_context,
+                module_utils=self.module_map['custom'],
+            )
+        else:
+            self._temp_watcher = TempFileWatcher()
+            self._importer = ModuleUtilsImporter(
+                context=self.service_context,
+                module_utils=self.module_map['custom'],
+            )
+        self.timer.mark('stdio')
         self._setup_imports()
+        self.timer.mark('imports')
         self._setup_excepthook()
         self.atexit_wrapper = AtExitWrapper()
-        if libc__res_init:
+        if self.recycle:
+            _recycled_hooks.res_init()
+        elif libc__res_init:
             libc__res_init()
+        self.timer.mark('hooks')
 
     def _revert_excepthook(self):
         sys.excepthook = self.original_excepthook
 
     def revert(self):
         self.atexit_wrapper.revert()
-        self._temp_watcher.revert()
+        if self.recycle:
+            self._temp_watcher.check()
+        else:
+            self._temp_watcher.revert()
         self._argv.revert()
         self._stdio.revert()
         self._revert_excepthook()
@@ -43,10 +43,13 @@ from __future__ import absolute_import, division, print_function
 from __future__ import unicode_literals
 __metaclass__ = type
 
+import collections
+import json
 import logging
 import os
 import sys
 import threading
+import zlib
 
 import ansible.constants
 
@@ -317,6 +320,30 @@ class ContextService(mitogen.service.Service):
                                        key=lambda c_k: c_k[0].context_id)
         ]
 
+    @mitogen.service.expose(mitogen.service.AllowParents())
+    def get_stats(self):
+        """
+        Return a dict describing the load on this connection multiplexer, used
+        by :class:`ansible_mitogen.process.ClassicWorkerModel` to place new
+        hosts, and logged to help spot a saturated multiplexer.
+
+        :returns dict:
+            * pid: multiplexer process ID.
+            * contexts: count of currently connected contexts.
+            * refs: sum of reference counts held by workers.
+            * routed_bytes: total message bytes routed by the multiplexer.
+        """
+        self._lock.acquire()
+        try:
+            return {
+                'pid': os.getpid(),
+                'contexts': len(self._key_by_context),
+                'refs': sum(self._refs_by_context.values()),
+                'routed_bytes': self.router.routed_bytes,
+            }
+        finally:
+            self._lock.release()
+
     @mitogen.service.expose(mitogen.service.AllowParents())
     def shutdown_all(self):
         """
@@ -352,9 +379,18 @@ class ContextService(mitogen.service.Service):
         'mitogen.service',
     )
 
-    def _send_module_forwards(self, context):
-        if hasattr(self.router.responder, 'forward_modules'):
-            self.router.responder.forward_modules(context, self.ALWAYS_PRELOAD)
+    def _send_module_forwards(self, context, spec):
+        responder = self.router.responder
+        if hasattr(responder, 'forward_modules'):
+            responder.forward_modules(context, self.ALWAYS_PRELOAD)
+        if (os.environ.get('MITOGEN_MODULE_PROFILE') and
+                hasattr(responder, 'profile_context')):
+            # Targets on the same interpreter import much the same modules.
+            python_path = spec['kwargs'].get('python_path') or ()
+            responder.profile_context(
+                context,
+                u'ansible_mitogen.target %s' % (u' '.join(python_path),),
+            )
 
     _candidate_temp_dirs = None
 
@@ -410,7 +446,7 @@ class ContextService(mitogen.service.Service):
         mitogen.core.listen(context, 'disconnect',
             lambda: self._on_context_disconnect(context))
 
-        self._send_module_forwards(context)
+        self._send_module_forwards(context, spec)
         init_child_result = context.call(
             ansible_mitogen.target.init_child,
             log_level=LOG.getEffectiveLevel(),
@@ -511,6 +547,71 @@ class ContextService(mitogen.service.Service):
 
         return result
 
+    def _prewarm_main(self, latch):
+        """
+        Prewarm thread body: pop stacks from `latch` until it is empty,
+        establishing each connection and immediately returning its reference,
+        leaving the context cached for a later :meth:`get`.
+        """
+        while True:
+            try:
+                stack = latch.get(block=False)
+            except mitogen.core.TimeoutError:
+                return
+
+            try:
+                result = self.get(stack)
+            except Exception:
+                LOG.debug('%r: prewarm of %r failed', self, stack,
+                          exc_info=True)
+                continue
+
+            if result['context'] is None:
+                LOG.debug('%r: prewarm of %r failed: %s',
+                          self, stack, result['msg'])
+                continue
+
+            self.put(result['context'])
+
+    @mitogen.service.expose(mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'stacks': list,
+        'concurrency': int,
+    })
+    def prewarm(self, stacks, concurrency):
+        """
+        Speculatively establish connections in the background, so that the
+        first task to run against each target finds its context already
+        cached. Returns immediately, before any connection has been attempted.
+
+        :param list stacks:
+            List of stacks, each in the form accepted by :meth:`get`.
+        :param int concurrency:
+            Maximum number of connection attempts to run in parallel. Each
+            prewarm thread blocks for the duration of its attempt, and
+            duplicate requests from task workers are absorbed by the usual
+            :meth:`get` deduplication.
+        :returns:
+            Number of threads started.
+        """
+        latch = mitogen.core.Latch()
+        for stack in stacks:
+            latch.put(stack)
+
+        count = min(concurrency, len(stacks))
+        for x in range(count):
+            thread = threading.Thread(
+                name='ContextService.prewarm.%d' % (x,),
+                target=self._prewarm_main,
+                args=(latch,),
+            )
+            thread.setDaemon(True)
+            thread.start()
+
+        LOG.debug('%r: prewarming %d stacks using %d threads',
+                  self, len(stacks), count)
+        return count
+
 
 class ModuleDepService(mitogen.service.Service):
     """
@@ -563,3 +664,189 @@ class ModuleDepService(mitogen.service.Service):
                 'custom': custom,
             }
         return self._cache[key]
+
+
+class AsyncJobService(mitogen.service.Service):
+    """
+    Record the results of asynchronous tasks as
+    :class:`ansible_mitogen.target.AsyncRunner` pushes them on completion, so
+    ``async_status`` can be answered without a round trip to the target to
+    read the job file.
+    """
+    #: Number of finished job results retained, the oldest being discarded
+    #: first. A discarded job is answered by reading its job file as usual.
+    max_finished = 4096
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncJobService, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        #: Mapping of job ID -> result dict, or :data:`None` while running.
+        self._result_by_job_id = {}
+        #: Finished job IDs, oldest first.
+        self._finished = collections.deque()
+
+    def _on_result(self, job_id, context, msg):
+        """
+        Respond to a result pushed by the job, or to `context` disconnecting
+        before it did, by recording the result or forgetting the job.
+        """
+        result = None
+        if not msg.is_dead:
+            try:
+                result = msg.unpickle()
+            except Exception:
+                LOG.exception('%r: bad result for job %r from %r',
+                              self, job_id, context)
+
+        self._lock.acquire()
+        try:
+            if not isinstance(result, dict):
+                LOG.debug('%r: job %r lost with %r', self, job_id, context)
+                self._result_by_job_id.pop(job_id, None)
+                return
+            self._result_by_job_id[job_id] = result
+            self._finished.append(job_id)
+            while len(self._finished) > self.max_finished:
+                self._result_by_job_id.pop(self._finished.popleft(), None)
+        finally:
+            self._lock.release()
+
+    @mitogen.service.expose(policy=mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'job_id': mitogen.core.UnicodeType,
+        'context': mitogen.core.Context,
+    })
+    def register(self, job_id, context):
+        """
+        Begin tracking a job about to start in `context`.
+
+        :returns:
+            :class:`mitogen.core.Sender` the job should send its final status
+            dict to. If `context` disconnects first, the job is forgotten.
+        """
+        self._lock.acquire()
+        try:
+            self._result_by_job_id[job_id] = None
+        finally:
+            self._lock.release()
+
+        handle = self.router.add_handler(
+            fn=lambda msg: self._on_result(job_id, context, msg),
+            persist=False,
+            respondent=context,
+        )
+        return mitogen.core.Sender(self.router.myself(), handle)
+
+    @mitogen.service.expose(policy=mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'job_id': mitogen.core.UnicodeType,
+    })
+    def get(self, job_id):
+        """
+        Return the status of a job.
+
+        :returns:
+            :data:`None` if the job is unknown or its context was lost,
+            otherwise a dict with a `finished` key, and when `finished` is
+            :data:`True`, a `result` key containing the job's final status.
+        """
+        self._lock.acquire()
+        try:
+            if job_id not in self._result_by_job_id:
+                return None
+            result = self._result_by_job_id[job_id]
+        finally:
+            self._lock.release()
+
+        if result is None:
+            return {'finished': False}
+        return {'finished': True, 'result': result}
+
+    @mitogen.service.expose(policy=mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'job_id': mitogen.core.UnicodeType,
+    })
+    def forget(self, job_id):
+        """
+        Stop tracking a job, as when ``async_status`` cleans it up.
+        """
+        self._lock.acquire()
+        try:
+            if self._result_by_job_id.pop(job_id, None) is not None:
+                self._finished.remove(job_id)
+        finally:
+            self._lock.release()
+
+
+class FactsCacheService(mitogen.service.Service):
+    """
+    Remember the most recent ``ansible_facts`` returned for each inventory
+    host, so :func:`ansible_mitogen.target.run_module` may return only the
+    facts that changed since. Facts are keyed by the digest the target
+    computed, so a stale or missing entry, such as one recorded by another
+    context of the same host, simply causes the target to send every fact
+    again.
+
+    A delta can only be applied to the full facts it was computed against, so
+    the facts themselves must be kept, but they are held as compressed JSON:
+    about 4 KiB for a typical Linux host, rather than 60 KiB as a dict. One
+    entry is kept per host assigned to this multiplexer, so the cache grows
+    with the inventory rather than with the number of contexts.
+    """
+    def __init__(self, *args, **kwargs):
+        super(FactsCacheService, self).__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        #: Mapping of inventory hostname -> (digest, zlib-compressed JSON
+        #: facts).
+        self._entry_by_host = {}
+
+    def _get_entry(self, host):
+        self._lock.acquire()
+        try:
+            return self._entry_by_host.get(host)
+        finally:
+            self._lock.release()
+
+    @mitogen.service.expose(policy=mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'host': mitogen.core.UnicodeType,
+    })
+    def get_digest(self, host):
+        """
+        Return the digest of the facts held for inventory hostname `host`, or
+        :data:`None`.
+        """
+        entry = self._get_entry(host)
+        if entry is not None:
+            return entry[0]
+
+    @mitogen.service.expose(policy=mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'host': mitogen.core.UnicodeType,
+        'digest': mitogen.core.UnicodeType,
+    })
+    def get(self, host, digest):
+        """
+        Return the facts held for inventory hostname `host`, or :data:`None`
+        if they are absent or their digest is not `digest`.
+        """
+        entry = self._get_entry(host)
+        if entry is not None and entry[0] == digest:
+            return json.loads(zlib.decompress(entry[1]).decode('utf-8'))
+
+    @mitogen.service.expose(policy=mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'host': mitogen.core.UnicodeType,
+        'digest': mitogen.core.UnicodeType,
+        'facts': dict,
+    })
+    def put(self, host, digest, facts):
+        """
+        Replace the facts held for inventory hostname `host`.
+        """
+        encoded = zlib.compress(json.dumps(facts).encode('utf-8'))
+        self._lock.acquire()
+        try:
+            self._entry_by_host[host] = (digest, encoded)
+        finally:
+            self._lock.release()
@@ -29,6 +29,7 @@
 from __future__ import absolute_import, division, print_function
 __metaclass__ = type
 
+import logging
 import os
 import signal
 import threading
@@ -40,14 +41,37 @@ except ImportError:
 
 import mitogen.core
 import ansible_mitogen.affinity
+import ansible_mitogen.connection
 import ansible_mitogen.loaders
 import ansible_mitogen.mixins
 import ansible_mitogen.process
 
+import ansible.constants as C
 import ansible.executor.process.worker
+import ansible.playbook.task
+import ansible.template
 import ansible.utils.sentinel
 
 
+LOG = logging.getLogger(__name__)
+
+#: If set to a positive integer, before each play the top-level process asks
+#: every connection multiplexer to begin connecting to play hosts using up to
+#: this many parallel connection attempts, so the first task finds its
+#: interpreters already running.
+PREWARM_CONCURRENCY = ansible_mitogen.process.getenv_int(
+    'MITOGEN_PREWARM_CONNECTIONS', 0
+)
+
+#: If set to a positive integer, before each play the top-level process places
+#: play hosts on connection multiplexers by load, keeping hosts that share a
+#: ``mitogen_via`` host together. This computes variables for every play host,
+#: so by default hosts are placed by a hash of their name instead.
+ASSIGN_MULTIPLEXERS = ansible_mitogen.process.getenv_int(
+    'MITOGEN_ASSIGN_MULTIPLEXERS', 0
+)
+
+
 def _patch_awx_callback():
     """
     issue #400: AWX loads a display callback that suffers from thread-safety
@@ -150,6 +174,77 @@ def wrap_worker__run(self):
     )
 
 
+#: ansible_python_interpreter values that request interpreter discovery.
+DISCOVERY_MODES = ('auto', 'auto_legacy', 'auto_silent', 'auto_legacy_silent')
+
+
+def _via_root(task_vars):
+    """
+    Return the inventory name of the first hop of the ``mitogen_via`` chain
+    described by `task_vars`, i.e. the host the controller connects to
+    directly, or :data:`None` if the host is connected to directly.
+    """
+    name = None
+    host_vars = task_vars
+    seen = set()
+    while host_vars is not None:
+        via = host_vars.get('mitogen_via')
+        if not via:
+            break
+
+        _, _, via_name = via.rpartition('@')
+        if via_name in seen:
+            break
+        seen.add(via_name)
+        name = via_name
+        host_vars = task_vars['hostvars'].get(via_name)
+
+    return name
+
+
+def _needs_interpreter_discovery(task_vars):
+    """
+    Return :data:`True` if building the connection stack for `task_vars`
+    would run interpreter discovery, either for the target or any of its
+    ``mitogen_via=`` hops. Discovery is never run from the top-level process.
+    """
+    facts = task_vars.get('ansible_facts') or {}
+    if 'discovered_interpreter_python' in facts:
+        return False
+
+    host_vars = task_vars
+    seen = set()
+    while host_vars is not None:
+        s = host_vars.get('ansible_python_interpreter')
+        if (not s) or s in DISCOVERY_MODES:
+            return True
+
+        via = host_vars.get('mitogen_via')
+        if not via:
+            return False
+
+        _, _, name = via.rpartition('@')
+        if name in seen:
+            return True
+        seen.add(name)
+        host_vars = task_vars['hostvars'].get(name)
+
+    return True
+
+
+def _strip_become(stack):
+    """
+    Return the connection `stack` of a become task without its final become
+    hop, leaving the login stack. The hop is absent when the become user is
+    the login user, unless ``BECOME_ALLOW_SAME_USER`` is set, and a stack of
+    one hop is a login using a become method such as ``mitogen_sudo``.
+    """
+    if len(stack) > 1 and stack[-1]['method'] in \
+            ansible_mitogen.connection.Connection.become_methods:
+        return stack[:-1]
+    return stack
+
+
 class AnsibleWrappers(object):
     """
     Manage add/removal of various Ansible runtime hooks.
@@ -303,6 +398,128 @@ class StrategyMixin(object):
         """
         return ansible_mitogen.process.get_classic_worker_model()
 
+    def _assign_multiplexers(self, iterator):
+        """
+        When :data:`ASSIGN_MULTIPLEXERS` is set, tell the worker model about
+        the play's hosts before any task runs, so hosts sharing a
+        ``mitogen_via`` host land on the same connection multiplexer, and new
+        hosts are spread by load rather than name.
+        """
+        if ASSIGN_MULTIPLEXERS <= 0:
+            return
+
+        group_by_name = {}
+        hosts = self._inventory.get_hosts(iterator._play.hosts,
+                                          order=iterator._play.order)
+        for host in hosts:
+            task_vars = self._variable_manager.get_vars(
+                play=iterator._play,
+                host=host,
+            )
+            group_by_name[host.name] = _via_root(task_vars) or host.name
+
+        self._worker_model.assign(group_by_name)
+
+    def _log_multiplexer_stats(self):
+        """
+        At the end of each play, when :data:`ASSIGN_MULTIPLEXERS` is set and
+        debug logging is enabled, log the load on each connection multiplexer.
+        """
+        if ASSIGN_MULTIPLEXERS <= 0 or not LOG.isEnabledFor(logging.DEBUG):
+            return
+
+        for stats in self._worker_model.get_stats():
+            LOG.debug('multiplexer %(index)d PID %(pid)d: %(hosts)d hosts, '
+                      '%(contexts)d contexts, %(refs)d refs, '
+                      '%(routed_bytes)d bytes routed', stats)
+
+    def _get_prewarm_stack(self, iterator, play_context, host):
+        """
+        Build the login stack for `host` the same way a task's connection
+        would, or return :data:`None` if the host does not use a Mitogen
+        connection, or its stack cannot be known without running interpreter
+        discovery.
+        """
+        task = ansible.playbook.task.Task()
+        task_vars = self._variable_manager.get_vars(
+            play=iterator._play,
+            host=host,
+            task=task,
+        )
+        templar = ansible.template.Templar(loader=self._loader,
+                                           variables=task_vars)
+        play_context = play_context.set_task_and_variable_override(
+            task=task,
+            variables=task_vars,
+            templar=templar,
+        )
+        play_context.post_validate(templar=templar)
+        if not play_context.remote_addr:
+            play_context.remote_addr = host.address
+        play_context.update_vars(task_vars)
+
+        if _needs_interpreter_discovery(task_vars):
+            return None
+
+        name = play_context.connection
+        if name is ansible.utils.sentinel.Sentinel:
+            name = C.DEFAULT_TRANSPORT
+        if name == 'smart':
+            name = 'ssh'
+
+        connection = ansible_mitogen.loaders.connection_loader.get(
+            name, play_context, os.devnull
+        )
+        if not isinstance(connection, ansible_mitogen.connection.Connection):
+            return None
+
+        # As in Connection.reset(), a placeholder action satisfies
+        # parse_python_path(); discovery was ruled out above.
+        connection._action = ansible_mitogen.mixins.ActionModuleMixin(
+            task=0,
+            connection=connection,
+            play_context=play_context,
+            loader=0,
+            templar=0,
+            shared_loader_obj=0
+        )
+        connection.templar = templar
+        connection.on_action_run(
+            task_vars=task_vars,
+            delegate_to_hostname=None,
+            loader_basedir=None,
+        )
+        _, stack = connection._build_stack()
+        if play_context.become:
+            stack = _strip_become(stack)
+        return stack
+
+    def _prewarm_connections(self, iterator, play_context):
+        """
+        When :data:`PREWARM_CONCURRENCY` is set, ask the worker model to begin
+        establishing connections to every host of the play. This is
+        purely speculative: any host whose stack cannot be built is skipped,
+        and failed attempts are only logged by the multiplexer, leaving the
+        first task to report the error as usual.
+        """
+        if PREWARM_CONCURRENCY <= 0:
+            return
+
+        stack_by_name = {}
+        hosts = self._inventory.get_hosts(iterator._play.hosts,
+                                          order=iterator._play.order)
+        for host in hosts:
+            try:
+                stack = self._get_prewarm_stack(iterator, play_context, host)
+            except Exception:
+                LOG.debug('cannot prewarm %r', host.name, exc_info=True)
+                continue
+            if stack:
+                stack_by_name[host.name] = stack
+
+        if stack_by_name:
+            self._worker_model.prewarm(stack_by_name, PREWARM_CONCURRENCY)
+
     def run(self, iterator, play_context, result=0):
         """
         Wrap :meth:`run` to ensure requisite infrastructure and modifications
@@ -316,10 +533,14 @@ class StrategyMixin(object):
             try:
                 wrappers.install()
                 try:
+                    self._assign_multiplexers(iterator)
+                    self._prewarm_connections(iterator, play_context)
                     run = super(StrategyMixin, self).run
-                    return mitogen.core._profile_hook('Strategy',
+                    result = mitogen.core._profile_hook('Strategy',
                         lambda: run(iterator, play_context)
                     )
+                    self._log_multiplexer_stats()
+                    return result
                 finally:
                     wrappers.remove()
             finally:
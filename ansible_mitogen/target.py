@@ -42,13 +42,17 @@ import operator
 import os
 import pwd
 import re
+import shutil
 import signal
 import stat
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import traceback
 import types
+import zlib
 
 # Absolute imports for <2.5.
 logging = __import__('logging')
@@ -58,6 +62,11 @@ import mitogen.parent
 import mitogen.service
 from mitogen.core import b
 
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
 try:
     import json
 except ImportError:
@@ -100,6 +109,10 @@ MAKE_TEMP_FAILED_MSG = (
     u"Please check '-vvv' output for a log of individual path errors."
 )
 
+#: Bytes of command output exec_args_streaming() sends before waiting for the
+#: receiver to acknowledge some of it.
+STREAM_WINDOW_SIZE = 1048576
+
 # Python 2.4/2.5 cannot support fork+threads whatsoever, it doesn't even fix up
 # interpreter state. So 2.4/2.5 interpreters start .local() contexts for
 # isolation instead. Since we don't have any crazy memory sharing problems to
@@ -116,6 +129,12 @@ _fork_parent = None
 #: temporary directory accessible by the active user account.
 good_temp_dir = None
 
+#: SHA-1 hex digest and content of the ``ansible_facts`` most recently
+#: returned by :func:`run_module` with `facts_delta` enabled, forming the base
+#: of the next delta.
+_facts_digest = None
+_facts = None
+
 
 def subprocess__Popen__close_fds(self, but):
     """
@@ -173,7 +192,33 @@ def get_small_file(context, path):
     return service.get(path)
 
 
-def transfer_file(context, in_path, out_path, sync=False, set_owner=False):
+def _get_partial_path(out_path):
+    """
+    Return the path an interrupted resumable transfer to `out_path` keeps its
+    partial output at.
+    """
+    dirname, basename = os.path.split(out_path)
+    name = sha1(mitogen.core.to_text(basename).encode('utf-8')).hexdigest()
+    return os.path.join(dirname, '.ansible_mitogen_transfer-%s.partial' % (
+        name[:16],
+    ))
+
+
+def _claim_partial(partial_path, tmp_path):
+    """
+    Move any partial output of an interrupted transfer at `partial_path` over
+    `tmp_path`, returning its size, or 0 if there was none.
+    """
+    try:
+        os.rename(partial_path, tmp_path)
+    except OSError:
+        # Absent, or claimed by a concurrent transfer.
+        return 0
+    return os.path.getsize(tmp_path)
+
+
+def transfer_file(context, in_path, out_path, sync=False, set_owner=False,
+                  relay_ids=None, resumable=False, base_path=None):
     """
     Streamily download a file from the connection multiplexer process in the
     controller.
@@ -193,13 +238,52 @@ def transfer_file(context, in_path, out_path, sync=False, set_owner=False):
     :param bool set_owner:
         If :data:`True`, look up the metadata username and group on the local
         system and file the file owner using :func:`os.fchmod`.
+    :param list relay_ids:
+        If not empty, IDs of contexts between this one and `context`, nearest
+        first, that should cache the file on disk and relay it, so each link
+        carries it once however many targets below it request it.
+    :param bool resumable:
+        If :data:`True` and `relay_ids` is empty, output of an interrupted
+        transfer is kept next to `out_path`, and a later transfer to
+        `out_path` resumes from it, after verifying its content against the
+        start of the file.
+    :param bytes base_path:
+        If not :data:`None` and `relay_ids` is empty, path of an existing
+        file likely to resemble the new content, such as `out_path` itself,
+        or the destination of a file staged at `out_path`. Both copies are
+        hashed, and only blocks differing from it are transferred. When
+        `base_path` is `out_path` and its content is identical, it is left in
+        place and only its metadata is updated.
     """
     out_path = os.path.abspath(out_path)
     fd, tmp_path = tempfile.mkstemp(suffix='.tmp',
                                     prefix='.ansible_mitogen_transfer-',
                                     dir=os.path.dirname(out_path))
-    fp = os.fdopen(fd, 'wb', mitogen.core.CHUNK_SIZE)
-    LOG.debug('transfer_file(%r) temporary file: %s', out_path, tmp_path)
+    partial_path = None
+    offset = 0
+    if resumable and not relay_ids:
+        partial_path = _get_partial_path(out_path)
+        offset = _claim_partial(partial_path, tmp_path)
+
+    if offset:
+        os.close(fd)
+        fp = open(tmp_path, 'r+b', mitogen.core.CHUNK_SIZE)
+        LOG.debug('transfer_file(%r): resuming from %d bytes in %s',
+                  out_path, offset, tmp_path)
+    else:
+        fp = os.fdopen(fd, 'wb', mitogen.core.CHUNK_SIZE)
+        LOG.debug('transfer_file(%r) temporary file: %s', out_path, tmp_path)
+
+    base_fp = None
+    if base_path is not None:
+        base_path = os.path.abspath(base_path)
+    if base_path and (not relay_ids) and (not offset) and \
+            os.path.isfile(base_path):
+        try:
+            base_fp = open(base_path, 'rb', mitogen.core.CHUNK_SIZE)
+        except (IOError, OSError):
+            LOG.debug('transfer_file(%r): cannot read %r, sending the file '
+                      'in full', out_path, base_path)
 
     try:
         try:
@@ -207,22 +291,48 @@ def transfer_file(context, in_path, out_path, sync=False, set_owner=False):
                 context=context,
                 path=in_path,
                 out_fp=fp,
+                base_fp=base_fp,
+                relays=relay_ids,
+                offset=offset,
             )
             if not ok:
                 raise IOError('transfer of %r was interrupted.' % (in_path,))
 
-            set_file_mode(tmp_path, metadata['mode'], fd=fp.fileno())
+            unchanged = metadata.get('unchanged')
+            if unchanged and base_path != out_path:
+                # Nothing was sent, so the content is that of base_path.
+                base_fp.seek(0)
+                shutil.copyfileobj(base_fp, fp)
+                unchanged = False
+
+            if unchanged:
+                dest_path, dest_fd = out_path, base_fp.fileno()
+            else:
+                dest_path, dest_fd = tmp_path, fp.fileno()
+            set_file_mode(dest_path, metadata['mode'], fd=dest_fd)
             if set_owner:
-                set_file_owner(tmp_path, metadata['owner'], metadata['group'],
-                               fd=fp.fileno())
+                set_file_owner(dest_path, metadata['owner'],
+                               metadata['group'], fd=dest_fd)
         finally:
             fp.close()
-
-        if sync:
-            os.fsync(fp.fileno())
-        os.rename(tmp_path, out_path)
+            if base_fp is not None:
+                base_fp.close()
+
+        if unchanged:
+            LOG.debug('transfer_file(%r): content unchanged', out_path)
+            os.unlink(tmp_path)
+        else:
+            if sync:
+                os.fsync(fp.fileno())
+            os.rename(tmp_path, out_path)
     except BaseException:
-        os.unlink(tmp_path)
+        if os.path.exists(tmp_path):
+            if partial_path and os.path.getsize(tmp_path):
+                LOG.debug('transfer_file(%r): keeping partial output in %s',
+                          out_path, partial_path)
+                os.rename(tmp_path, partial_path)
+            else:
+                os.unlink(tmp_path)
         raise
 
     os.utime(out_path, (metadata['atime'], metadata['mtime']))
@@ -358,12 +468,14 @@ def init_child(econtext, log_level, candidate_temp_dirs):
             {
                 'fork_context': mitogen.core.Context or None,
                 'good_temp_dir': ...
-                'home_dir': str
+                'home_dir': str,
+                'parent_ids': [int, ...]
             }
 
         Where `fork_context` refers to the newly forked 'fork parent' context
-        the controller will use to start forked jobs, and `home_dir` is the
-        home directory for the active user account.
+        the controller will use to start forked jobs, `home_dir` is the
+        home directory for the active user account, and `parent_ids` lists the
+        IDs of the parent contexts, nearest first.
     """
     # Copying the master's log level causes log messages to be filtered before
     # they reach LogForwarder, thus reducing an influx of tiny messges waking
@@ -374,7 +486,11 @@ def init_child(econtext, log_level, candidate_temp_dirs):
     # issue #536: if the json module is available, remove simplejson from the
     # importer whitelist to avoid confusing certain Ansible modules.
     if json.__name__ == 'json':
-        econtext.importer.whitelist.remove('simplejson')
+        econtext.importer.whitelist = [
+            prefix
+            for prefix in econtext.importer.whitelist
+            if prefix != 'simplejson'
+        ]
 
     global _fork_parent
     if FORK_SUPPORTED:
@@ -388,6 +504,7 @@ def init_child(econtext, log_level, candidate_temp_dirs):
         u'fork_context': _fork_parent,
         u'home_dir': mitogen.core.to_text(os.path.expanduser('~')),
         u'good_temp_dir': good_temp_dir,
+        u'parent_ids': mitogen.parent_ids,
     }
 
 
@@ -411,17 +528,148 @@ def spawn_isolated_child(econtext):
     return context
 
 
-def run_module(kwargs):
+#: Types a JSON decoder may produce for a scalar value.
+_JSON_SCALAR_TYPES = (mitogen.core.UnicodeType, bool, int, float, type(None))
+if not mitogen.core.PY3:
+    _JSON_SCALAR_TYPES += (long,)
+
+
+def _is_json_value(obj):
+    """
+    Return :data:`True` if `obj` is built only from types the controller's
+    JSON decoder would produce from module output. Text must be Unicode: on
+    Python 2 some decoders return ASCII strings as bytes, which would reach a
+    Python 3 controller as :class:`bytes`.
+    """
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if not isinstance(key, mitogen.core.UnicodeType):
+                    return False
+                stack.append(value)
+        elif isinstance(obj, list):
+            stack.extend(obj)
+        elif not isinstance(obj, _JSON_SCALAR_TYPES):
+            return False
+    return True
+
+
+def _load_output(stdout):
+    """
+    Return module output parsed as a dict if it is a lone JSON object, as
+    Ansible would parse it without discarding any junk or warning, otherwise
+    :data:`None`.
+    """
+    try:
+        data = json.loads(stdout)
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        return data
+
+
+def _encode_facts(result, data, base_digest):
+    """
+    Record the ``ansible_facts`` in the parsed module output `data`, and if
+    this context still has the facts whose digest is `base_digest`, replace
+    them with only the top-level facts that changed since. A `facts_delta`
+    key is added to `result` describing the encoding.
+
+    :returns:
+        :data:`True` if `data` was modified.
+    """
+    global _facts_digest, _facts
+    facts = data.get('ansible_facts')
+    if not isinstance(facts, dict):
+        return False
+
+    encoded = json.dumps(facts, sort_keys=True)
+    digest = sha1(encoded.encode('utf-8')).hexdigest()
+    info = {
+        u'digest': digest,
+        u'base': None,
+        u'removed': [],
+    }
+    result[u'facts_delta'] = info
+    modified = base_digest is not None and base_digest == _facts_digest
+    if modified:
+        info[u'base'] = base_digest
+        info[u'removed'] = [key for key in _facts if key not in facts]
+        data['ansible_facts'] = dict(
+            (key, value)
+            for key, value in facts.items()
+            if key not in _facts or _facts[key] != value
+        )
+
+    _facts_digest = digest
+    _facts = facts
+    return modified
+
+
+def _compress_result(result, min_size):
+    """
+    Replace the module output in `result` with a zlib-compressed
+    `stdout_zlib` key when it is at least `min_size` bytes long.
+    """
+    stdout = result['stdout']
+    if len(stdout) >= min_size:
+        result[u'stdout_zlib'] = mitogen.core.Blob(
+            zlib.compress(stdout.encode('utf-8'))
+        )
+        result[u'stdout'] = u''
+
+
+def _encode_result(result, compress_size, facts_delta, facts_digest,
+                   parse_result):
+    """
+    Apply the encodings selected by :func:`run_module`'s arguments to
+    `result`.
+    """
+    if facts_delta or parse_result:
+        data = _load_output(result['stdout'])
+        if data is not None:
+            modified = facts_delta and _encode_facts(result, data,
+                                                     facts_digest)
+            if parse_result and _is_json_value(data):
+                result[u'parsed'] = data
+                result[u'stdout'] = u''
+            elif modified:
+                result[u'stdout'] = mitogen.core.to_text(json.dumps(data))
+    if compress_size:
+        _compress_result(result, compress_size)
+
+
+def run_module(kwargs, compress_size=0, facts_delta=False, facts_digest=None,
+               parse_result=False):
     """
     Set up the process environment in preparation for running an Ansible
     module. This monkey-patches the Ansible libraries in various places to
     prevent it from trying to kill the process on completion, and to prevent it
     from reading sys.stdin.
+
+    :param int compress_size:
+        If nonzero, module output at least this many bytes long is returned
+        compressed. See :func:`_compress_result`.
+    :param bool facts_delta:
+        If :data:`True`, returned facts may be encoded as a delta against the
+        facts whose digest is `facts_digest`. See :func:`_encode_facts`.
+    :param str facts_digest:
+        Digest of the facts the controller holds for this context, or
+        :data:`None`.
+    :param bool parse_result:
+        If :data:`True`, module output that is a lone JSON object is returned
+        already decoded in a `parsed` key, sparing the controller from
+        decoding it.
     """
     runner_name = kwargs.pop('runner_name')
     klass = getattr(ansible_mitogen.runner, runner_name)
     impl = klass(**mitogen.core.Kwargs(kwargs))
-    return impl.run()
+    result = impl.run()
+    _encode_result(result, compress_size, facts_delta, facts_digest,
+                   parse_result)
+    return result
 
 
 def _get_async_dir():
@@ -576,6 +824,111 @@ def run_module_async(kwargs, job_id, timeout_secs, started_sender, econtext):
     arunner.run()
 
 
+class AsyncJobWatcher(object):
+    """
+    Poll the status files written by :class:`AsyncRunner` from a thread in a
+    long-lived context, pushing each job's final status to the controller as
+    soon as it is written. The job cannot do this itself, since it detaches
+    from its parent before running the module.
+    """
+    #: Seconds to sleep between polls.
+    interval = 0.25
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sender_by_job_id = {}
+        self._thread = None
+
+    def add(self, job_id, sender):
+        self._lock.acquire()
+        try:
+            self._sender_by_job_id[job_id] = sender
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    name='AsyncJobWatcher',
+                    target=self._run,
+                )
+                self._thread.setDaemon(True)
+                self._thread.start()
+        finally:
+            self._lock.release()
+
+    def _pid_exists(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            e = sys.exc_info()[1]
+            return e.args[0] == errno.EPERM
+        return True
+
+    def _check(self, job_id):
+        """
+        Return the final status of a job as async_status would report it,
+        :data:`None` if it is still running, or :data:`False` if it can no
+        longer be followed, because its job file was removed, or the job died
+        without updating it.
+        """
+        path = os.path.join(_get_async_dir(), job_id)
+        try:
+            fp = open(path)
+            try:
+                dct = json.loads(fp.read())
+            finally:
+                fp.close()
+        except (IOError, OSError, ValueError):
+            return False
+
+        if 'started' not in dct:
+            dct['finished'] = 1
+            return dct
+        if isinstance(dct.get('pid'), int) and not self._pid_exists(dct['pid']):
+            return False
+        return None
+
+    def _poll(self):
+        self._lock.acquire()
+        try:
+            items = list(self._sender_by_job_id.items())
+            if not items:
+                self._thread = None
+                return False
+        finally:
+            self._lock.release()
+
+        for job_id, sender in items:
+            status = self._check(job_id)
+            if status is None:
+                continue
+            if status:
+                sender.send(status)
+            else:
+                sender.close()
+            self._lock.acquire()
+            try:
+                del self._sender_by_job_id[job_id]
+            finally:
+                self._lock.release()
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._poll():
+                break
+
+
+_async_job_watcher = AsyncJobWatcher()
+
+
+def watch_async_job(job_id, result_sender):
+    """
+    Arrange for `result_sender` to receive the final status dict of an
+    asynchronous job started by :func:`run_module_async`, or to be closed if
+    the job can no longer be followed.
+    """
+    _async_job_watcher.add(job_id, result_sender)
+
+
 def get_user_shell():
     """
     For commands executed directly via an SSH command-line, SSH looks up the
@@ -650,6 +1003,161 @@ def exec_command(cmd, in_data='', chdir=None, shell=None, emulate_tty=False):
     )
 
 
+def _send_output(sender, ack_recv, unacked, name, s):
+    """
+    Send a chunk of output from :func:`exec_args_streaming`, first waiting for
+    acknowledgements while :data:`STREAM_WINDOW_SIZE` bytes or more are
+    unacknowledged. Return the new unacknowledged byte count.
+    """
+    while unacked >= STREAM_WINDOW_SIZE:
+        unacked -= ack_recv.get().unpickle()
+    sender.send((name, mitogen.core.Blob(s)))
+    return unacked + len(s)
+
+
+def _stream_process(proc, in_data, emulate_tty, sender, ack_recv):
+    """
+    Write `in_data` to the standard input of `proc`, while sending its output
+    to `sender` as it arrives, until its output pipes are closed.
+    """
+    name_by_fd = {}
+    for name, fp in ((u'stdout', proc.stdout), (u'stderr', proc.stderr)):
+        if fp is not None:
+            name_by_fd[fp.fileno()] = name
+
+    stdin_fd = None
+    if in_data:
+        stdin_fd = proc.stdin.fileno()
+        mitogen.core.set_nonblock(stdin_fd)
+    else:
+        proc.stdin.close()
+
+    poller = mitogen.parent.PREFERRED_POLLER()
+    try:
+        for fd in name_by_fd:
+            poller.start_receive(fd)
+        if stdin_fd is not None:
+            poller.start_transmit(stdin_fd)
+
+        in_pos = 0
+        unacked = 0
+        while name_by_fd:
+            for fd in poller.poll():
+                if fd == stdin_fd:
+                    try:
+                        in_pos += os.write(fd, in_data[in_pos:in_pos +
+                                                       mitogen.core.CHUNK_SIZE])
+                    except OSError:
+                        e = sys.exc_info()[1]
+                        if e.args[0] == errno.EAGAIN:
+                            continue
+                        if e.args[0] != errno.EPIPE:
+                            raise
+                        in_pos = len(in_data)
+                    if in_pos >= len(in_data):
+                        poller.stop_transmit(fd)
+                        proc.stdin.close()
+                        stdin_fd = None
+                    continue
+
+                s = os.read(fd, mitogen.core.CHUNK_SIZE)
+                if not s:
+                    poller.stop_receive(fd)
+                    del name_by_fd[fd]
+                    continue
+                if emulate_tty:
+                    s = s.replace(b('\n'), b('\r\n'))
+                unacked = _send_output(sender, ack_recv, unacked,
+                                       name_by_fd[fd], s)
+    finally:
+        poller.close()
+        if not proc.stdin.closed:
+            proc.stdin.close()
+
+
+@mitogen.core.takes_router
+def exec_args_streaming(args, sender, in_data='', chdir=None, shell=None,
+                        emulate_tty=False, router=None):
+    """
+    Like :func:`exec_args`, but send output to `sender` as it is produced,
+    rather than buffering it until the command exits.
+
+    The first message sent is a :class:`mitogen.core.Sender` the receiver must
+    send the size of each chunk to once it has been consumed. It is followed
+    by `(name, data)` tuples, where `name` is ``stdout`` or ``stderr``, and
+    `sender` is closed once the command's output ends. No more than
+    :data:`STREAM_WINDOW_SIZE` bytes are sent without being acknowledged.
+
+    :param list[str]:
+        Argument vector.
+    :param mitogen.core.Sender sender:
+        Sender to receive output.
+    :param bytes in_data:
+        Optional standard input for the command.
+    :param bool emulate_tty:
+        If :data:`True`, arrange for stdout and stderr to be merged into the
+        stdout pipe and for LF to be translated into CRLF, emulating the
+        behaviour of a TTY.
+    :return:
+        Return code.
+    """
+    LOG.debug('exec_args_streaming(%r, ..., chdir=%r)', args, chdir)
+    assert isinstance(args, list)
+
+    # Closing sender ends the receiver's loop even if the command failed to
+    # start.
+    try:
+        ack_recv = mitogen.core.Receiver(router)
+        try:
+            sender.send(ack_recv.to_sender())
+            if emulate_tty:
+                stderr = subprocess.STDOUT
+            else:
+                stderr = subprocess.PIPE
+
+            proc = subprocess.Popen(
+                args=args,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                stdin=subprocess.PIPE,
+                cwd=chdir,
+            )
+            _stream_process(proc, in_data, emulate_tty, sender, ack_recv)
+            return proc.wait()
+        finally:
+            ack_recv.close()
+    finally:
+        sender.close()
+
+
+@mitogen.core.takes_router
+def exec_command_streaming(cmd, sender, in_data='', chdir=None, shell=None,
+                           emulate_tty=False, router=None):
+    """
+    Like :func:`exec_command`, but send output to `sender` as it is produced,
+    as described by :func:`exec_args_streaming`.
+
+    :param bytes cmd:
+        String command line, passed to user's shell.
+    :param mitogen.core.Sender sender:
+        Sender to receive output.
+    :param bytes in_data:
+        Optional standard input for the command.
+    :return:
+        Return code.
+    """
+    assert isinstance(cmd, mitogen.core.UnicodeType)
+    return exec_args_streaming(
+        args=[get_user_shell(), '-c', cmd],
+        sender=sender,
+        in_data=in_data,
+        chdir=chdir,
+        shell=shell,
+        emulate_tty=emulate_tty,
+        router=router,
+    )
+
+
 def read_path(path):
     """
     Fetch the contents of a filesystem `path` as bytes.
@@ -778,3 +1286,235 @@ def file_exists(path):
     Python versions.
     """
     return os.path.exists(path)
+
+
+#: Maximum number of entries in :data:`_checksum_cache` before it is emptied.
+CHECKSUM_CACHE_SIZE = 16384
+
+#: Mapping of path -> `(key, hex SHA-1 digest)`, where `key` is a tuple of the
+#: file's device, inode, size, modification and change times at the time it
+#: was hashed. An entry is only used if the key still matches.
+_checksum_cache = {}
+
+
+def _get_checksum(path, st):
+    """
+    Return the hex SHA-1 digest of the regular file `path` whose
+    :func:`os.stat` result is `st`, using :data:`_checksum_cache` if the file
+    appears unchanged since it was last hashed.
+    """
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+    entry = _checksum_cache.get(path)
+    if entry and entry[0] == key:
+        return entry[1]
+
+    digest = sha1()
+    fp = open(path, 'rb')
+    try:
+        while True:
+            s = fp.read(65536)
+            if not s:
+                break
+            digest.update(s)
+    finally:
+        fp.close()
+
+    hexdigest = digest.hexdigest()
+    # A file written again within the timestamp granularity after hashing
+    # would keep its key, so don't trust recently modified files.
+    if max(st.st_mtime, st.st_ctime) < (time.time() - 2):
+        if len(_checksum_cache) >= CHECKSUM_CACHE_SIZE:
+            _checksum_cache.clear()
+        _checksum_cache[path] = (key, hexdigest)
+    return hexdigest
+
+
+def _stat_path(path, follow, checksum):
+    """
+    Implement :func:`stat_paths` for one path.
+    """
+    path = os.path.expanduser(os.path.expandvars(path))
+    try:
+        if follow:
+            st = os.stat(path)
+        else:
+            st = os.lstat(path)
+    except OSError:
+        e = sys.exc_info()[1]
+        if e.args[0] == errno.ENOENT:
+            return {'changed': False, 'stat': {'exists': False}}
+        return {'failed': True, 'msg': e.strerror}
+
+    mode = st.st_mode
+    dct = {
+        'exists': True,
+        'path': path,
+        'mode': '%04o' % stat.S_IMODE(mode),
+        'isdir': stat.S_ISDIR(mode),
+        'ischr': stat.S_ISCHR(mode),
+        'isblk': stat.S_ISBLK(mode),
+        'isreg': stat.S_ISREG(mode),
+        'isfifo': stat.S_ISFIFO(mode),
+        'islnk': stat.S_ISLNK(mode),
+        'issock': stat.S_ISSOCK(mode),
+        'uid': st.st_uid,
+        'gid': st.st_gid,
+        'size': st.st_size,
+        'inode': st.st_ino,
+        'dev': st.st_dev,
+        'nlink': st.st_nlink,
+        'atime': st.st_atime,
+        'mtime': st.st_mtime,
+        'ctime': st.st_ctime,
+        'readable': os.access(path, os.R_OK),
+        'writeable': os.access(path, os.W_OK),
+        'executable': os.access(path, os.X_OK),
+    }
+    for name in ('IRUSR', 'IWUSR', 'IXUSR', 'IRGRP', 'IWGRP', 'IXGRP',
+                 'IROTH', 'IWOTH', 'IXOTH'):
+        dct[name[1:].lower()] = bool(mode & getattr(stat, 'S_' + name))
+    dct['isuid'] = bool(mode & stat.S_ISUID)
+    dct['isgid'] = bool(mode & stat.S_ISGID)
+
+    if dct['islnk']:
+        dct['lnk_source'] = os.path.realpath(path)
+        dct['lnk_target'] = os.readlink(path)
+    try:
+        dct['pw_name'] = pwd.getpwuid(st.st_uid).pw_name
+    except KeyError:
+        pass
+    try:
+        dct['gr_name'] = grp.getgrgid(st.st_gid).gr_name
+    except KeyError:
+        pass
+
+    if checksum and dct['isreg'] and dct['readable']:
+        try:
+            dct['checksum'] = _get_checksum(path, st)
+        except IOError:
+            e = sys.exc_info()[1]
+            return {'failed': True, 'msg': str(e)}
+    return {'changed': False, 'stat': dct}
+
+
+def stat_paths(paths, follow=False, checksum=True):
+    """
+    Stat and optionally hash many paths in one call, without the module
+    runner setup needed to run the stat module for each.
+
+    :param list paths:
+        Paths to examine. User and variable references are expanded as by
+        the stat module.
+    :param bool follow:
+        If :data:`True`, follow symbolic links.
+    :param bool checksum:
+        If :data:`True`, include the SHA-1 ``checksum`` of readable regular
+        files, reusing a cached digest while the file's inode, size and
+        timestamps are unchanged.
+    :returns:
+        List of results in the format returned by the stat module without
+        MIME type or attribute information, in the order of `paths`.
+    """
+    return [_stat_path(path, follow, checksum) for path in paths]
+
+
+def _file_op_rm(paths, recurse, force):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            e = sys.exc_info()[1]
+            if force and e.args[0] == errno.ENOENT:
+                continue
+            if not (recurse and os.path.isdir(path) and
+                    not os.path.islink(path)):
+                raise
+            shutil.rmtree(path)
+    return 0, ''
+
+
+def _file_op_chmod(mode, paths):
+    for path in paths:
+        set_file_mode(path, mode)
+    return 0, ''
+
+
+def _mkdir(path, mode):
+    """
+    Create `path` with the octal string `mode` exactly, as by ``mkdir -m``,
+    by clearing the umask during the call, so the directory never exists
+    with looser permissions.
+    """
+    if mode is None:
+        os.mkdir(path)
+        return
+
+    old_umask = os.umask(0)
+    try:
+        os.mkdir(path, int(mode, 8))
+    finally:
+        os.umask(old_umask)
+
+
+def _file_op_mkdir(paths, mode, parents):
+    for path in paths:
+        if parents:
+            if os.path.isdir(path):
+                continue
+            parent = os.path.dirname(path.rstrip('/'))
+            if parent and not os.path.isdir(parent):
+                os.makedirs(parent)
+        _mkdir(path, mode)
+    return 0, ''
+
+
+def _file_op_exists(path):
+    if os.path.exists(path):
+        return 0, ''
+    return 1, ''
+
+
+def _file_op_expanduser(path):
+    return 0, os.path.expanduser(path) + '\n'
+
+
+_FILE_OPS = {
+    'rm': _file_op_rm,
+    'chmod': _file_op_chmod,
+    'mkdir': _file_op_mkdir,
+    'exists': _file_op_exists,
+    'expanduser': _file_op_expanduser,
+}
+
+
+def run_file_ops(ops):
+    """
+    Perform simple file operations parsed from a shell command line by
+    :func:`ansible_mitogen.parsing.parse_file_ops` in-process, rather than
+    forking a shell to run them.
+
+    :param list ops:
+        List of `(connector, quiet, name, args)` tuples. An operation whose
+        `connector` is ``&&`` is skipped if the previous one failed. If
+        `quiet` is :data:`True`, its output is discarded.
+    :returns:
+        Tuple of `(return code, stdout, stderr)`, as for the shell command.
+    """
+    rc = 0
+    stdout = []
+    stderr = []
+    for connector, quiet, name, args in ops:
+        if connector == '&&' and rc != 0:
+            continue
+        out = err = ''
+        try:
+            rc, out = _FILE_OPS[name](*args)
+        except (IOError, OSError):
+            e = sys.exc_info()[1]
+            LOG.debug('run_file_ops(): %s%r failed: %s', name, args, e)
+            rc = 1
+            err = '%s: %s\n' % (name, e)
+        if not quiet:
+            stdout.append(out)
+            stderr.append(err)
+    return rc, ''.join(stdout), ''.join(stderr)
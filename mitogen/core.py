@@ -43,9 +43,11 @@ import fcntl
 import itertools
 import linecache
 import logging
+import marshal
 import os
 import pickle as py_pickle
 import pstats
+import re
 import signal
 import socket
 import struct
@@ -495,6 +497,55 @@ def takes_router(func):
     return func
 
 
+def compile_prefixes(prefixes):
+    """
+    Return a function that, given a string, returns a true value if the string
+    starts with any of `prefixes`. The prefixes are arranged in a trie that is
+    compiled into one regular expression, so the test costs a single match
+    however many prefixes there are.
+    """
+    trie = {}
+    for prefix in sorted(prefixes, key=len):
+        node = trie
+        for c in prefix:
+            if '' in node:
+                break  # A shorter prefix already matches.
+            node = node.setdefault(c, {})
+        else:
+            node.clear()
+            node[''] = {}
+    if not trie:
+        return re.compile('(?!)').match  # Never matches.
+    return re.compile(_trie_pattern(trie), re.S).match
+
+
+def _trie_pattern(node):
+    if '' in node:
+        return ''
+    alts = []
+    for c, child in sorted(node.items()):
+        alts.append(re.escape(c) + _trie_pattern(child))
+    if len(alts) == 1:
+        return alts[0]
+    return '(?:%s)' % ('|'.join(alts),)
+
+
+def prefix_list(name):
+    """
+    Return a property storing a list of module name prefixes in the attribute
+    `_<name>`, and the matcher :func:`compile_prefixes` returns for the list in
+    `_<name>_match`. The matcher is compiled only when a list is assigned, so
+    a list must be replaced rather than changed in place.
+    """
+    def fget(self):
+        return getattr(self, '_' + name)
+
+    def fset(self, prefixes):
+        setattr(self, '_' + name, prefixes)
+        setattr(self, '_%s_match' % (name,), compile_prefixes(prefixes))
+    return property(fget, fset)
+
+
 def is_blacklisted_import(importer, fullname):
     """
     Return :data:`True` if `fullname` is part of a blacklisted package, or if
@@ -505,8 +556,8 @@ def is_blacklisted_import(importer, fullname):
       - If any package is whitelisted, then all non-whitelisted packages are
         treated as blacklisted.
     """
-    return ((not any(fullname.startswith(s) for s in importer.whitelist)) or
-                (any(fullname.startswith(s) for s in importer.blacklist)))
+    return (importer._whitelist_match(fullname) is None or
+            importer._blacklist_match(fullname) is not None)
 
 
 def set_cloexec(fd):
@@ -682,6 +733,17 @@ def import_module(modname):
     return __import__(modname, None, None, [''])
 
 
+def get_bytecode_magic():
+    """
+    Return a string identifying the bytecode format of this interpreter: its
+    magic number, and optimization level. Code objects compiled by a process
+    with the same value can be executed by this one.
+    """
+    optimize = getattr(getattr(sys, 'flags', None), 'optimize', 0)
+    return u'%s-O%d' % (to_text(binascii.hexlify(imp.get_magic())), optimize)
+
+
+
 def pipe():
     """
     Create a UNIX pipe pair using :func:`os.pipe`, wrapping the returned
@@ -756,15 +818,24 @@ if PY3:
         def find_class(self, module, func):
             return self.find_global(module, func)
     pickle__dumps = pickle.dumps
+
+    # The 3.x C unpickler calls read() for every opcode of a file lacking
+    # peek(), making large messages several times slower to decode than with
+    # pickle.loads(). A buffer holding the whole message avoids it.
+    import io
+    def _unpickler_file(data):
+        return io.BufferedReader(BytesIO(data), len(data) + 1)
 elif PY24:
     # On Python 2.4, we must use a pure-Python pickler.
     pickle__dumps = Py24Pickler.dumps
     _Unpickler = pickle.Unpickler
+    _unpickler_file = BytesIO
 else:
     pickle__dumps = pickle.dumps
     # In 2.x Unpickler is a function exposing a writeable find_global
     # attribute.
     _Unpickler = pickle.Unpickler
+    _unpickler_file = BytesIO
 
 
 class Message(object):
@@ -800,6 +871,11 @@ class Message(object):
     #: Raw message data bytes.
     data = b('')
 
+    #: If not :data:`None`, a :class:`FileRegion` whose bytes follow
+    #: :attr:`data` as part of the message, copied to the stream by the kernel
+    #: as the message is written, rather than held in memory.
+    region = None
+
     _unpickled = object()
 
     #: The :class:`Router` responsible for routing the message. This is
@@ -824,14 +900,37 @@ class Message(object):
         vars(self).update(kwargs)
         assert isinstance(self.data, BytesType), 'Message data is not Bytes'
 
+    def size(self):
+        """
+        Return the size of the message payload, including any
+        :attr:`region`.
+        """
+        if self.region is None:
+            return len(self.data)
+        return len(self.data) + self.region.size
+
     def pack(self):
+        """
+        Return the message header and :attr:`data`. The bytes of any
+        :attr:`region` must be written after them.
+        """
         return (
             struct.pack(self.HEADER_FMT, self.HEADER_MAGIC, self.dst_id,
                         self.src_id, self.auth_id, self.handle,
-                        self.reply_to or 0, len(self.data))
+                        self.reply_to or 0, self.size())
             + self.data
         )
 
+    def read_region(self):
+        """
+        Append the bytes of :attr:`region` to :attr:`data`, for delivery to
+        destinations that cannot receive it directly.
+        """
+        if self.region is not None:
+            self.data += self.region.read()
+            self.region.close()
+            self.region = None
+
     def _unpickle_context(self, context_id, name):
         return _unpickle_context(context_id, name, router=self.router)
 
@@ -957,7 +1056,7 @@ class Message(object):
 
         obj = self._unpickled
         if obj is Message._unpickled:
-            fp = BytesIO(self.data)
+            fp = _unpickler_file(self.data)
             unpickler = _Unpickler(fp, **self.UNPICKLER_KWARGS)
             unpickler.find_global = self._find_global
             try:
@@ -1266,6 +1365,7 @@ class Importer(object):
         'lxd',
         'master',
         'minify',
+        'module_store',
         'os_fork',
         'parent',
         'podman',
@@ -1301,6 +1401,28 @@ class Importer(object):
     if PY3:
         ALWAYS_BLACKLIST += ['cStringIO']
 
+    #: Module name prefixes, see :func:`prefix_list`.
+    whitelist = prefix_list('whitelist')
+    blacklist = prefix_list('blacklist')
+
+    #: Identifier of the host-local :class:`mitogen.module_store.ModuleStore`
+    #: shared with sibling contexts, or :data:`None` if the master has not
+    #: enabled one.
+    store_id = None
+
+    #: :class:`mitogen.module_store.ModuleStore` consulted before requesting a
+    #: module from the parent, or :data:`None`.
+    store = None
+
+    #: :data:`True` once :meth:`enable_lazy` has installed the PEP 451
+    #: loader methods.
+    lazy = False
+
+    #: Value of :func:`get_bytecode_magic` if the master compiles modules
+    #: for this interpreter, otherwise :data:`None`. Compiled code is only
+    #: requested and used when this is set.
+    bytecode_magic = None
+
     def __init__(self, router, context, core_src, whitelist=(), blacklist=()):
         self._log = logging.getLogger('mitogen.importer')
         self._context = context
@@ -1403,7 +1525,7 @@ class Importer(object):
             # #114: explicitly whitelisted prefixes override any
             # system-installed package.
             if self.whitelist != ['']:
-                if any(fullname.startswith(s) for s in self.whitelist):
+                if self._whitelist_match(fullname):
                     return self
 
             try:
@@ -1465,23 +1587,40 @@ class Importer(object):
 
         self._lock.acquire()
         try:
-            self._cache[fullname] = tup
-            if tup[2] is not None and PY24:
-                self._update_linecache(
-                    path='master:' + tup[2],
-                    data=zlib.decompress(tup[3])
-                )
+            self._add_to_cache(tup)
             callbacks = self._callbacks.pop(fullname, [])
         finally:
             self._lock.release()
 
+        if self.store:
+            self.store.put(tup)
         for callback in callbacks:
             callback()
 
+    def _add_to_cache(self, tup):
+        self._cache[tup[0]] = tup
+        if tup[2] is not None and PY24:
+            self._update_linecache(
+                path='master:' + tup[2],
+                data=zlib.decompress(tup[3])
+            )
+
+    def _get_request(self, fullname):
+        if self.bytecode_magic:
+            return b('%s\x00%s' % (fullname, self.bytecode_magic))
+        return b(fullname)
+
     def _request_module(self, fullname, callback):
         self._lock.acquire()
         try:
             present = fullname in self._cache
+            if not (present or self.store is None):
+                tup = self.store.get(fullname)
+                if tup is not None:
+                    _v and self._log.debug('found %s in %r',
+                                           fullname, self.store)
+                    self._add_to_cache(tup)
+                    present = True
             if not present:
                 funcs = self._callbacks.get(fullname)
                 if funcs is not None:
@@ -1493,7 +1632,8 @@ class Importer(object):
                                            fullname)
                     self._callbacks[fullname] = [callback]
                     self._context.send(
-                        Message(data=b(fullname), handle=GET_MODULE)
+                        Message(data=self._get_request(fullname),
+                                handle=GET_MODULE)
                     )
         finally:
             self._lock.release()
@@ -1512,15 +1652,7 @@ class Importer(object):
         _v and self._log.debug('requesting %s', fullname)
         self._refuse_imports(fullname)
 
-        event = threading.Event()
-        self._request_module(fullname, event.set)
-        event.wait()
-
-        ret = self._cache[fullname]
-        if ret[2] is None:
-            raise ModuleNotFoundError(self.absent_msg % (fullname,))
-
-        pkg_present = ret[1]
+        pkg_present = self._fetch(fullname)[1]
         mod = sys.modules.setdefault(fullname, imp.new_module(fullname))
         mod.__file__ = self.get_filename(fullname)
         mod.__loader__ = self
@@ -1535,13 +1667,7 @@ class Importer(object):
             # 2.x requires __package__ to be exactly a string.
             mod.__package__, _ = encodings.utf_8.encode(mod.__package__)
 
-        source = self.get_source(fullname)
-        try:
-            code = compile(source, mod.__file__, 'exec', 0, 1)
-        except SyntaxError:
-            LOG.exception('while importing %r', fullname)
-            raise
-
+        code = self._compile(fullname, mod.__file__)
         if PY3:
             exec(code, vars(mod))
         else:
@@ -1551,6 +1677,157 @@ class Importer(object):
         # is necessary. This matches PyImport_ExecCodeModuleEx()
         return sys.modules.get(fullname, mod)
 
+    def enable_lazy(self):
+        """
+        On Python 3.5+, have the import machinery use the PEP 451
+        ``find_spec()`` protocol rather than :meth:`find_module`, and execute
+        the body of each module outside the Mitogen package on first attribute
+        access, as with :class:`importlib.util.LazyLoader`. Modules the master
+        marked as replacing themselves in :data:`sys.modules` still execute at
+        import. Does nothing on older versions.
+        """
+        try:
+            import importlib.machinery
+            import importlib.util
+            self._lazy_loader = importlib.util.LazyLoader
+        except (ImportError, AttributeError):
+            return
+
+        self._module_spec = importlib.machinery.ModuleSpec
+        self.find_spec = self._find_spec
+        self.create_module = self._create_module
+        self.exec_module = self._exec_module
+        self.lazy = True
+
+    def _find_spec(self, fullname, path, target=None):
+        # importlib.abc.MetaPathFinder.find_spec().
+        if self.find_module(fullname, path) is None:
+            return None
+        return self._module_spec(fullname, self)
+
+    def _create_module(self, spec):
+        # importlib.abc.Loader.create_module(). The requestee frame seen by
+        # _refuse_imports() belongs to the import machinery here, so its
+        # pkg_resources check applies only to load_module().
+        fullname = spec.name
+        _v and self._log.debug('requesting %s', fullname)
+        self._refuse_imports(fullname)
+
+        pkg_present = self._fetch(fullname)[1]
+        spec.origin = self.get_filename(fullname)
+        if pkg_present is not None:  # it's a package.
+            spec.submodule_search_locations = []
+            self._present[fullname] = pkg_present
+
+        mod = imp.new_module(fullname)
+        mod.__file__ = spec.origin
+        return mod
+
+    def _exec_module(self, mod):
+        # importlib.abc.Loader.exec_module().
+        spec = mod.__spec__
+        if spec.loader_state is None and self._is_lazy(spec.name):
+            # Sets spec.loader_state, so the call made by the lazy module on
+            # first access executes the body below.
+            self._lazy_loader(self).exec_module(mod)
+            return
+
+        code = self._compile(spec.name, spec.origin)
+        exec(code, vars(mod))
+
+    def _is_lazy(self, fullname):
+        # 6:eager, set by the master for modules that replace themselves in
+        # sys.modules (#590), since their importer would keep the original.
+        tup = self._cache[fullname]
+        return not (fullname.startswith('mitogen.') or
+                    (len(tup) > 6 and tup[6]))
+
+    def _fetch(self, fullname):
+        event = threading.Event()
+        self._request_module(fullname, event.set)
+        event.wait()
+
+        ret = self._cache[fullname]
+        if ret[2] is None:
+            raise ModuleNotFoundError(self.absent_msg % (fullname,))
+        return ret
+
+    def _compile(self, fullname, path):
+        code = self._get_code(fullname)
+        if code is None:
+            source = self.get_source(fullname)
+            try:
+                code = compile(source, path, 'exec', 0, 1)
+            except SyntaxError:
+                LOG.exception('while importing %r', fullname)
+                raise
+
+        # 7:names of modules it imports, if the master lists them.
+        tup = self._cache[fullname]
+        if len(tup) > 7:
+            self.prefetch(tup[7])
+        return code
+
+    def _get_code(self, fullname):
+        """
+        Return the code object the master compiled for `fullname`, or
+        :data:`None` if it did not send one usable by this interpreter.
+        """
+        # 5:(bytecode_magic, compressed marshalled code), if present.
+        tup = self._cache[fullname]
+        if (self.bytecode_magic and len(tup) > 5 and tup[5] and
+                tup[5][0] == self.bytecode_magic):
+            try:
+                return marshal.loads(zlib.decompress(tup[5][1]))
+            except (EOFError, ValueError, TypeError, zlib.error):
+                LOG.debug('%r: bad code for %s, compiling it', self, fullname)
+
+    def _is_local(self, fullname):
+        """
+        Return :data:`True` if `fullname` is expected to be found locally
+        rather than by requesting it from the parent, as in :meth:`find_module`.
+        """
+        if self.whitelist != ['']:
+            if self._whitelist_match(fullname):
+                return False
+
+        pkgname, _, suffix = str_rpartition(fullname, '.')
+        if pkgname:
+            pkg = sys.modules.get(pkgname)
+            if pkg is not None and getattr(pkg, '__loader__', None) is not self:
+                return True
+            tup = self._cache.get(pkgname)
+            return tup is not None and suffix not in (tup[1] or ())
+
+        try:
+            self.builtin_find_module(fullname)
+            return True
+        except ImportError:
+            return False
+
+    def prefetch(self, fullnames):
+        """
+        Request each module in `fullnames` that is not already loaded,
+        requested, blacklisted or available locally, without waiting for the
+        responses, so that importing them costs a single round-trip rather
+        than one per module. Names the parent cannot serve are ignored, and
+        only fail when imported.
+
+        :param list fullnames:
+            Absolute names of modules that will likely be imported.
+        """
+        for fullname in fullnames:
+            fullname = to_text(fullname)
+            if (fullname in sys.modules or
+                    fullname in self._cache or
+                    fullname in self._callbacks or
+                    is_blacklisted_import(self, fullname) or
+                    self._is_local(fullname)):
+                continue
+
+            _v and self._log.debug('prefetching %s', fullname)
+            self._request_module(fullname, lambda: None)
+
     def get_filename(self, fullname):
         if fullname in self._cache:
             path = self._cache[fullname][2]
@@ -1901,6 +2178,75 @@ class DelimitedProtocol(Protocol):
         pass
 
 
+class FileRegion(object):
+    """
+    A range of an open file written to a stream by :class:`BufferedWriter`
+    using :func:`os.sendfile`, so its bytes are never copied into the process.
+    The region holds its own duplicate of the file descriptor, closed once the
+    region is written or discarded.
+
+    :param fp:
+        Open file object.
+    :param int offset:
+        Offset of the first byte to write.
+    :param int size:
+        Number of bytes to write.
+    """
+    #: :data:`True` if the platform's :func:`os.sendfile` can write to any
+    #: descriptor, rather than only sockets.
+    supported = hasattr(os, 'sendfile') and sys.platform.startswith('linux')
+
+    truncated_msg = 'file was truncated while it was sent'
+
+    #: Bytes written after the zeros that replace the rest of the region if
+    #: the file ends early, set by :class:`MitogenProtocol` to a dead message
+    #: telling the recipient its data is incomplete.
+    trailer = b('')
+
+    fd = None
+
+    def __init__(self, fp, offset, size):
+        self.fd = os.dup(fp.fileno())
+        self.offset = offset
+        self.size = size
+
+    def __repr__(self):
+        return 'FileRegion(fd %r, offset %d, size %d)' % (
+            self.fd, self.offset, self.size,
+        )
+
+    def __len__(self):
+        return self.size
+
+    def __del__(self):
+        self.close()
+
+    def consume(self, n):
+        """
+        Advance the region past `n` written bytes.
+        """
+        self.offset += n
+        self.size -= n
+
+    def read(self):
+        """
+        Read the remaining bytes of the region into memory.
+        """
+        chunks = []
+        while self.size:
+            s = os.pread(self.fd, self.size, self.offset)
+            if not s:
+                raise StreamError('%r: file was truncated', self)
+            chunks.append(s)
+            self.consume(len(s))
+        return b('').join(chunks)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
 class BufferedWriter(object):
     """
     Implement buffered output while avoiding quadratic string operations. This
@@ -1913,6 +2259,29 @@ class BufferedWriter(object):
         self._buf = collections.deque()
         self._len = 0
 
+    def write_region(self, region):
+        """
+        Like :meth:`write`, but transmit the bytes of the :class:`FileRegion`
+        `region`, closing it once written.
+        """
+        if not region.size:
+            region.close()
+            return
+        if not self._len:
+            try:
+                n = self._protocol.stream.transmit_side.write_region(region)
+                if n:
+                    region.consume(n)
+                    if not region.size:
+                        region.close()
+                        return
+            except OSError:
+                pass
+
+            self._broker._start_transmit(self._protocol.stream)
+        self._buf.append(region)
+        self._len += region.size
+
     def write(self, s):
         """
         Transmit `s` immediately, falling back to enqueuing it and marking the
@@ -1942,11 +2311,33 @@ class BufferedWriter(object):
         """
         if self._buf:
             buf = self._buf.popleft()
-            written = self._protocol.stream.transmit_side.write(buf)
+            is_region = isinstance(buf, FileRegion)
+            if is_region:
+                written = self._protocol.stream.transmit_side.write_region(buf)
+            else:
+                written = self._protocol.stream.transmit_side.write(buf)
+            if is_region and written == 0:
+                # The stream already carries a header promising the missing
+                # bytes, so send zeros in their place, followed by the trailer
+                # failing the transfer.
+                LOG.error('%r: %r was truncated during write', self, buf)
+                self._buf.appendleft(buf.trailer)
+                self._buf.appendleft(b('\x00') * buf.size)
+                self._len += len(buf.trailer)
+                buf.close()
+                return
             if not written:
+                if is_region:
+                    buf.close()
                 _v and LOG.debug('disconnected during write to %r', self)
                 self._protocol.stream.on_disconnect(broker)
                 return
+            elif is_region:
+                buf.consume(written)
+                if buf.size:
+                    self._buf.appendleft(buf)
+                else:
+                    buf.close()
             elif written != len(buf):
                 self._buf.appendleft(BufferType(buf, written))
 
@@ -1985,6 +2376,7 @@ class Side(object):
     """
     _fork_refs = weakref.WeakValueDictionary()
     closed = False
+    _sendfile_ok = True
 
     def __init__(self, stream, fp, cloexec=True, keep_alive=True, blocking=False):
         #: The :class:`Stream` for which this is a read or write side.
@@ -2074,6 +2466,41 @@ class Side(object):
             return None
         return written
 
+    def write_region(self, region):
+        """
+        Like :meth:`write`, but write bytes from the :class:`FileRegion`
+        `region` using :func:`os.sendfile`, falling back to reading a chunk
+        of it when the descriptor does not support :func:`os.sendfile`.
+
+        :returns:
+            Number of bytes written, 0 if the file ended before the region
+            did, or :data:`None` if disconnection was detected.
+        """
+        if self.closed:
+            return None
+
+        if self._sendfile_ok:
+            try:
+                written, disconnected = io_op(os.sendfile, self.fd, region.fd,
+                                              region.offset, region.size)
+            except OSError:
+                e = sys.exc_info()[1]
+                if e.args[0] not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+                LOG.debug('%r: sendfile() unsupported: %s', self, e)
+                self._sendfile_ok = False
+            else:
+                if disconnected:
+                    LOG.debug('%r: disconnected during sendfile: %s',
+                              self, disconnected)
+                    return None
+                return written
+
+        s = os.pread(region.fd, min(region.size, CHUNK_SIZE), region.offset)
+        if not s:
+            return 0
+        return self.write(s)
+
 
 class MitogenProtocol(Protocol):
     """
@@ -2107,6 +2534,9 @@ class MitogenProtocol(Protocol):
             auth_id in ([local_id] + parent_ids)
         )
         self.sent_modules = set(['mitogen', 'mitogen.core'])
+        #: Value of :func:`get_bytecode_magic` announced by the remote in its
+        #: ``GET_MODULE`` requests, or :data:`None`.
+        self.bytecode_magic = None
         self._input_buf = collections.deque()
         self._input_buf_len = 0
         self._writer = BufferedWriter(router.broker, self)
@@ -2207,6 +2637,13 @@ class MitogenProtocol(Protocol):
     def _send(self, msg):
         _vv and IOLOG.debug('%r._send(%r)', self, msg)
         self._writer.write(msg.pack())
+        if msg.region is not None:
+            msg.region.trailer = Message.dead(
+                reason=FileRegion.truncated_msg,
+                dst_id=msg.dst_id,
+                handle=msg.handle,
+            ).pack()
+            self._writer.write_region(msg.region)
 
     def send(self, msg):
         """
@@ -3303,7 +3740,7 @@ class Router(object):
         """
         _vv and IOLOG.debug('%r._async_route(%r, %r)', self, msg, in_stream)
 
-        if len(msg.data) > self.max_message_size:
+        if msg.size() > self.max_message_size:
             self._maybe_send_dead(False, msg, self.too_large_msg % (
                 self.max_message_size,
             ))
@@ -3343,6 +3780,7 @@ class Router(object):
             in_stream.protocol.egress_ids.add(msg.dst_id)
 
         if msg.dst_id == mitogen.context_id:
+            msg.read_region()
             return self._invoke(msg, in_stream)
 
         out_stream = self._stream_by_id.get(msg.dst_id)
@@ -3845,6 +4283,7 @@ class ExternalContext(object):
         self.router = Router(self.broker)
         self.router.debug = self.config.get('debug', False)
         self.router.unidirectional = self.config['unidirectional']
+        self.router.lazy_imports = self.config.get('lazy_imports', False)
         self.router.add_handler(
             fn=self._on_shutdown_msg,
             handle=SHUTDOWN,
@@ -3915,10 +4354,31 @@ class ExternalContext(object):
                 self.config.get('blacklist', ()),
             )
 
+        if self.config.get('lazy_imports'):
+            importer.enable_lazy()
+        bytecode_magic = self.config.get('bytecode_magic')
+        if bytecode_magic and bytecode_magic == get_bytecode_magic():
+            importer.bytecode_magic = bytecode_magic
+        store_id = self.config.get('module_store')
+        if store_id and importer.store is None:
+            importer.store_id = store_id
+
         self.importer = importer
         self.router.importer = importer
         sys.meta_path.insert(0, self.importer)
 
+    def _setup_module_store(self):
+        # Imported only once the parent can serve it, since the store is
+        # optional and would otherwise enlarge every bootstrap.
+        try:
+            import mitogen.module_store
+        except ImportError:
+            LOG.debug('module store unavailable: %s', sys.exc_info()[1])
+            return
+        self.importer.store = mitogen.module_store.ModuleStore.open(
+            self.importer.store_id
+        )
+
     def _setup_package(self):
         global mitogen
         mitogen = imp.new_module('mitogen')
@@ -4023,6 +4483,8 @@ class ExternalContext(object):
                     self.stream.transmit_side.write(b('MITO002\n'))
                 self.broker._py24_25_compat()
                 self.log_handler.uncork()
+                if self.importer.store_id and self.importer.store is None:
+                    self._setup_module_store()
                 self.dispatcher.run()
                 _v and LOG.debug('ExternalContext.main() normal exit')
             except KeyboardInterrupt:
@@ -151,7 +151,7 @@ class Options(mitogen.parent.Options):
 
     def __init__(self, old_router, max_message_size, on_fork=None, debug=False,
                  profiling=False, unidirectional=False, on_start=None,
-                 name=None):
+                 name=None, lazy_imports=False):
         if not FORK_SUPPORTED:
             raise Error(self.python_version_msg)
 
@@ -159,6 +159,7 @@ class Options(mitogen.parent.Options):
         super(Options, self).__init__(
             max_message_size=max_message_size, debug=debug,
             profiling=profiling, unidirectional=unidirectional, name=name,
+            lazy_imports=lazy_imports,
         )
         self.on_fork = on_fork
         self.on_start = on_start
@@ -35,17 +35,23 @@ be sent to any context that will be used to establish additional child
 contexts.
 """
 
+import binascii
 import dis
 import errno
+import fcntl
 import imp
 import inspect
 import itertools
 import logging
+import marshal
+import mmap
 import os
 import pkgutil
 import re
 import string
+import struct
 import sys
+import tempfile
 import threading
 import types
 import zlib
@@ -55,6 +61,16 @@ try:
 except ImportError:
     sysconfig = None
 
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 if not hasattr(pkgutil, 'find_loader'):
     # find_loader() was new in >=2.5, but the modern pkgutil.py syntax has
     # been kept intentionally 2.3 compatible so we can reuse it.
@@ -66,6 +82,7 @@ import mitogen.minify
 import mitogen.parent
 
 from mitogen.core import b
+from mitogen.core import bytes_partition
 from mitogen.core import IOLOG
 from mitogen.core import LOG
 from mitogen.core import str_partition
@@ -144,13 +161,42 @@ def is_stdlib_name(modname):
 _STDLIB_PATHS = _stdlib_paths()
 
 
+def _build_path_trie(paths):
+    """
+    Return a trie of nested dicts keyed by path component, where the
+    :data:`None` key marks the end of a path in `paths`.
+    """
+    trie = {}
+    for path in paths:
+        if path:
+            node = trie
+            for part in path.split(os.sep):
+                node = node.setdefault(part, {})
+            node[None] = True
+    return trie
+
+
+_STDLIB_TRIE = _build_path_trie(_STDLIB_PATHS)
+
+
 def is_stdlib_path(path):
-    return any(
-        os.path.commonprefix((libpath, path)) == libpath
-        and 'site-packages' not in path
-        and 'dist-packages' not in path
-        for libpath in _STDLIB_PATHS
-    )
+    """
+    Return :data:`True` if `path` lies beneath a standard library directory,
+    outside of any site-packages directory. The path is walked once
+    through a trie of :data:`_STDLIB_PATHS`, rather than compared against
+    each directory in turn.
+    """
+    if 'site-packages' in path or 'dist-packages' in path:
+        return False
+
+    node = _STDLIB_TRIE
+    for part in path.split(os.sep):
+        if None in node:
+            return True
+        node = node.get(part)
+        if node is None:
+            return False
+    return None in node
 
 
 def get_child_modules(path, fullname):
@@ -241,6 +287,9 @@ if mitogen.is_master:
 
 LOAD_CONST = dis.opname.index('LOAD_CONST')
 IMPORT_NAME = dis.opname.index('IMPORT_NAME')
+EXTENDED_ARG = dis.opname.index('EXTENDED_ARG')
+_IMPORT_NAME_BYTE = struct.pack('B', IMPORT_NAME)
+_EXTENDED_ARG_BYTE = struct.pack('B', EXTENDED_ARG)
 
 
 def _getarg(nextb, c):
@@ -269,6 +318,24 @@ else:
         return ((c, nextb()) for c in ordit)
 
 
+def _fold_extended_args(ops):
+    # Yield `(op, oparg)` tuples from `ops` with the argument of each
+    # EXTENDED_ARG prefix folded into that of the instruction it extends.
+    if sys.version_info >= (3, 6):
+        shift = 8
+    else:
+        shift = 16
+    ext = 0
+    for op, arg in ops:
+        if op == EXTENDED_ARG:
+            ext = (ext | arg) << shift
+            continue
+        if ext:
+            arg |= ext
+            ext = 0
+        yield op, arg
+
+
 def scan_code_imports(co):
     """
     Given a code object `co`, scan its bytecode yielding any ``IMPORT_NAME``
@@ -285,30 +352,37 @@ def scan_code_imports(co):
         * `namelist`: for `ImportFrom`, the list of names to be imported from
           `modname`.
     """
-    opit = iter_opcodes(co)
-    opit, opit2, opit3 = itertools.tee(opit, 3)
-
-    try:
-        next(opit2)
-        next(opit3)
-        next(opit3)
-    except StopIteration:
+    code = co.co_code
+    if sys.version_info >= (3, 6) and _EXTENDED_ARG_BYTE not in code[::2]:
+        # Wordcode without EXTENDED_ARG: every instruction is 2 bytes with
+        # its whole argument in the second, so search the bytecode for
+        # IMPORT_NAME directly instead of decoding each instruction.
+        i = code.find(_IMPORT_NAME_BYTE, 4)
+        while i != -1:
+            if not (i & 1) and code[i-4] == code[i-2] == LOAD_CONST:
+                yield (co.co_consts[code[i-3]],
+                       co.co_names[code[i+1]],
+                       co.co_consts[code[i-1]] or ())
+            i = code.find(_IMPORT_NAME_BYTE, i + 1)
         return
 
+    ops = list(_fold_extended_args(iter_opcodes(co)))
     if sys.version_info >= (2, 5):
-        for oparg1, oparg2, (op3, arg3) in izip(opit, opit2, opit3):
+        for i in range(2, len(ops)):
+            op3, arg3 = ops[i]
             if op3 == IMPORT_NAME:
-                op2, arg2 = oparg2
-                op1, arg1 = oparg1
+                op2, arg2 = ops[i-1]
+                op1, arg1 = ops[i-2]
                 if op1 == op2 == LOAD_CONST:
                     yield (co.co_consts[arg1],
                            co.co_names[arg3],
                            co.co_consts[arg2] or ())
     else:
         # Python 2.4 did not yet have 'level', so stack format differs.
-        for oparg1, (op2, arg2) in izip(opit, opit2):
+        for i in range(1, len(ops)):
+            op2, arg2 = ops[i]
             if op2 == IMPORT_NAME:
-                op1, arg1 = oparg1
+                op1, arg1 = ops[i-1]
                 if op1 == LOAD_CONST:
                     yield (-1, co.co_names[arg2], co.co_consts[arg1] or ())
 
@@ -812,6 +886,10 @@ class ModuleFinder(object):
         #: Avoid repeated dependency scanning, which is expensive.
         self._related_cache = {}
 
+        #: Names installed by :meth:`add_source_override`, whose source may
+        #: not match the module's loader.
+        self._overridden = set()
+
     def __repr__(self):
         return 'ModuleFinder()'
 
@@ -833,6 +911,8 @@ class ModuleFinder(object):
             :data:`True` if the module is a package.
         """
         self._found_cache[fullname] = (path, source, is_pkg)
+        self._overridden.add(fullname)
+        self._related_cache.pop(fullname, None)
 
     get_module_methods = [
         DefectivePython3xMainMethod(),
@@ -891,13 +971,33 @@ class ModuleFinder(object):
             fullname, _, _ = str_rpartition(to_text(fullname), u'.')
             yield fullname
 
+    def _get_code(self, fullname, path, source):
+        """
+        Return a code object for `source`, reusing the loader of an already
+        imported module when it can supply one from its bytecode cache, since
+        compiling large modules dominates :meth:`find_related_imports`.
+        """
+        module = sys.modules.get(fullname)
+        loader = getattr(module, '__loader__', None)
+        if (fullname not in self._overridden and
+                getattr(module, '__file__', None) == path and
+                hasattr(loader, 'get_code')):
+            try:
+                co = loader.get_code(fullname)
+                if co is not None:
+                    return co
+            except Exception:
+                LOG.debug('%r: %r.get_code(%r) failed', self, loader,
+                          fullname, exc_info=True)
+        return compile(source, path, 'exec')
+
     def find_related_imports(self, fullname):
         """
         Return a list of non-stdlib modules that are directly imported by
         `fullname`, plus their parents.
 
-        The list is determined by retrieving the source code of
-        `fullname`, compiling it, and examining all IMPORT_NAME ops.
+        The list is determined by retrieving the code object of `fullname`,
+        compiling its source if necessary, and examining all IMPORT_NAME ops.
 
         :param fullname: Fully qualified name of an *already imported* module
             for which source code can be retrieved
@@ -913,7 +1013,7 @@ class ModuleFinder(object):
 
         maybe_names = list(self.generate_parent_names(fullname))
 
-        co = compile(src, modpath, 'exec')
+        co = self._get_code(fullname, modpath, src)
         for level, modname, namelist in scan_code_imports(co):
             if level == -1:
                 modnames = [modname, '%s.%s' % (fullname, modname)]
@@ -951,20 +1051,165 @@ class ModuleFinder(object):
             for which source code can be retrieved
         :type fullname: str
         """
-        stack = [fullname]
-        found = set()
+        # Breadth-first walk of the import graph, where `queue` doubles as
+        # the visit order and `seen` as its index, so each module's edges
+        # are scanned exactly once.
+        queue = [fullname]
+        seen = set(queue)
+        i = 0
+        while i < len(queue):
+            for name in self.find_related_imports(queue[i]):
+                if name not in seen:
+                    seen.add(name)
+                    queue.append(name)
+            i += 1
+
+        seen.discard(fullname)
+        return sorted(seen)
+
+
+class ModuleBundle(object):
+    """
+    Read-only view of a bundle file written by :meth:`write`, holding
+    prebuilt :class:`ModuleResponder` responses. The file is memory-mapped,
+    so only the compressed source of modules actually served is read.
 
-        while stack:
-            name = stack.pop(0)
-            names = self.find_related_imports(name)
-            stack.extend(set(names).difference(set(found).union(stack)))
-            found.update(names)
+    The file is a magic string, a 4 byte big-endian index length, a JSON
+    index, then the compressed source of each module. The index maps each
+    module name to a list of `[path, digest, is_pkg, offset, size,
+    related]`, where `digest` is the hex SHA-1 digest of the module's original
+    source, and `offset` is relative to the end of the index. JSON is used
+    rather than pickle, since the file may be writeable by others.
+
+    :param str path:
+        Path to the bundle file.
+    :raises mitogen.core.Error:
+        The file is not a module bundle.
+    """
+    magic = b('MITOGEN-BUNDLE-2\n')
+    not_bundle_msg = '%r is not a module bundle'
+
+    def __init__(self, path):
+        self.path = path
+        fp = open(path, 'rb')
+        try:
+            size = os.fstat(fp.fileno()).st_size
+            hdr_len = len(self.magic) + 4
+            if size < hdr_len:
+                raise mitogen.core.Error(self.not_bundle_msg, path)
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+        if self.data[:len(self.magic)] != self.magic:
+            self.data.close()
+            raise mitogen.core.Error(self.not_bundle_msg, path)
+        index_len, = struct.unpack('>L', self.data[len(self.magic):hdr_len])
+        self.base = hdr_len + index_len
+        try:
+            self.index = json.loads(
+                self.data[hdr_len:self.base].decode('utf-8')
+            )
+        except ValueError:
+            self.data.close()
+            raise mitogen.core.Error(self.not_bundle_msg, path)
+        if not isinstance(self.index, dict):
+            self.data.close()
+            raise mitogen.core.Error(self.not_bundle_msg, path)
+
+    def __repr__(self):
+        return 'ModuleBundle(%r)' % (self.path,)
 
-        found.discard(fullname)
-        return sorted(found)
+    def get(self, fullname, path, source, is_pkg):
+        """
+        Return the compressed source and related module names bundled for
+        `fullname`, or :data:`None` if it is absent, or was bundled from a
+        different `path` or `source`.
+        """
+        entry = self.index.get(fullname)
+        if entry is None:
+            return None
+        bpath, digest, bis_pkg, offset, size, related = entry
+        if bpath != path or bis_pkg != bool(is_pkg) or \
+                digest != to_text(sha1(source).hexdigest()):
+            LOG.debug('%r: %s is stale', self, fullname)
+            return None
+        offset += self.base
+        return self.data[offset:offset + size], related
+
+    def entries(self):
+        """
+        Yield each bundled module in the form accepted by :meth:`write`.
+        """
+        for fullname, entry in self.index.items():
+            path, digest, is_pkg, offset, size, related = entry
+            offset += self.base
+            yield (fullname, path, digest, is_pkg,
+                   self.data[offset:offset + size], related)
+
+    def close(self):
+        self.data.close()
+
+    @classmethod
+    def write(cls, path, entries):
+        """
+        Atomically replace `path` with a bundle of `entries`, a sequence of
+        `(fullname, path, digest, is_pkg, compressed, related)` tuples.
+        """
+        index = {}
+        offset = 0
+        for fullname, mpath, digest, is_pkg, compressed, related in entries:
+            index[fullname] = [mpath, digest, is_pkg, offset,
+                               len(compressed), list(related)]
+            offset += len(compressed)
+
+        index_s = json.dumps(index).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(prefix='.mitogen-bundle',
+                                        dir=os.path.dirname(path) or '.')
+        fp = os.fdopen(fd, 'wb')
+        try:
+            try:
+                fp.write(cls.magic)
+                fp.write(struct.pack('>L', len(index_s)))
+                fp.write(index_s)
+                for _, _, _, _, compressed, _ in entries:
+                    fp.write(compressed)
+            finally:
+                fp.close()
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
 
 
 class ModuleResponder(object):
+    """
+    Respond to ``GET_MODULE`` requests from children. Responses for modules
+    not already cached are built by :attr:`worker_count` worker threads, since
+    finding, compiling, minifying and compressing source would otherwise stall
+    routing for every stream. Replies are posted back to the broker thread
+    when ready, and concurrent requests for a module being built share its
+    result.
+    """
+    #: Number of threads building uncached responses.
+    worker_count = 2
+
+    #: Identifier of the host-local :class:`mitogen.module_store.ModuleStore`
+    #: children share modules through, set by :meth:`enable_module_store`.
+    store_id = None
+
+    #: Value of :func:`mitogen.core.get_bytecode_magic` if responses include
+    #: compiled code, set by :meth:`enable_bytecode`.
+    bytecode_magic = None
+
+    #: If :data:`True`, responses list the modules named by import statements
+    #: of their module, set by :meth:`enable_prefetch`.
+    prefetch_imports = False
+
+    #: Module name prefixes, see :func:`mitogen.core.prefix_list`.
+    whitelist = mitogen.core.prefix_list('whitelist')
+    blacklist = mitogen.core.prefix_list('blacklist')
+
     def __init__(self, router):
         self._log = logging.getLogger('mitogen.responder')
         self._router = router
@@ -973,12 +1218,27 @@ class ModuleResponder(object):
         self.blacklist = []
         self.whitelist = ['']
 
+        #: Serialize :attr:`_building` and statistics updated by workers.
+        self._lock = threading.Lock()
+        #: fullname -> [callback, ..] for modules being built by a worker.
+        self._building = {}
+        #: Module names awaiting a worker.
+        self._queue = mitogen.core.Latch()
+        #: :class:`ModuleBundle` loaded by :meth:`load_bundle`, if any.
+        self._bundle = None
+        self._workers = []
+        mitogen.core.listen(router.broker, 'exit', self._on_broker_exit)
+
         #: Context -> set([fullname, ..])
         self._forwarded_by_context = {}
+        #: Profile key -> [fullname, ..] in the order first requested.
+        self._profiles = {}
+        #: Context ID -> profile key, see :meth:`profile_context`.
+        self._profile_key_by_id = {}
 
         #: Number of GET_MODULE messages received.
         self.get_module_count = 0
-        #: Total time spent in uncached GET_MODULE.
+        #: Total time spent building uncached GET_MODULE responses.
         self.get_module_secs = 0.0
         #: Total time spent minifying modules.
         self.minify_secs = 0.0
@@ -988,6 +1248,13 @@ class ModuleResponder(object):
         self.good_load_module_size = 0
         #: Number of negative LOAD_MODULE messages sent.
         self.bad_load_module_count = 0
+        #: Number of responses found in the bundle.
+        self.bundle_hit_count = 0
+        #: Number of responses built while a bundle was loaded, because they
+        #: were absent from it or stale.
+        self.bundle_miss_count = 0
+        #: Number of modules forwarded because a profile listed them.
+        self.profile_forward_count = 0
 
         router.add_handler(
             fn=self._on_get_module,
@@ -1016,10 +1283,10 @@ class ModuleResponder(object):
     def whitelist_prefix(self, fullname):
         if self.whitelist == ['']:
             self.whitelist = ['mitogen']
-        self.whitelist.append(fullname)
+        self.whitelist = self.whitelist + [fullname]
 
     def blacklist_prefix(self, fullname):
-        self.blacklist.append(fullname)
+        self.blacklist = self.blacklist + [fullname]
 
     def neutralize_main(self, path, src):
         """
@@ -1066,11 +1333,21 @@ class ModuleResponder(object):
             self._cache[fullname] = tup
             return tup
 
+        tup = self._get_bundled(fullname, path, source, is_pkg)
+        if tup is not None:
+            tup = self._add_code(tup, source)
+            self._cache[fullname] = tup
+            return tup
+
         if self.minify_safe_re.search(source):
             # If the module contains a magic marker, it's safe to minify.
             t0 = mitogen.core.now()
             source = mitogen.minify.minimize_source(source).encode('utf-8')
-            self.minify_secs += mitogen.core.now() - t0
+            self._lock.acquire()
+            try:
+                self.minify_secs += mitogen.core.now() - t0
+            finally:
+                self._lock.release()
 
         if is_pkg:
             pkg_present = get_child_modules(path, fullname)
@@ -1088,19 +1365,508 @@ class ModuleResponder(object):
             if not mitogen.core.is_blacklisted_import(self, name)
         ]
         # 0:fullname 1:pkg_present 2:path 3:compressed 4:related
-        tup = (
+        tup = self._add_code((
             to_text(fullname),
             pkg_present,
             to_text(path),
             compressed,
             related
-        )
+        ), source)
         self._cache[fullname] = tup
         return tup
 
-    def _send_load_module(self, stream, fullname):
+    def _get_bundled(self, fullname, path, source, is_pkg):
+        """
+        Return the response for `fullname` from the loaded bundle, or
+        :data:`None` if no bundle is loaded, or its entry is absent or stale.
+        """
+        if self._bundle is None or fullname == '__main__':
+            return None
+
+        found = self._bundle.get(to_text(fullname), to_text(path), source,
+                                 is_pkg)
+        self._lock.acquire()
+        try:
+            if found is None:
+                self.bundle_miss_count += 1
+            else:
+                self.bundle_hit_count += 1
+        finally:
+            self._lock.release()
+        if found is None:
+            return None
+
+        compressed, related = found
+        if is_pkg:
+            pkg_present = get_child_modules(path, fullname)
+        else:
+            pkg_present = None
+        # 0:fullname 1:pkg_present 2:path 3:compressed 4:related
+        return (
+            to_text(fullname),
+            pkg_present,
+            to_text(path),
+            mitogen.core.Blob(compressed),
+            [
+                name
+                for name in related
+                if not mitogen.core.is_blacklisted_import(self, name)
+            ],
+        )
+
+    def enable_bytecode(self):
+        """
+        Include code compiled by this process in responses built after this
+        call, and send it to children whose Python interpreter reports the
+        same magic number and optimization level, sparing them from compiling
+        each module's source. Other children receive only source.
+        """
+        self.bytecode_magic = mitogen.core.get_bytecode_magic()
+
+    def enable_prefetch(self):
+        """
+        Include in responses built after this call the names of modules that
+        import statements of each module refer to, including those within
+        functions. Before executing the module, a child requests each of them
+        it lacks without awaiting the replies, so fetching modules this
+        process never imported costs one round-trip rather than one per
+        import. Modules imported only by functions never called are fetched
+        too. See :meth:`mitogen.core.Importer.prefetch`.
+        """
+        self.prefetch_imports = True
+
+    def _add_code(self, tup, source):
+        """
+        Return the response `tup` with the compiled code of its module
+        appended if :meth:`enable_bytecode` was called, followed by a flag
+        telling lazy importers whether `source` must execute at import, and
+        if :meth:`enable_prefetch` was called, the names of modules it
+        imports.
+        """
+        compiled = None
+        if self.bytecode_magic is not None or self.prefetch_imports:
+            try:
+                compiled = compile(zlib.decompress(tup[3]),
+                                   u'master:' + tup[2], 'exec', 0, 1)
+            except SyntaxError:
+                # Let the child compile it, and report the error.
+                pass
+
+        code = None
+        if compiled is not None and self.bytecode_magic is not None:
+            code = (self.bytecode_magic, mitogen.core.Blob(
+                zlib.compress(marshal.dumps(compiled), 9)
+            ))
+
+        # A module replacing itself in sys.modules (#590) cannot be deferred,
+        # since its importer would keep the replaced module.
+        eager = b('sys.modules') in source
+        # 5:(bytecode_magic, compressed marshalled code) or None 6:eager
+        tup += (code, eager)
+        if self.prefetch_imports:
+            # 7:names of modules it imports
+            tup += (self._get_imports(tup, compiled),)
+        return tup
+
+    def _get_imports(self, tup, co):
+        """
+        Return sorted absolute names of modules, and their parent packages,
+        that import statements in the code object `co` of the response `tup`
+        or the code objects nested within it refer to, excluding blacklisted
+        and standard library modules. Names imported from a package are
+        included when the package contains a submodule of that name.
+        """
+        if co is None:
+            return []
+
+        fullname = tup[0]
+        if tup[1] is None:
+            pkgname = str_rpartition(fullname, u'.')[0]
+        else:
+            pkgname = fullname
+
+        names = set()
+        stack = [co]
+        while stack:
+            co = stack.pop()
+            stack.extend(c for c in co.co_consts if isinstance(c, type(co)))
+            for level, modname, namelist in scan_code_imports(co):
+                if level > 0:
+                    bits = pkgname.split(u'.')
+                    if not pkgname or level - 1 >= len(bits):
+                        # This would be an ImportError in real code.
+                        continue
+                    base = u'.'.join(bits[:len(bits) - (level - 1)])
+                    modname = u'.'.join(n for n in (base, modname) if n)
+
+                names.add(modname)
+                names.update(self._finder.generate_parent_names(modname))
+                if namelist:
+                    present = self._get_child_modules(modname)
+                    names.update(modname + u'.' + name
+                                 for name in namelist
+                                 if name in present)
+
+        return sorted(
+            to_text(name)
+            for name in names
+            if name != fullname
+            and not mitogen.core.is_blacklisted_import(self, name)
+            and not self._is_stdlib(name)
+        )
+
+    def _is_stdlib(self, fullname):
+        """
+        Like :func:`is_stdlib_name`, but also recognize modules this process
+        has not imported by the location of their top-level package.
+        """
+        root = str_partition(fullname, u'.')[0]
+        if is_stdlib_name(fullname) or is_stdlib_name(root):
+            return True
+        path = self._finder.get_module_source(root)[0]
+        return bool(path) and is_stdlib_path(path)
+
+    def _get_child_modules(self, fullname):
+        """
+        Return names of submodules of the package `fullname`, or an empty
+        list if it is not a package with source.
+        """
+        if mitogen.core.is_blacklisted_import(self, fullname):
+            return []
+        path, _, is_pkg = self._finder.get_module_source(fullname)
+        if not is_pkg or is_stdlib_path(path):
+            return []
+        return get_child_modules(path, fullname)
+
+    def enable_module_store(self):
+        """
+        Have children started after this call share modules they receive with
+        later children running as the same user on the same host, through a
+        :class:`mitogen.module_store.ModuleStore` private to this master. A
+        child finding a module in the store imports it without sending
+        ``GET_MODULE``. Children import :mod:`mitogen.module_store` after
+        starting, so the bootstrap of other children is unchanged.
+        """
+        if self.store_id is None:
+            self.store_id = mitogen.core.to_text(
+                binascii.hexlify(os.urandom(16))
+            )
+
+    def load_bundle(self, path):
+        """
+        Serve responses from the bundle file at `path`, written by
+        :meth:`save_bundle`, rather than building them. Each response is used
+        only if the module's current source matches the bundled digest.
+
+        :raises mitogen.core.Error:
+            The file is not a module bundle.
+        """
+        self._bundle = ModuleBundle(path)
+        self._log.debug('%r: loaded %d modules from %r',
+                        self, len(self._bundle.index), path)
+
+    def save_bundle(self, path, fullnames=None):
+        """
+        Write responses for `fullnames` and their related modules to a bundle
+        file at `path`, for a later :meth:`load_bundle`. Entries of any loaded
+        bundle, and of the file as it exists when saving, are kept unless a
+        module was served from newer source, so processes sharing the file do
+        not discard each other's entries. Saves are serialized by a lock on
+        ``<path>.lock``.
+
+        :param list fullnames:
+            Names of modules to build responses for, or :data:`None` to write
+            the responses already built, such as every module served so far.
+        """
+        if fullnames is None:
+            tups = list(self._cache.values())
+        else:
+            tups = []
+            for fullname in fullnames:
+                tup, related = self._build_tuples(fullname)
+                tups.append(tup)
+                tups.extend(related)
+
+        lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT,
+                          int('0600', 8))
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            self._save_bundle(path, tups)
+        finally:
+            os.close(lock_fd)
+
+    def _save_bundle(self, path, tups):
+        entries = {}
+        if self._bundle is not None:
+            for entry in self._bundle.entries():
+                entries[entry[0]] = entry
+
+        if os.path.exists(path):
+            try:
+                bundle = ModuleBundle(path)
+            except Exception:
+                self._log.debug('%r: discarding unreadable %r', self, path,
+                                exc_info=True)
+            else:
+                try:
+                    for entry in bundle.entries():
+                        entries[entry[0]] = entry
+                finally:
+                    bundle.close()
+
+        for tup in tups:
+            fullname, _, mpath, compressed, related = tup[:5]
+            if mpath is None or fullname == '__main__':
+                continue  # Negative response.
+            _, source, is_pkg = self._finder.get_module_source(fullname)
+            entries[fullname] = (
+                fullname,
+                mpath,
+                to_text(sha1(source).hexdigest()),
+                bool(is_pkg),
+                mitogen.core.BytesType(compressed),
+                list(related),
+            )
+
+        ModuleBundle.write(path, list(entries.values()))
+        self._log.debug('%r: saved %d modules to %r',
+                        self, len(entries), path)
+
+    #: Most module names recorded for each profile.
+    max_profile_size = 500
+
+    def profile_context(self, context, key):
+        """
+        Record the names of modules `context` requests under the profile
+        `key`, and forward to it any modules already recorded for `key`, so
+        a context starting a familiar workload receives the modules it will
+        import without requesting each in turn. Modules imported by children
+        of `context` are included, as `context` requests them on their behalf.
+        Call this as soon as `context` is constructed.
+
+        :param str key:
+            Identifies the kind of context, such as the program it will run
+            and the interpreter it runs on.
+        """
+        self._lock.acquire()
+        try:
+            self._profile_key_by_id[context.context_id] = key
+            fullnames = list(self._profiles.get(key, ()))
+            self.profile_forward_count += len(fullnames)
+        finally:
+            self._lock.release()
+
+        mitogen.core.listen(context, 'disconnect',
+                            lambda: self._on_profiled_disconnect(context))
+        if fullnames:
+            self._log.debug('%r: forwarding %d modules profiled for %r to %r',
+                            self, len(fullnames), key, context)
+            self.forward_modules(context, fullnames)
+
+    def _on_profiled_disconnect(self, context):
+        self._lock.acquire()
+        try:
+            self._profile_key_by_id.pop(context.context_id, None)
+        finally:
+            self._lock.release()
+
+    def _record_if_found(self, key, fullname):
+        # Names answered negatively would reach every later context of the
+        # kind as failed LOAD_MODULEs, so only record modules that were found.
+        tup = self._cache.get(fullname)
+        if tup is not None and tup[2] is not None:
+            self._record_profile(key, [fullname])
+
+    def _record_profile(self, key, fullnames):
+        self._lock.acquire()
+        try:
+            profile = self._profiles.setdefault(key, [])
+            for fullname in fullnames:
+                if len(profile) >= self.max_profile_size:
+                    break
+                if fullname != '__main__' and fullname not in profile:
+                    profile.append(fullname)
+        finally:
+            self._lock.release()
+
+    def load_profiles(self, path):
+        """
+        Merge profiles from the file at `path`, written by
+        :meth:`save_profiles`, into those recorded so far.
+
+        :raises mitogen.core.Error:
+            The file is not a profile file.
+        """
+        for key, fullnames in self._read_profiles(path).items():
+            self._record_profile(key, fullnames)
+
+    def _read_profiles(self, path):
+        fp = open(path, 'rb')
+        try:
+            data = fp.read()
+        finally:
+            fp.close()
+        try:
+            profiles = json.loads(data.decode('utf-8'))
+        except ValueError:
+            profiles = None
+        if not isinstance(profiles, dict):
+            raise mitogen.core.Error('%r is not a module profile file', path)
+        return profiles
+
+    def save_profiles(self, path):
+        """
+        Write the profiles recorded by :meth:`profile_context` to `path`,
+        merged with any the file already holds, so processes sharing the
+        file do not discard each other's profiles. The file is replaced
+        atomically.
+        """
+        profiles = {}
+        if os.path.exists(path):
+            try:
+                profiles = self._read_profiles(path)
+            except Exception:
+                self._log.debug('%r: discarding unreadable %r', self, path,
+                                exc_info=True)
+
+        self._lock.acquire()
+        try:
+            for key, fullnames in self._profiles.items():
+                profile = profiles.setdefault(key, [])
+                for fullname in fullnames:
+                    if (len(profile) < self.max_profile_size and
+                            fullname not in profile):
+                        profile.append(fullname)
+        finally:
+            self._lock.release()
+
+        data = json.dumps(profiles, indent=1, sort_keys=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.mitogen-profile',
+                                        dir=os.path.dirname(path) or '.')
+        fp = os.fdopen(fd, 'wb')
+        try:
+            try:
+                fp.write(data.encode('utf-8'))
+            finally:
+                fp.close()
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self._log.debug('%r: saved %d profiles to %r',
+                        self, len(profiles), path)
+
+    def _build_tuples(self, fullname):
+        """
+        Return a tuple of the response for `fullname`, and the list of
+        responses for its related modules that could be built.
+        """
+        tup = self._build_tuple(fullname)
+        related = []
+        for name in tup[4]:
+            try:
+                related.append(self._build_tuple(name))
+            except Exception:
+                LOG.debug('While importing %r related to %r', name, fullname,
+                          exc_info=True)
+        return tup, related
+
+    def _get_cached_tuples(self, fullname):
+        """
+        Return the result of :meth:`_build_tuples` if every response is
+        cached already, otherwise :data:`None`.
+        """
+        tup = self._cache.get(fullname)
+        if tup is None:
+            return None
+        related = []
+        for name in tup[4]:
+            rtup = self._cache.get(name)
+            if rtup is None:
+                return None
+            related.append(rtup)
+        return tup, related
+
+    def _start_workers(self):
+        while len(self._workers) < self.worker_count:
+            thread = threading.Thread(
+                name='mitogen.ModuleResponder.%d' % (len(self._workers),),
+                target=mitogen.core._profile_hook,
+                args=('mitogen.responder', self._worker_main),
+            )
+            thread.setDaemon(True)
+            thread.start()
+            self._workers.append(thread)
+
+    def _on_broker_exit(self):
+        self._queue.close()
+        for thread in self._workers:
+            thread.join()
+
+    def _worker_main(self):
+        while True:
+            try:
+                fullname = self._queue.get()
+            except mitogen.core.LatchError:
+                return
+
+            t0 = mitogen.core.now()
+            try:
+                tuples = self._build_tuples(fullname)
+            except Exception:
+                LOG.debug('While importing %r', fullname, exc_info=True)
+                tuples = None
+
+            self._lock.acquire()
+            try:
+                self.get_module_secs += mitogen.core.now() - t0
+            finally:
+                self._lock.release()
+
+            try:
+                self._router.broker.defer(self._on_built, fullname, tuples)
+            except mitogen.core.Error:
+                return  # Broker is shutting down.
+
+    def _on_built(self, fullname, tuples):
+        self._lock.acquire()
+        try:
+            callbacks = self._building.pop(fullname)
+        finally:
+            self._lock.release()
+        for callback in callbacks:
+            callback(tuples)
+
+    def _get_tuples(self, fullname, callback):
+        """
+        Arrange for `callback(tuples)` to run on the broker thread, with the
+        result of :meth:`_build_tuples` for `fullname`, or :data:`None` if it
+        failed. Runs `callback` immediately if every response is cached,
+        otherwise after a worker has built them.
+        """
+        tuples = self._get_cached_tuples(fullname)
+        if tuples is not None:
+            callback(tuples)
+            return
+
+        self._lock.acquire()
+        try:
+            callbacks = self._building.get(fullname)
+            if callbacks is not None:
+                callbacks.append(callback)
+                return
+            self._building[fullname] = [callback]
+            self._start_workers()
+        finally:
+            self._lock.release()
+        self._queue.put(fullname)
+
+    def _send_load_module(self, stream, tup):
+        fullname = tup[0]
+        if len(tup) > 5 and tup[5] and (
+                tup[5][0] != stream.protocol.bytecode_magic):
+            tup = tup[:5] + (None,) + tup[6:]
         if fullname not in stream.protocol.sent_modules:
-            tup = self._build_tuple(fullname)
             msg = mitogen.core.Message.pickled(
                 tup,
                 dst_id=stream.protocol.remote_id,
@@ -1126,23 +1892,39 @@ class ModuleResponder(object):
             )
         )
 
-    def _send_module_and_related(self, stream, fullname):
+    def _send_tuples(self, stream, fullname, tuples):
         if fullname in stream.protocol.sent_modules:
             return
-
-        try:
-            tup = self._build_tuple(fullname)
-            for name in tup[4]:  # related
-                parent, _, _ = str_partition(name, '.')
-                if parent != fullname and parent not in stream.protocol.sent_modules:
-                    # Parent hasn't been sent, so don't load submodule yet.
-                    continue
-
-                self._send_load_module(stream, name)
-            self._send_load_module(stream, fullname)
-        except Exception:
-            LOG.debug('While importing %r', fullname, exc_info=True)
+        if tuples is None:
             self._send_module_load_failed(stream, fullname)
+            return
+
+        tup, related = tuples
+        for rtup in related:
+            parent, _, _ = str_partition(rtup[0], '.')
+            if parent != fullname and parent not in stream.protocol.sent_modules:
+                # Parent hasn't been sent, so don't load submodule yet.
+                continue
+
+            self._send_load_module(stream, rtup)
+        self._send_load_module(stream, tup)
+
+    def _send_module_and_related(self, stream, fullname, on_sent=None):
+        """
+        Send `fullname` and its related modules to `stream`, then call
+        `on_sent()` if it is not :data:`None`. If any response is not yet
+        cached, this happens after a worker thread has built it.
+        """
+        if fullname in stream.protocol.sent_modules:
+            if on_sent is not None:
+                on_sent()
+            return
+
+        def on_built(tuples):
+            self._send_tuples(stream, fullname, tuples)
+            if on_sent is not None:
+                on_sent()
+        self._get_tuples(fullname, on_built)
 
     def _on_get_module(self, msg):
         if msg.is_dead:
@@ -1152,18 +1934,21 @@ class ModuleResponder(object):
         if stream is None:
             return
 
-        fullname = msg.data.decode()
+        fullname, _, magic = bytes_partition(msg.data, b('\x00'))
+        fullname = fullname.decode()
+        if magic and msg.src_id == stream.protocol.remote_id:
+            stream.protocol.bytecode_magic = magic.decode()
         self._log.debug('%s requested module %s', stream.name, fullname)
         self.get_module_count += 1
+        key = self._profile_key_by_id.get(msg.src_id)
+        on_sent = None
+        if key is not None:
+            on_sent = lambda: self._record_if_found(key, fullname)
         if fullname in stream.protocol.sent_modules:
             LOG.warning('_on_get_module(): dup request for %r from %r',
                         fullname, stream)
 
-        t0 = mitogen.core.now()
-        try:
-            self._send_module_and_related(stream, fullname)
-        finally:
-            self.get_module_secs += mitogen.core.now() - t0
+        self._send_module_and_related(stream, fullname, on_sent)
 
     def _send_forward_module(self, stream, context, fullname):
         if stream.protocol.remote_id != context.context_id:
@@ -1195,9 +1980,17 @@ class ModuleResponder(object):
                       '%r', self, path[0], context)
             return
 
-        for fullname in reversed(path):
-            self._send_module_and_related(stream, fullname)
+        # Forward parents first, each only after its LOAD_MODULE was sent.
+        def forward(fullname):
             self._send_forward_module(stream, context, fullname)
+            forward_next()
+
+        def forward_next():
+            if path:
+                fullname = path.pop()
+                self._send_module_and_related(stream, fullname,
+                                              lambda: forward(fullname))
+        forward_next()
 
     def _forward_modules(self, context, fullnames):
         IOLOG.debug('%r._forward_modules(%r, %r)', self, context, fullnames)
@@ -1287,6 +2080,10 @@ class Router(mitogen.parent.Router):
     #:      mitogen.master.Router.profiling = True
     profiling = os.environ.get('MITOGEN_PROFILING') is not None
 
+    #: Integer total bytes of message payloads routed, including messages
+    #: merely forwarded between children. Updated on the broker thread.
+    routed_bytes = 0
+
     def __init__(self, broker=None, max_message_size=None):
         if broker is None:
             broker = self.broker_class()
@@ -1306,6 +2103,10 @@ class Router(mitogen.parent.Router):
             persist=True,
         )
 
+    def _async_route(self, msg, in_stream=None):
+        self.routed_bytes += msg.size()
+        super(Router, self)._async_route(msg, in_stream)
+
     def _on_broker_exit(self):
         super(Router, self)._on_broker_exit()
         dct = self.get_stats()
@@ -1342,8 +2143,9 @@ class Router(mitogen.parent.Router):
 
             * `get_module_count`: Integer count of
               :data:`mitogen.core.GET_MODULE` messages received.
-            * `get_module_secs`: Floating point total seconds spent servicing
-              :data:`mitogen.core.GET_MODULE` requests.
+            * `get_module_secs`: Floating point total seconds worker threads
+              spent building responses to :data:`mitogen.core.GET_MODULE`
+              requests.
             * `good_load_module_count`: Integer count of successful
               :data:`mitogen.core.LOAD_MODULE` messages sent.
             * `good_load_module_size`: Integer total bytes sent in
@@ -28,13 +28,22 @@
 
 # !mitogen: minify_safe
 
+import os
+import re
 import sys
+import tempfile
+import threading
 
 try:
     from io import StringIO
 except ImportError:
     from StringIO import StringIO
 
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
 import mitogen.core
 
 if sys.version_info < (2, 7, 11):
@@ -43,10 +52,22 @@ else:
     import tokenize
 
 
+#: Directory in which :func:`minimize_source` persists results, so other
+#: processes minifying the same source can reuse them, or :data:`None`.
+cache_dir = None
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+#: Bump when the minifier's output changes, invalidating :data:`cache_dir`.
+_CACHE_VERSION = 1
+
+
 def minimize_source(source):
     """
     Remove comments and docstrings from Python `source`, preserving line
-    numbers and syntax of empty blocks.
+    numbers and syntax of empty blocks. Results are cached by the SHA-1 of
+    `source`, in memory and in :data:`cache_dir` if it is set.
 
     :param str source:
         The source to minimize.
@@ -55,13 +76,217 @@ def minimize_source(source):
         The minimized source.
     """
     source = mitogen.core.to_text(source)
-    tokens = tokenize.generate_tokens(StringIO(source).readline)
+    key = sha1(source.encode('utf-8')).hexdigest()
+    _cache_lock.acquire()
+    try:
+        minimized = _cache.get(key)
+    finally:
+        _cache_lock.release()
+
+    if minimized is None and cache_dir:
+        minimized = _read_cached(key)
+    if minimized is None:
+        minimized = _minimize_source(source)
+        if cache_dir:
+            _write_cached(key, minimized)
+
+    _cache_lock.acquire()
+    try:
+        _cache[key] = minimized
+    finally:
+        _cache_lock.release()
+    return minimized
+
+
+def _cache_path(key):
+    return os.path.join(cache_dir, 'minify-%d-py%d-%s' % (
+        _CACHE_VERSION, sys.version_info[0], key
+    ))
+
+
+def _read_cached(key):
+    try:
+        fp = open(_cache_path(key), 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        return fp.read().decode('utf-8')
+    finally:
+        fp.close()
+
+
+def _write_cached(key, minimized):
+    """
+    Write an entry via a temporary file and rename, so concurrent readers
+    never see a partial entry. Failure only costs a later recomputation.
+    """
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix='.minify-', dir=cache_dir)
+    except (IOError, OSError):
+        e = sys.exc_info()[1]
+        mitogen.core.LOG.debug('minify: cannot write cache: %s', e)
+        return
+    try:
+        try:
+            os.write(fd, minimized.encode('utf-8'))
+        finally:
+            os.close(fd)
+        os.rename(tmp_path, _cache_path(key))
+    except (IOError, OSError):
+        e = sys.exc_info()[1]
+        mitogen.core.LOG.debug('minify: cannot write cache: %s', e)
+        os.unlink(tmp_path)
+
+
+def _minimize_source(source):
+    try:
+        tokens = generate_tokens(source)
+    except UnsupportedSource:
+        tokens = tokenize.generate_tokens(StringIO(source).readline)
     tokens = strip_comments(tokens)
     tokens = strip_docstrings(tokens)
     tokens = reindent(tokens)
     return tokenize.untokenize(tokens)
 
 
+class UnsupportedSource(Exception):
+    """
+    Raised by :func:`generate_tokens` for source it leaves to
+    :mod:`tokenize`.
+    """
+    pass
+
+
+if sys.version_info >= (3, 0):
+    _STRING_PREFIX = r'(?:[rR][bBfF]?|[bBfF][rR]?|[uU])?'
+else:
+    _STRING_PREFIX = r'(?:[uUbB][rR]?|[rR])?'
+
+_TOKEN_RE = re.compile('|'.join([
+    r'(?P<space>[ \t\f]+)',
+    r'(?P<string>' + _STRING_PREFIX + '(?:' + '|'.join([
+        r"'''[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'''",
+        r'"""[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""',
+        r"'[^\n'\\]*(?:\\.[^\n'\\]*)*'",
+        r'"[^\n"\\]*(?:\\.[^\n"\\]*)*"',
+    ]) + '))',
+    r'(?P<newline>\n)',
+    r'(?P<comment>#[^\n]*)',
+    r'(?P<open>[(\[{])',
+    r'(?P<close>[)\]}])',
+    r'(?P<continuation>\\\n)',
+    r'(?P<code>(?:[^\s\w#\'"\\()\[\]{}]|\w+(?![\'"]))+)',
+    r'(?P<name>\w+)',
+]), re.S | re.U)
+
+
+def generate_tokens(source):
+    """
+    Return a list of :mod:`tokenize`-style 5-tuples for `source`, splitting
+    it with a single regular expression rather than the much slower
+    :func:`tokenize.generate_tokens`.
+
+    Only the token types :func:`minimize_source` distinguishes are exact:
+    names, numbers and operators are returned as runs of
+    :data:`tokenize.OP`. Indentation other than spaces, carriage returns,
+    unterminated constructs and anything else the expression cannot match
+    raise :class:`UnsupportedSource`.
+    """
+    if sys.version_info >= (3, 12) or not source.endswith('\n') or \
+            '\r' in source:
+        # Python 3.12 tokenizes f-strings differently, and is fast anyway.
+        raise UnsupportedSource()
+
+    STRING, OP, COMMENT = tokenize.STRING, tokenize.OP, tokenize.COMMENT
+    NL, NEWLINE = tokenize.NL, tokenize.NEWLINE
+    match = _TOKEN_RE.match
+    tokens = []
+    append = tokens.append
+    indents = [0]
+    row = 1
+    line_start = pos = 0
+    depth = 0
+    # True once the logical line has a token other than a comment.
+    in_stmt = False
+    # True until the first token of a physical line.
+    fresh = True
+
+    while pos < len(source):
+        m = match(source, pos)
+        if m is None:
+            raise UnsupportedSource()
+        kind = m.lastgroup
+        end = m.end()
+        if kind == 'space':
+            pos = end
+            continue
+
+        col = pos - line_start
+        if fresh:
+            fresh = False
+            if kind in ('newline', 'comment'):
+                pass
+            elif in_stmt:
+                if col < indents[-1] - len(indents) + 1:
+                    # reindent() would clamp this continuation line's
+                    # columns, making token boundaries significant.
+                    raise UnsupportedSource()
+            elif kind == 'continuation' or source[line_start:pos].strip(' '):
+                # Tabs and form feeds change how tokenize measures indents.
+                raise UnsupportedSource()
+            elif col > indents[-1]:
+                indents.append(col)
+                append((tokenize.INDENT, source[line_start:pos],
+                        (row, 0), (row, col), ''))
+            elif col < indents[-1]:
+                while col < indents[-1]:
+                    indents.pop()
+                    append((tokenize.DEDENT, '', (row, col), (row, col), ''))
+                if col != indents[-1]:
+                    raise UnsupportedSource()
+
+        text = m.group()
+        if kind == 'newline':
+            if in_stmt and not depth:
+                append((NEWLINE, text, (row, col), (row, col + 1), ''))
+                in_stmt = False
+            else:
+                append((NL, text, (row, col), (row, col + 1), ''))
+            row += 1
+            line_start = end
+            fresh = True
+        elif kind == 'comment':
+            append((COMMENT, text, (row, col), (row, col + len(text)), ''))
+        elif kind == 'continuation':
+            row += 1
+            line_start = end
+        elif kind == 'string':
+            start = (row, col)
+            nl = text.count('\n')
+            if nl:
+                row += nl
+                line_start = pos + text.rindex('\n') + 1
+            append((STRING, text, start, (row, end - line_start), ''))
+            in_stmt = True
+        else:
+            if kind == 'open':
+                depth += 1
+            elif kind == 'close':
+                depth -= 1
+                if depth < 0:
+                    raise UnsupportedSource()
+            append((OP, text, (row, col), (row, col + len(text)), ''))
+            in_stmt = True
+        pos = end
+
+    if in_stmt or depth:
+        raise UnsupportedSource()
+    for indent in indents[1:]:
+        append((tokenize.DEDENT, '', (row, 0), (row, 0), ''))
+    append((tokenize.ENDMARKER, '', (row, 0), (row, 0), ''))
+    return tokens
+
+
 def strip_comments(tokens):
     """
     Drop comment tokens from a `tokenize` stream.
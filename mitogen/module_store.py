@@ -0,0 +1,184 @@
+# Copyright 2019, David Wilson
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+# this list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+# !mitogen: minify_safe
+
+"""
+Host-local storage of modules received from the master, shared by contexts
+running as the same user. Children import this module only when the master
+enabled a store with
+:meth:`mitogen.master.ModuleResponder.enable_module_store`, so it adds nothing
+to the bootstrap of other children.
+"""
+
+import errno
+import marshal
+import os
+import stat
+import sys
+import time
+
+import mitogen.core
+
+
+class ModuleStore(object):
+    """
+    Directory of modules received by any context running as the same user on
+    one host, allowing sibling contexts started by a master to import modules
+    a previous sibling already fetched, without a round-trip to the parent.
+
+    Stores are created beneath ``/dev/shm`` when present, falling back to
+    ``/tmp``, in a directory writable only by the current user. Each master
+    run selects a fresh store via a random
+    :attr:`mitogen.core.Importer.store_id`, so a module
+    changed on the master between runs is never served stale. Use
+    :meth:`open` to construct an instance.
+
+    :param str path:
+        Store directory.
+    """
+    #: Stores belonging to other runs that have been idle for longer than this
+    #: many seconds are deleted when a new store is opened.
+    max_age = 86400
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return 'ModuleStore(%r)' % (self.path,)
+
+    @classmethod
+    def _get_base_dir(cls):
+        if os.path.isdir('/dev/shm'):
+            return '/dev/shm'
+        return '/tmp'
+
+    @classmethod
+    def _make_private_dir(cls, path):
+        """
+        Create `path` if it does not exist, returning :data:`True` if it is a
+        directory owned by and accessible only to the current user.
+        """
+        try:
+            os.mkdir(path, int('0700', 8))
+        except OSError:
+            e = sys.exc_info()[1]
+            if e.args[0] != errno.EEXIST:
+                return False
+
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return False
+        return (stat.S_ISDIR(st.st_mode) and
+                st.st_uid == os.getuid() and
+                (st.st_mode & int('077', 8)) == 0)
+
+    @classmethod
+    def _prune(cls, root, keep):
+        now = time.time()
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if name == keep:
+                continue
+            try:
+                if (now - os.lstat(path).st_mtime) < cls.max_age:
+                    continue
+                for filename in os.listdir(path):
+                    os.unlink(os.path.join(path, filename))
+                os.rmdir(path)
+            except OSError:
+                pass
+
+    @classmethod
+    def open(cls, store_id):
+        """
+        Return a :class:`ModuleStore` for `store_id`, or :data:`None` if
+        `store_id` is invalid or no safe store directory could be created.
+        """
+        if not store_id or store_id.strip('0123456789abcdef'):
+            return None
+
+        root = os.path.join(cls._get_base_dir(),
+                            'mitogen-modules-%d' % (os.getuid(),))
+        name = '%s-py%d' % (store_id, sys.version_info[0])
+        path = os.path.join(root, name)
+        if not (cls._make_private_dir(root) and cls._make_private_dir(path)):
+            return None
+
+        cls._prune(root, keep=name)
+        return cls(path)
+
+    def _get_path(self, fullname):
+        if os.sep in fullname or fullname.startswith('.'):
+            return None
+        return os.path.join(self.path, fullname)
+
+    def get(self, fullname):
+        """
+        Return the :data:`mitogen.core.LOAD_MODULE` tuple previously stored for `fullname`,
+        or :data:`None` if it is absent or unreadable.
+        """
+        path = self._get_path(fullname)
+        if path is None:
+            return None
+
+        try:
+            fp = open(path, 'rb')
+            try:
+                tup = marshal.load(fp)
+            finally:
+                fp.close()
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+        if isinstance(tup, tuple) and len(tup) >= 5 and tup[0] == fullname:
+            return tup
+
+    def put(self, tup):
+        """
+        Record a :data:`mitogen.core.LOAD_MODULE` tuple for use by sibling contexts. Errors
+        are ignored, since the store is only an optimization.
+        """
+        path = self._get_path(tup[0])
+        if path is None:
+            return
+
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), mitogen.core.thread.get_ident())
+        try:
+            fp = open(tmp_path, 'wb')
+            try:
+                marshal.dump(tup, fp)
+            finally:
+                fp.close()
+            os.rename(tmp_path, path)
+        except (IOError, OSError, ValueError):
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
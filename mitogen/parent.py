@@ -1295,6 +1295,9 @@ class Options(object):
     #: True if unidirectional routing is enabled in the new child.
     unidirectional = False
 
+    #: True if the new child defers executing imported modules until first use.
+    lazy_imports = False
+
     #: Passed via Router wrapper methods, must eventually be passed to
     #: ExternalContext.main().
     max_message_size = None
@@ -1308,7 +1311,8 @@ class Options(object):
 
     def __init__(self, max_message_size, name=None, remote_name=None,
                  python_path=None, debug=False, connect_timeout=None,
-                 profiling=False, unidirectional=False, old_router=None):
+                 profiling=False, unidirectional=False, old_router=None,
+                 lazy_imports=False):
         self.name = name
         self.max_message_size = max_message_size
         if python_path:
@@ -1324,6 +1328,7 @@ class Options(object):
         self.debug = debug
         self.profiling = profiling
         self.unidirectional = unidirectional
+        self.lazy_imports = lazy_imports
         self.max_message_size = max_message_size
         self.connect_deadline = mitogen.core.now() + self.connect_timeout
 
@@ -1499,9 +1504,12 @@ class Connection(object):
             'debug': self.options.debug,
             'profiling': self.options.profiling,
             'unidirectional': self.options.unidirectional,
+            'lazy_imports': self.options.lazy_imports,
             'log_level': get_log_level(),
             'whitelist': self._router.get_module_whitelist(),
             'blacklist': self._router.get_module_blacklist(),
+            'module_store': self._router.get_module_store_id(),
+            'bytecode_magic': self._router.get_bytecode_magic(),
             'max_message_size': self.options.max_message_size,
             'version': mitogen.__version__,
         }
@@ -2291,6 +2299,7 @@ class Router(mitogen.core.Router):
     context_class = Context
     debug = False
     profiling = False
+    lazy_imports = False
 
     id_allocator = None
     responder = None
@@ -2413,6 +2422,16 @@ class Router(mitogen.core.Router):
             return self.responder.whitelist
         return self.importer.master_whitelist
 
+    def get_module_store_id(self):
+        if mitogen.context_id == 0:
+            return self.responder.store_id
+        return self.importer.store_id
+
+    def get_bytecode_magic(self):
+        if mitogen.context_id == 0:
+            return self.responder.bytecode_magic
+        return self.importer.bytecode_magic
+
     def allocate_id(self):
         return self.id_allocator.allocate()
 
@@ -2441,6 +2460,7 @@ class Router(mitogen.core.Router):
         kwargs.setdefault(u'debug', self.debug)
         kwargs.setdefault(u'profiling', self.profiling)
         kwargs.setdefault(u'unidirectional', self.unidirectional)
+        kwargs.setdefault(u'lazy_imports', self.lazy_imports)
         kwargs.setdefault(u'name', name)
 
         via = kwargs.pop(u'via', None)
@@ -2745,7 +2765,11 @@ class ModuleForwarder(object):
         if msg.is_dead:
             return
 
-        fullname = msg.data.decode('utf-8')
+        fullname, _, magic = bytes_partition(msg.data, b('\x00'))
+        fullname = fullname.decode('utf-8')
+        stream = self.router.stream_by_id(msg.src_id)
+        if magic and stream and msg.src_id == stream.protocol.remote_id:
+            stream.protocol.bytecode_magic = magic.decode()
         LOG.debug('%r: %s requested by context %d', self, fullname, msg.src_id)
         callback = lambda: self._on_cache_callback(msg, fullname)
         self.importer._request_module(fullname, callback)
@@ -2768,6 +2792,9 @@ class ModuleForwarder(object):
         self._send_one_module(stream, tup)
 
     def _send_one_module(self, stream, tup):
+        if len(tup) > 5 and tup[5] and (
+                tup[5][0] != stream.protocol.bytecode_magic):
+            tup = tup[:5] + (None,) + tup[6:]
         if tup[0] not in stream.protocol.sent_modules:
             stream.protocol.sent_modules.add(tup[0])
             self.router._async_route(
@@ -28,20 +28,34 @@
 
 # !mitogen: minify_safe
 
+import collections
 import grp
 import logging
 import os
 import pprint
 import pwd
+import shutil
 import stat
 import sys
+import tempfile
 import threading
+import time
 
 import mitogen.core
 import mitogen.select
 from mitogen.core import b
 from mitogen.core import str_rpartition
 
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+if mitogen.core.PY3:
+    integer_types = (int,)
+else:
+    integer_types = (int, long)
+
 try:
     all
 except NameError:
@@ -130,7 +144,7 @@ def call(service_name, method_name, call_context=None, **kwargs):
         return getattr(invoker.service, method_name)(**kwargs)
 
 
-def validate_arg_spec(spec, args):
+def validate_arg_spec(spec, args, optional=None):
     for name in spec:
         try:
             obj = args[name]
@@ -138,36 +152,48 @@ def validate_arg_spec(spec, args):
             raise mitogen.core.CallError(
                 'Required argument %r missing.' % (name,)
             )
+        _validate_arg_type(name, obj, spec[name])
 
-        if not isinstance(obj, spec[name]):
-            raise mitogen.core.CallError(
-                'Argument %r type incorrect, got %r, expected %r' % (
-                    name,
-                    type(obj),
-                    spec[name]
-                )
+    for name in optional or ():
+        obj = args.get(name)
+        if obj is not None:
+            _validate_arg_type(name, obj, optional[name])
+
+
+def _validate_arg_type(name, obj, klass):
+    if not isinstance(obj, klass):
+        raise mitogen.core.CallError(
+            'Argument %r type incorrect, got %r, expected %r' % (
+                name,
+                type(obj),
+                klass
             )
+        )
 
 
-def arg_spec(spec):
+def arg_spec(spec, optional=None):
     """
-    Annotate a method as requiring arguments with a specific type. This only
-    validates required arguments. For optional arguments, write a manual check
-    within the function.
+    Annotate a method as requiring arguments with a specific type. Arguments
+    named by `optional` are only validated when passed and not :data:`None`.
 
     ::
 
         @mitogen.service.arg_spec({
             'path': str
+        }, optional={
+            'size': int
         })
-        def fetch_path(self, path, optional=None):
+        def fetch_path(self, path, size=None):
             ...
 
     :param dict spec:
-        Mapping from argument name to expected type.
+        Mapping from required argument name to expected type.
+    :param dict optional:
+        Mapping from optional argument name to expected type.
     """
     def wrapper(func):
         func.mitogen_service__arg_spec = spec
+        func.mitogen_service__optional_arg_spec = optional or {}
         return func
     return wrapper
 
@@ -286,7 +312,8 @@ class Invoker(object):
                 )
 
         required = getattr(method, 'mitogen_service__arg_spec', {})
-        validate_arg_spec(required, kwargs)
+        optional = getattr(method, 'mitogen_service__optional_arg_spec', {})
+        validate_arg_spec(required, kwargs, optional)
 
     def _invoke(self, method_name, kwargs, msg):
         method = getattr(self.service, method_name)
@@ -668,16 +695,189 @@ class Pool(object):
         )
 
 
+class FileTransfer(object):
+    """
+    Progress of one transfer made by :class:`FileService`, reported by
+    :meth:`FileService.get_stats` and logged on completion.
+    """
+    def __init__(self, path):
+        #: Registered path being sent.
+        self.path = path
+        #: Time the transfer was queued.
+        self.started = mitogen.core.now()
+        #: Bytes sent so far.
+        self.sent = 0
+
+    def get_stats(self, now):
+        elapsed = now - self.started
+        rate = 0.0
+        if elapsed > 0:
+            rate = self.sent / elapsed
+        return {
+            'path': self.path,
+            'sent': self.sent,
+            'elapsed': elapsed,
+            'rate': rate,
+        }
+
+
 class FileStreamState(object):
-    def __init__(self):
-        #: List of [(Sender, file object)]
+    def __init__(self, window):
+        #: List of [(Sender, file object, FileTransfer)]
         self.jobs = []
         self.completing = {}
         #: In-flight byte count.
         self.unacked = 0
+        #: Unacknowledged byte count at which sending pauses.
+        self.window = window
+        #: Window size at which slow start ends.
+        self.ssthresh = None
+        #: Time before which the window may not be reduced again.
+        self.hold_until = 0
+        #: Deque of [(send time, size)] for each unacknowledged chunk.
+        self.in_flight = collections.deque()
+        #: Smallest round trip time observed, in seconds.
+        self.min_rtt = None
+        #: Smoothed rate bytes were acknowledged at, in bytes/sec.
+        self.rate = None
+        #: Time of the last acknowledgement, or :data:`None` after the stream
+        #: drained.
+        self.last_ack = None
         #: Lock.
         self.lock = threading.Lock()
 
+    def get_stats(self, now):
+        return {
+            'window': self.window,
+            'ssthresh': self.ssthresh,
+            'unacked': self.unacked,
+            'min_rtt': self.min_rtt,
+            'rate': self.rate,
+            'transfers': [
+                transfer.get_stats(now)
+                for _, _, transfer in self.jobs
+            ],
+        }
+
+
+class DeltaReader(object):
+    """
+    File-like wrapper returning only the selected fixed-size blocks of `fp`,
+    in order, used by :meth:`FileService.fetch` for delta transfers. A read
+    never crosses the end of a block.
+    """
+    def __init__(self, fp, block_size, indices):
+        self.fp = fp
+        self.block_size = block_size
+        self.indices = list(indices)
+        self.indices.reverse()
+        self.remaining = 0
+
+    def read(self, size):
+        while True:
+            if self.remaining:
+                s = self.fp.read(min(size, self.remaining))
+                if s:
+                    self.remaining -= len(s)
+                    return s
+                self.remaining = 0
+            if not self.indices:
+                return b('')
+            self.fp.seek(self.indices.pop() * self.block_size)
+            self.remaining = self.block_size
+
+    def close(self):
+        self.fp.close()
+
+
+class RelayedFile(object):
+    """
+    A file being cached on disk by a :class:`FileService` relaying it from a
+    parent to children.
+    """
+    def __init__(self, path):
+        #: Path of the cache file.
+        self.path = path
+        #: Metadata sent to children, or :data:`None` until known.
+        self.metadata = None
+        #: Bytes written to the cache file so far.
+        self.available = 0
+        #: :data:`True` once the download has succeeded or failed.
+        self.done = False
+        #: :data:`True` if the download succeeded.
+        self.ok = False
+        #: List of Senders waiting for :attr:`metadata`.
+        self.waiters = []
+        #: :func:`mitogen.core.now` when the file was last requested.
+        self.last_used = mitogen.core.now()
+
+
+class RelayReader(object):
+    """
+    File-like view of a :class:`RelayedFile` that may still be downloading.
+    :meth:`read` returns :data:`None` when all bytes written so far have been
+    read, and the empty string once the download is done.
+    """
+    def __init__(self, relayed):
+        self.relayed = relayed
+        self.fp = open(relayed.path, 'rb')
+        self.pos = 0
+
+    def read(self, size):
+        # Test done first: available is final by the time it is set.
+        done = self.relayed.done
+        size = min(size, self.relayed.available - self.pos)
+        if size <= 0:
+            if done:
+                return b('')
+            return None
+        s = self.fp.read(size)
+        self.pos += len(s)
+        return s
+
+    def close(self):
+        self.fp.close()
+
+
+class RegionReader(object):
+    """
+    File-like view of a regular file whose :meth:`read` returns
+    :class:`mitogen.core.FileRegion` instances rather than bytes, so chunks
+    are copied from the file to the stream by the kernel.
+    """
+    def __init__(self, fp, size):
+        self.fp = fp
+        self.pos = fp.tell()
+        self.size = size
+
+    def read(self, size):
+        size = min(size, self.size - self.pos)
+        if size <= 0:
+            return b('')
+        region = mitogen.core.FileRegion(self.fp, self.pos, size)
+        self.pos += size
+        return region
+
+    def close(self):
+        self.fp.close()
+
+
+class RelayWriter(object):
+    """
+    File-like object used as `out_fp` by a relaying :class:`FileService`,
+    publishing each write to readers of the :class:`RelayedFile`.
+    """
+    def __init__(self, relayed, fp, on_write):
+        self.relayed = relayed
+        self.fp = fp
+        self.on_write = on_write
+
+    def write(self, s):
+        self.fp.write(s)
+        self.fp.flush()
+        self.relayed.available += len(s)
+        self.on_write()
+
 
 class PushFileService(Service):
     """
@@ -873,7 +1073,13 @@ class FileService(Service):
         4. Chunks begin to arrive in the requestee, which calls acknowledge()
            for each 128KiB received.
         5. The acknowledge() call arrives at FileService, which scheduled a new
-           chunk to refill the drained window back to the size limit.
+           chunk to refill the drained window back to the size limit. The
+           window adapts to the stream TCP-style, see :meth:`_update_window`,
+           so long fat links are not limited to 1MiB per round trip.
+
+           If the requestee passed digests of the blocks of an existing copy
+           of the file, only the blocks that differ are sent, and none at all
+           when the file is unchanged.
         6. When the last chunk has been pumped for a single transfer,
            Sender.close() is called causing the receive loop in
            target.py::_get_file() to exit, allowing that code to compare the
@@ -881,6 +1087,18 @@ class FileService(Service):
         7. If the sizes mismatch, _get_file()'s caller is informed which will
            discard the result and log/raise an error.
 
+    Relaying:
+        A requestee may pass `relays`, the IDs of contexts between it and
+        FileService, nearest first. FileService replies to fetch() with a
+        marker and asks the first relay to serve the file using relay(). The
+        relay fetches the file in turn, passing on the remaining relays, and
+        caches it on disk, streaming chunks on to every child requesting the
+        same path as they arrive. Metadata and chunks are sent on the
+        requestee's sender, and acknowledgements return to a receiver in the
+        relay, since children may not call services in their parents. Each
+        link carries the file once, however many contexts below it request
+        it.
+
     Shutdown:
         1. process.py calls service.Pool.shutdown(), which arranges for the
            service pool threads to exit and be joined, guranteeing no new
@@ -896,19 +1114,76 @@ class FileService(Service):
     """
     unregistered_msg = 'Path %r is not registered with FileService.'
     context_mismatch_msg = 'sender= kwarg context must match requestee context'
+    relay_mismatch_msg = 'relays= kwarg must name contexts on the route to ' \
+                         'the requestee'
 
-    #: Burst size. With 1MiB and 10ms RTT max throughput is 100MiB/sec, which
-    #: is 5x what SSH can handle on a 2011 era 2.4Ghz Core i5.
+    #: Initial and minimum burst size. With 1MiB and 10ms RTT max throughput
+    #: is 100MiB/sec, which is 5x what SSH can handle on a 2011 era 2.4Ghz Core
+    #: i5. Links with a larger bandwidth-delay product grow the window.
     window_size_bytes = 1048576
 
+    #: Largest window a stream may grow to.
+    max_window_size_bytes = 16 * 1048576
+
+    #: Total unacknowledged bytes across every stream, bounding memory spent
+    #: buffering data for slow receivers. Each stream may always have
+    #: :attr:`window_size_bytes` in flight.
+    max_buffered_bytes = 64 * 1048576
+
+    #: Number of completed transfers remembered for :meth:`get_stats`.
+    max_completed = 100
+
+    #: If :data:`True` and :attr:`mitogen.core.FileRegion.supported`, whole
+    #: file transfers are written to the stream using :func:`os.sendfile`
+    #: and received as raw bytes, rather than read into memory and pickled.
+    #: A file that shrinks while it is sent fails its transfer, after zeros
+    #: have been sent in place of the missing bytes.
+    zero_copy = False
+
+    #: Size of the blocks compared when a requestee supplies digests of an
+    #: existing copy of the file. Blocks are compared at fixed offsets, so an
+    #: insertion causes every following block to be resent.
+    delta_block_size = 131072
+
+    #: Maximum number of entries in :attr:`_digests_by_path` before it is
+    #: emptied.
+    max_cached_digests = 1024
+
+    #: Maximum number of files relayed to children kept on disk. The least
+    #: recently requested complete files beyond this are removed.
+    max_relayed_files = 100
+
+    #: Maximum total size of files relayed to children kept on disk. The
+    #: least recently requested complete files beyond this are removed.
+    max_relayed_bytes = 1024 * 1048576
+
     def __init__(self, router):
         super(FileService, self).__init__(router)
+        #: Mapping of path -> (key, digest, block digests) for the most
+        #: recently served version of each file, where `key` is a tuple of the
+        #: file's device, inode, size, modification and change times at the
+        #: time it was hashed.
+        self._digests_by_path = {}
         #: Set of registered paths.
         self._paths = set()
         #: Set of registered directory prefixes.
         self._prefixes = set()
         #: Mapping of Stream->FileStreamState.
         self._state_by_stream = {}
+        #: Mapping of path -> RelayedFile for files relayed to children.
+        self._relayed_by_path = {}
+        #: Directory holding relayed files, created on first use.
+        self._relay_dir = None
+        #: Sender children use to acknowledge relayed chunks.
+        self._relay_ack_sender = None
+        #: Serialize relay state changes.
+        self._lock = threading.Lock()
+        #: Unacknowledged bytes across every stream.
+        self._buffered = 0
+        #: Serialize updates to :attr:`_buffered`.
+        self._buffered_lock = threading.Lock()
+        #: Stats of recently completed transfers, oldest first.
+        self._completed = collections.deque()
 
     def _name_or_none(self, func, n, attr):
         try:
@@ -962,6 +1237,85 @@ class FileService(Service):
             u'atime': float(st.st_atime),  # Python 2.4 uses int.
         }
 
+    @classmethod
+    def _digest_fp(cls, fp):
+        """
+        Read `fp` from the start, returning the hex digest of its content and
+        the list of hex digests of each :attr:`delta_block_size` block.
+        """
+        fp.seek(0)
+        digest = sha1()
+        block_digests = []
+        while True:
+            s = fp.read(cls.delta_block_size)
+            if not s:
+                break
+            digest.update(s)
+            block_digests.append(mitogen.core.to_text(sha1(s).hexdigest()))
+        return mitogen.core.to_text(digest.hexdigest()), block_digests
+
+    def _get_digests(self, path, fp):
+        """
+        Return :meth:`_digest_fp` for `fp`, cached by path while the file's
+        inode, size and timestamps are unchanged, so a file pushed to many
+        targets is only hashed once.
+        """
+        st = os.fstat(fp.fileno())
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+        cached = self._digests_by_path.get(path)
+        if cached and cached[0] == key:
+            return cached[1:]
+
+        digest, block_digests = self._digest_fp(fp)
+        # A file written again within the timestamp granularity after hashing
+        # would keep its key, so don't trust recently modified files.
+        if max(st.st_mtime, st.st_ctime) < (time.time() - 2):
+            if len(self._digests_by_path) >= self.max_cached_digests:
+                self._digests_by_path.clear()
+            self._digests_by_path[path] = (key, digest, block_digests)
+        return digest, block_digests
+
+    def _plan_delta(self, path, fp, metadata, block_digests):
+        """
+        Compare the requestee's `block_digests` with those of `fp`, record the
+        result in `metadata`, and return a :class:`DeltaReader` for the blocks
+        that must be sent.
+        """
+        digest, my_digests = self._get_digests(path, fp)
+        indices = [
+            i for i, block_digest in enumerate(my_digests)
+            if i >= len(block_digests) or block_digests[i] != block_digest
+        ]
+        metadata[u'digest'] = digest
+        metadata[u'block_size'] = self.delta_block_size
+        metadata[u'blocks'] = indices
+        metadata[u'unchanged'] = (not indices and
+                                  len(block_digests) == len(my_digests))
+        LOG.debug('%r: sending %d of %d blocks of %r',
+                  self, len(indices), len(my_digests), path)
+        return DeltaReader(fp, self.delta_block_size, indices)
+
+    def _plan_resume(self, fp, offset, prefix_digest):
+        """
+        Position `fp` after its first `offset` bytes if their digest is
+        `prefix_digest`, otherwise at its start, and return its position.
+        """
+        digest = sha1()
+        remaining = offset
+        while remaining > 0:
+            s = fp.read(min(remaining, self.IO_SIZE))
+            if not s:
+                break
+            digest.update(s)
+            remaining -= len(s)
+
+        if remaining or mitogen.core.to_text(digest.hexdigest()) != \
+                prefix_digest:
+            LOG.debug('%r: prefix mismatch, sending %r in full', self, fp)
+            fp.seek(0)
+            return 0
+        return offset
+
     def on_shutdown(self):
         """
         Respond to shutdown by sending close() to every target, allowing their
@@ -971,13 +1325,26 @@ class FileService(Service):
         for stream, state in self._state_by_stream.items():
             state.lock.acquire()
             try:
-                for sender, fp in reversed(state.jobs):
+                for sender, fp, _ in reversed(state.jobs):
                     sender.close()
                     fp.close()
                     state.jobs.pop()
             finally:
                 state.lock.release()
 
+        self._lock.acquire()
+        try:
+            for relayed in self._relayed_by_path.values():
+                for sender in relayed.waiters:
+                    sender.close()
+                del relayed.waiters[:]
+            if self._relay_ack_sender is not None:
+                self.router.del_handler(self._relay_ack_sender.dst_handle)
+            if self._relay_dir is not None:
+                shutil.rmtree(self._relay_dir, ignore_errors=True)
+        finally:
+            self._lock.release()
+
     # The IO loop pumps 128KiB chunks. An ideal message is a multiple of this,
     # odd-sized messages waste one tiny write() per message on the trailer.
     # Therefore subtract 10 bytes pickle overhead + 24 bytes header.
@@ -989,27 +1356,101 @@ class FileService(Service):
         ) - mitogen.core.CHUNK_SIZE
     ))
 
+    def _get_stream_state(self, stream):
+        state = self._state_by_stream.get(stream)
+        if state is None:
+            state = FileStreamState(self.window_size_bytes)
+            state.ssthresh = self.max_window_size_bytes
+            if self._state_by_stream.setdefault(stream, state) is state and \
+                    stream is not None:
+                mitogen.core.listen(stream, 'disconnect',
+                    lambda: self._on_stream_disconnect(stream))
+            state = self._state_by_stream[stream]
+        return state
+
+    def _on_stream_disconnect(self, stream):
+        """
+        Release the memory cap share of a stream that disconnected while data
+        was still in flight.
+        """
+        state = self._state_by_stream.get(stream)
+        if state is None:
+            return
+        state.lock.acquire()
+        try:
+            self._add_buffered(-state.unacked)
+            state.unacked = 0
+            state.in_flight.clear()
+        finally:
+            state.lock.release()
+
+    def _add_buffered(self, n):
+        self._buffered_lock.acquire()
+        try:
+            self._buffered += n
+        finally:
+            self._buffered_lock.release()
+
+    def _may_send(self, state):
+        """
+        Return :data:`True` if the stream's window and the memory cap permit
+        another chunk to be sent.
+        """
+        return state.unacked < state.window and (
+            state.unacked < self.window_size_bytes or
+            self._buffered < self.max_buffered_bytes
+        )
+
+    def _finish_transfer(self, transfer):
+        stats = transfer.get_stats(mitogen.core.now())
+        LOG.debug('%r: sent %d bytes of %r in %.2fs (%.2f MiB/s)',
+                  self, stats['sent'], stats['path'], stats['elapsed'],
+                  stats['rate'] / 1048576)
+        self._lock.acquire()
+        try:
+            self._completed.append(stats)
+            while len(self._completed) > self.max_completed:
+                self._completed.popleft()
+        finally:
+            self._lock.release()
+
+    def _send_chunk(self, sender, s):
+        if isinstance(s, mitogen.core.FileRegion):
+            sender.context.send(
+                mitogen.core.Message(handle=sender.dst_handle, region=s)
+            )
+        else:
+            sender.send(mitogen.core.Blob(s))
+
     def _schedule_pending_unlocked(self, state):
         """
         Consider the pending transfers for a stream, pumping new chunks while
-        the unacknowledged byte count is below :attr:`window_size_bytes`. Must
-        be called with the FileStreamState lock held.
+        the unacknowledged byte count is below the stream's window. Must be
+        called with the FileStreamState lock held.
 
         :param FileStreamState state:
             Stream to schedule chunks for.
         """
-        while state.jobs and state.unacked < self.window_size_bytes:
-            sender, fp = state.jobs[0]
+        while state.jobs and self._may_send(state):
+            sender, fp, transfer = state.jobs[0]
             s = fp.read(self.IO_SIZE)
+            if s is None:
+                # Relayed file has no more data yet. Its download pumps again
+                # when more arrives.
+                break
             if s:
                 state.unacked += len(s)
-                sender.send(mitogen.core.Blob(s))
+                state.in_flight.append((mitogen.core.now(), len(s)))
+                self._add_buffered(len(s))
+                transfer.sent += len(s)
+                self._send_chunk(sender, s)
             else:
                 # File is done. Cause the target's receive loop to exit by
                 # closing the sender, close the file, and remove the job entry.
                 sender.close()
                 fp.close()
                 state.jobs.pop(0)
+                self._finish_transfer(transfer)
 
     def _prefix_is_authorized(self, path):
         """
@@ -1034,8 +1475,14 @@ class FileService(Service):
     @arg_spec({
         'path': mitogen.core.FsPathTypes,
         'sender': mitogen.core.Sender,
+    }, optional={
+        'block_digests': list,
+        'relays': list,
+        'offset': integer_types,
+        'prefix_digest': mitogen.core.UnicodeType,
     })
-    def fetch(self, path, sender, msg):
+    def fetch(self, path, sender, msg, block_digests=None, relays=None,
+              offset=0, prefix_digest=None):
         """
         Start a transfer for a registered path.
 
@@ -1043,6 +1490,22 @@ class FileService(Service):
             File path.
         :param mitogen.core.Sender sender:
             Sender to receive file data.
+        :param list block_digests:
+            If not :data:`None`, hex SHA-1 digests of each
+            :attr:`delta_block_size` block of the requestee's existing copy of
+            the file. Only differing blocks are sent.
+        :param list relays:
+            If not empty, IDs of contexts between the requestee and this one,
+            nearest the requestee first. The first is asked to serve the file
+            using :meth:`relay`, and ``{"relayed": True}`` is returned. The
+            metadata then arrives as the first message on `sender`, with an
+            additional ``ack_sender`` key.
+        :param int offset:
+            If nonzero, the requestee already holds the first `offset` bytes
+            of the file, with hex SHA-1 digest `prefix_digest`. If they match
+            the file, only the remainder is sent.
+        :param str prefix_digest:
+            Digest of the requestee's first `offset` bytes.
         :returns:
             Dict containing the file metadata:
 
@@ -1052,6 +1515,24 @@ class FileService(Service):
             * ``group``: Owner group name on host machine.
             * ``mtime``: Floating point modification time.
             * ``ctime``: Floating point change time.
+
+            When `block_digests` was given, additionally:
+
+            * ``digest``: Hex SHA-1 digest of the whole file.
+            * ``block_size``: Block size used for comparison.
+            * ``blocks``: Sorted list of indices of the blocks that will be
+              sent.
+            * ``unchanged``: :data:`True` if the requestee's copy is
+              identical, and no data will be sent.
+
+            When `offset` was given, additionally:
+
+            * ``offset``: Offset of the first byte that will be sent, either
+              `offset`, or 0 when the requestee's prefix did not match.
+
+            ``raw`` is :data:`True` when file data arrives as raw message
+            bytes written using :func:`os.sendfile`, rather than pickled
+            :class:`mitogen.core.Blob` instances.
         :raises Error:
             Unregistered path, or Sender did not match requestee context.
         """
@@ -1071,110 +1552,690 @@ class FileService(Service):
             ))
             return
 
+        if relays:
+            self._forward_fetch(path, sender, msg, relays)
+            return
+
+        if block_digests is None:
+            self._serve(path, sender, msg, None, offset, prefix_digest)
+            return
+
+        # Hashing a large file would stall this pool thread, delaying every
+        # other request, so plan the delta on a thread of its own.
+        thread = threading.Thread(
+            name='mitogen.FileService.delta',
+            target=self._serve,
+            args=(path, sender, msg, block_digests, offset, prefix_digest),
+        )
+        thread.setDaemon(True)
+        thread.start()
+
+    def _serve(self, path, sender, msg, block_digests, offset, prefix_digest):
+        """
+        Reply to the :meth:`fetch` request `msg` with the metadata of `path`,
+        and queue its content for `sender`.
+        """
         LOG.debug('Serving %r', path)
 
         # Response must arrive first so requestee can begin receive loop,
         # otherwise first ack won't arrive until all pending chunks were
         # delivered. In that case max BDP would always be 128KiB, aka. max
         # ~10Mbit/sec over a 100ms link.
+        stream = self.router.stream_by_id(sender.context.context_id)
         try:
             fp = open(path, 'rb', self.IO_SIZE)
-            msg.reply(self._generate_stat(path))
-        except IOError:
+            metadata = self._generate_stat(path)
+            if block_digests is not None:
+                fp = self._plan_delta(path, fp, metadata, block_digests)
+            elif offset:
+                metadata[u'offset'] = self._plan_resume(fp, offset,
+                                                        prefix_digest)
+            if block_digests is None and self._can_zero_copy(stream):
+                fp = RegionReader(fp, metadata[u'size'])
+                metadata[u'raw'] = True
+            msg.reply(metadata)
+        except (IOError, OSError):
             msg.reply(mitogen.core.CallError(
                 sys.exc_info()[1]
             ))
             return
 
-        stream = self.router.stream_by_id(sender.context.context_id)
-        state = self._state_by_stream.setdefault(stream, FileStreamState())
+        state = self._get_stream_state(stream)
         state.lock.acquire()
         try:
-            state.jobs.append((sender, fp))
+            state.jobs.append((sender, fp, FileTransfer(path)))
             self._schedule_pending_unlocked(state)
         finally:
             state.lock.release()
 
-    @expose(policy=AllowAny())
+    def _can_zero_copy(self, stream):
+        """
+        Return :data:`True` if file data for `stream` may be written using
+        :func:`os.sendfile`. Messages for the local context are delivered
+        from memory, so gain nothing.
+        """
+        return (
+            self.zero_copy and
+            mitogen.core.FileRegion.supported and
+            stream is not None
+        )
+
+    def _forward_fetch(self, path, sender, msg, relays):
+        """
+        Ask the context nearest the requestee in `relays` to serve `path` to
+        `sender`, after checking it lies on the route to the requestee.
+        """
+        stream = self.router.stream_by_id(sender.context.context_id)
+        if self.router.stream_by_id(relays[0]) is not stream:
+            msg.reply(mitogen.core.CallError(
+                Error(self.relay_mismatch_msg)
+            ))
+            return
+
+        LOG.debug('Relaying %r to %r via %r', path, sender.context, relays)
+        msg.reply({u'relayed': True})
+        self.router.context_by_id(relays[0]).call_service_async(
+            service_name=self.name(),
+            method_name='relay',
+            path=path,
+            sender=sender,
+            relays=relays[1:],
+            source=self.router.myself(),
+        ).close()
+
+    def _get_relay_ack_sender(self):
+        """
+        Return the Sender children use to acknowledge relayed chunks, creating
+        its handler on first use. Must be called with :attr:`_lock` held.
+        """
+        if self._relay_ack_sender is None:
+            handle = self.router.add_handler(fn=self._on_relay_ack)
+            self._relay_ack_sender = mitogen.core.Sender(
+                self.router.myself(), handle
+            )
+        return self._relay_ack_sender
+
+    def _on_relay_ack(self, msg):
+        """
+        Respond to an acknowledgement of relayed chunks, sent to the Sender
+        from :meth:`_get_relay_ack_sender` since children may not call
+        :meth:`acknowledge` in a parent.
+        """
+        if msg.is_dead:
+            return
+        size = msg.unpickle()
+        if isinstance(size, int):
+            self._acknowledge(msg.src_id, size)
+
+    def _pump_relayed(self):
+        """
+        Arrange for chunks to be scheduled for every stream, after more of a
+        relayed file has been written or a child has been added.
+
+        Relayed chunks are only sent from the broker thread, where their
+        acknowledgements arrive. Messages sent by other threads are queued
+        behind any the broker thread sends itself, so chunks sent from both
+        could be reordered.
+        """
+        self.router.broker.defer(self._pump_relayed_now)
+
+    def _pump_relayed_now(self):
+        for state in list(self._state_by_stream.values()):
+            state.lock.acquire()
+            try:
+                self._schedule_pending_unlocked(state)
+            finally:
+                state.lock.release()
+
+    def _serve_relayed(self, path, relayed, sender):
+        """
+        Send the metadata of `relayed` to `sender`, and queue its content.
+        Must be called with :attr:`_lock` held, so the cache file cannot be
+        replaced before it is opened.
+        """
+        sender.send(relayed.metadata)
+        stream = self.router.stream_by_id(sender.context.context_id)
+        state = self._get_stream_state(stream)
+        state.lock.acquire()
+        try:
+            state.jobs.append((sender, RelayReader(relayed),
+                               FileTransfer(path)))
+        finally:
+            state.lock.release()
+        self._pump_relayed()
+
+    def _start_relay(self, path, relays, source, base):
+        """
+        Start a thread downloading `path` from `source` into a new cache file,
+        using the cache file of an earlier download `base` as the basis for a
+        delta. Must be called with :attr:`_lock` held.
+        """
+        if self._relay_dir is None:
+            self._relay_dir = tempfile.mkdtemp(prefix='mitogen_file_relay.')
+        fd, cache_path = tempfile.mkstemp(dir=self._relay_dir)
+        relayed = RelayedFile(cache_path)
+        self._relayed_by_path[path] = relayed
+
+        thread = threading.Thread(
+            name='mitogen.FileService.relay',
+            target=self._relay_main,
+            args=(path, relayed, os.fdopen(fd, 'wb'), relays, source, base),
+        )
+        thread.setDaemon(True)
+        thread.start()
+        return relayed
+
+    def _set_relay_metadata(self, path, relayed, metadata):
+        """
+        Record the metadata of `relayed`, a download of `path`, and start
+        serving children waiting for it.
+        """
+        dct = dict([
+            (key, metadata[key])
+            for key in (u'size', u'mode', u'owner', u'group', u'mtime',
+                        u'atime')
+        ])
+        self._lock.acquire()
+        try:
+            dct[u'ack_sender'] = self._get_relay_ack_sender()
+            relayed.metadata = dct
+            for sender in relayed.waiters:
+                self._serve_relayed(path, relayed, sender)
+            del relayed.waiters[:]
+        finally:
+            self._lock.release()
+
+    def _relay_main(self, path, relayed, fp, relays, source, base):
+        """
+        Relay thread body: download `path` into `relayed`, pumping chunks to
+        children as they arrive.
+        """
+        base_fp = None
+        ok = False
+        try:
+            try:
+                kwargs = {}
+                if relays:
+                    kwargs['relays'] = relays
+                if base is not None:
+                    base_fp = open(base.path, 'rb')
+                    kwargs['block_digests'] = self._get_digests(
+                        base.path, base_fp
+                    )[1]
+                recv, metadata = self._request(source, path, **kwargs)
+                if metadata.get(u'unchanged'):
+                    os.unlink(relayed.path)
+                    relayed.path = base.path
+                    relayed.available = metadata['size']
+                    ok = True
+                self._set_relay_metadata(path, relayed, metadata)
+                if not ok:
+                    ok = self._receive(
+                        context=source,
+                        path=path,
+                        recv=recv,
+                        metadata=metadata,
+                        out_fp=RelayWriter(relayed, fp, self._pump_relayed),
+                        base_fp=base_fp,
+                    )
+            except Exception:
+                e = sys.exc_info()[1]
+                LOG.error('%r: relaying %r failed: %s', self, path, e)
+                self._lock.acquire()
+                try:
+                    for sender in relayed.waiters:
+                        sender.send(mitogen.core.CallError(e))
+                        sender.close()
+                    del relayed.waiters[:]
+                finally:
+                    self._lock.release()
+        finally:
+            fp.close()
+            if base_fp is not None:
+                base_fp.close()
+
+        self._lock.acquire()
+        try:
+            relayed.ok = ok
+            relayed.done = True
+            if ok:
+                if base is not None and base.path != relayed.path:
+                    os.unlink(base.path)
+            else:
+                os.unlink(relayed.path)
+                if base is not None:
+                    self._relayed_by_path[path] = base
+                else:
+                    del self._relayed_by_path[path]
+            self._evict_relayed()
+        finally:
+            self._lock.release()
+        # Let readers that caught up see the end of file.
+        self._pump_relayed()
+
+    @expose(policy=AllowParents())
     @no_reply()
     @arg_spec({
-        'size': int,
+        'path': mitogen.core.FsPathTypes,
+        'sender': mitogen.core.Sender,
+        'relays': list,
+        'source': mitogen.core.Context,
     })
-    @no_reply()
-    def acknowledge(self, size, msg):
+    def relay(self, path, sender, relays, source):
         """
-        Acknowledge bytes received by a transfer target, scheduling new chunks
-        to keep the window full. This should be called for every chunk received
-        by the target.
+        Serve `path` to `sender` on behalf of `source`, fetching it from
+        `source` via `relays` and caching it on disk, or from the cache when
+        another child requested it already. A cached file is revalidated
+        against `source` by a delta transfer whenever a new request arrives
+        after it was complete.
+
+        :param str path:
+            File path registered with the FileService in `source`.
+        :param mitogen.core.Sender sender:
+            Sender to receive metadata followed by file data.
+        :param list relays:
+            Remaining contexts between this one and `source`.
+        :param mitogen.core.Context source:
+            Context hosting the FileService the path is registered with.
         """
-        stream = self.router.stream_by_id(msg.src_id)
+        self._lock.acquire()
+        try:
+            try:
+                relayed = self._relayed_by_path.get(path)
+                if relayed is None or relayed.done:
+                    relayed = self._start_relay(path, relays, source, relayed)
+                    self._evict_relayed()
+                relayed.last_used = mitogen.core.now()
+                if relayed.metadata is None:
+                    relayed.waiters.append(sender)
+                else:
+                    self._serve_relayed(path, relayed, sender)
+            except (IOError, OSError):
+                # The requestee is blocked waiting for metadata on sender.
+                sender.send(mitogen.core.CallError(sys.exc_info()[1]))
+                sender.close()
+        finally:
+            self._lock.release()
+
+    def _evict_relayed(self):
+        """
+        Remove the least recently requested complete files from the relay
+        cache until it holds at most :attr:`max_relayed_files` files and
+        :attr:`max_relayed_bytes` bytes, or only files still downloading.
+        Children still reading a removed file keep it open. Must be called
+        with :attr:`_lock` held.
+        """
+        items = sorted(self._relayed_by_path.items(),
+                       key=lambda item: item[1].last_used)
+        count = len(items)
+        size = sum([relayed.available for _, relayed in items])
+        for path, relayed in items:
+            if count <= self.max_relayed_files and \
+                    size <= self.max_relayed_bytes:
+                break
+            if not relayed.done:
+                continue
+            LOG.debug('%r: evicting relayed %r', self, path)
+            del self._relayed_by_path[path]
+            try:
+                os.unlink(relayed.path)
+            except OSError:
+                LOG.debug('%r: cannot remove %r', self, relayed.path,
+                          exc_info=True)
+            count -= 1
+            size -= relayed.available
+
+    #: Weight of each new sample in the smoothed acknowledgement rate.
+    rate_gain = 0.125
+
+    def _update_window(self, state, size):
+        """
+        Account for the acknowledgement of `size` bytes, adapting the stream's
+        window as TCP does. The bandwidth-delay product is estimated from the
+        smallest round trip time of any chunk and the smoothed rate
+        acknowledgements arrive at.
+
+        * In slow start, while the window is below `ssthresh`, it grows by
+          the acknowledged size, doubling every round trip.
+        * Beyond `ssthresh`, it grows by one :attr:`IO_SIZE` chunk per round
+          trip.
+        * When more than a bandwidth-delay product of data is queued beyond
+          what the link holds, the link is full and the window is only
+          filling buffers: `ssthresh` and the window are halved, at most once
+          per round trip.
+
+        The window only grows while it limits sending, and stays within
+        :attr:`window_size_bytes` and :attr:`max_window_size_bytes`. Must be
+        called with the FileStreamState lock held.
+        """
+        now = mitogen.core.now()
+        sent = None
+        acked = size
+        limited = state.unacked + acked >= state.window - self.IO_SIZE
+        while size > 0 and state.in_flight:
+            sent, n = state.in_flight[0]
+            if n > size:
+                state.in_flight[0] = (sent, n - size)
+                break
+            state.in_flight.popleft()
+            size -= n
+
+        if sent is not None:
+            rtt = now - sent
+            if state.min_rtt is None or rtt < state.min_rtt:
+                state.min_rtt = rtt
+
+        if state.last_ack is not None and now > state.last_ack:
+            sample = acked / (now - state.last_ack)
+            if state.rate is None:
+                state.rate = sample
+            else:
+                state.rate += self.rate_gain * (sample - state.rate)
+
+        if state.rate and state.min_rtt:
+            bdp = int(state.rate * state.min_rtt)
+            queued = state.unacked - bdp
+            if queued > max(bdp, self.window_size_bytes) and \
+                    now >= state.hold_until:
+                state.ssthresh = max(self.window_size_bytes,
+                                     state.window // 2)
+                state.window = state.ssthresh
+                state.hold_until = now + state.min_rtt
+                limited = False
+
+        if limited:
+            if state.window < state.ssthresh:
+                state.window += acked
+            else:
+                state.window += max(1, self.IO_SIZE * acked // state.window)
+            state.window = min(state.window, self.max_window_size_bytes)
+
+        if state.unacked:
+            state.last_ack = now
+        else:
+            # Idle time before the next transfer must not count as slowness.
+            state.last_ack = None
+
+    def _acknowledge(self, src_id, size):
+        stream = self.router.stream_by_id(src_id)
         state = self._state_by_stream[stream]
         state.lock.acquire()
         try:
             if state.unacked < size:
                 LOG.error('%r.acknowledge(src_id %d): unacked=%d < size %d',
-                          self, msg.src_id, state.unacked, size)
-            state.unacked -= min(state.unacked, size)
+                          self, src_id, state.unacked, size)
+            acked = min(state.unacked, size)
+            state.unacked -= acked
+            self._add_buffered(-acked)
+            self._update_window(state, size)
             self._schedule_pending_unlocked(state)
         finally:
             state.lock.release()
 
-    @classmethod
-    def get(cls, context, path, out_fp):
+    @expose(policy=AllowParents())
+    def get_stats(self):
         """
-        Streamily download a file from the connection multiplexer process in
-        the controller.
+        Return window and throughput statistics for each stream, and for
+        recently completed transfers.
 
-        :param mitogen.core.Context context:
-            Reference to the context hosting the FileService that will be used
-            to fetch the file.
-        :param bytes path:
-            FileService registered name of the input file.
-        :param bytes out_path:
-            Name of the output path on the local disk.
         :returns:
-            Tuple of (`ok`, `metadata`), where `ok` is :data:`True` on success,
-            or :data:`False` if the transfer was interrupted and the output
-            should be discarded.
+            Dict with keys:
 
-            `metadata` is a dictionary of file metadata as documented in
-            :meth:`fetch`.
+            * ``streams``: dict mapping each stream's name, or :data:`None`
+              for the local context, to a dict of its ``window``,
+              ``ssthresh``, ``unacked`` byte count, ``min_rtt``, smoothed
+              acknowledgement ``rate`` in bytes per second, and list of
+              active ``transfers``.
+            * ``completed``: list of completed transfers, oldest first.
+
+            Each transfer is a dict of its ``path``, bytes ``sent``,
+            ``elapsed`` seconds and average ``rate`` in bytes per second.
+        """
+        now = mitogen.core.now()
+        streams = {}
+        for stream, state in list(self._state_by_stream.items()):
+            state.lock.acquire()
+            try:
+                name = None
+                if stream is not None:
+                    name = stream.name
+                streams[name] = state.get_stats(now)
+            finally:
+                state.lock.release()
+        self._lock.acquire()
+        try:
+            completed = list(self._completed)
+        finally:
+            self._lock.release()
+        return {
+            'streams': streams,
+            'completed': completed,
+        }
+
+    @expose(policy=AllowAny())
+    @no_reply()
+    @arg_spec({
+        'size': int,
+    })
+    @no_reply()
+    def acknowledge(self, size, msg):
+        """
+        Acknowledge bytes received by a transfer target, scheduling new chunks
+        to keep the window full. This should be called for every chunk received
+        by the target.
+        """
+        self._acknowledge(msg.src_id, size)
+
+    @classmethod
+    def _copy_range(cls, in_fp, out_fp, digest, offset, size):
+        """
+        Copy `size` bytes starting at `offset` of `in_fp` to `out_fp`,
+        updating `digest`.
+        """
+        in_fp.seek(offset)
+        while size > 0:
+            s = in_fp.read(min(size, cls.IO_SIZE))
+            if not s:
+                raise IOError('base file shrank during delta transfer')
+            out_fp.write(s)
+            digest.update(s)
+            size -= len(s)
+
+    @classmethod
+    def _get_expected_size(cls, metadata):
+        """
+        Return the number of bytes :meth:`fetch` will send for `metadata`.
+        """
+        if u'blocks' not in metadata:
+            return metadata['size'] - metadata.get(u'offset', 0)
+
+        size = metadata['size']
+        block_size = metadata['block_size']
+        return sum([
+            min(block_size, size - (i * block_size))
+            for i in metadata['blocks']
+        ])
+
+    @classmethod
+    def _request(cls, context, path, **kwargs):
+        """
+        Call :meth:`fetch` in `context`, returning a tuple of the
+        :class:`mitogen.core.Receiver` the file data will arrive on, and the
+        file metadata, reading it from the receiver when the transfer is
+        relayed.
         """
-        LOG.debug('get_file(): fetching %r from %r', path, context)
-        t0 = mitogen.core.now()
         recv = mitogen.core.Receiver(router=context.router)
         metadata = context.call_service(
             service_name=cls.name(),
             method_name='fetch',
             path=path,
             sender=recv.to_sender(),
+            **kwargs
         )
+        if metadata.get(u'relayed'):
+            metadata = recv.get().unpickle()
+        return recv, metadata
 
+    @classmethod
+    def _receive(cls, context, path, recv, metadata, out_fp, base_fp):
+        """
+        Receive the file data of a transfer started by :meth:`_request`,
+        writing it to `out_fp`, returning :data:`True` on success.
+        """
+        expected_bytes = cls._get_expected_size(metadata)
+        ack_sender = metadata.get(u'ack_sender')
+        raw = metadata.get(u'raw')
+        is_delta = u'blocks' in metadata
+        if is_delta:
+            block_size = metadata['block_size']
+            pending = list(metadata['blocks'])
+            pending.reverse()
+            digest = sha1()
+
+        # Bytes written to out_fp so far, and bytes of the current block yet
+        # to arrive. Chunks never span blocks.
+        written_bytes = 0
+        block_remaining = 0
         received_bytes = 0
-        for chunk in recv:
-            s = chunk.unpickle()
+        truncated = False
+        while True:
+            try:
+                chunk = recv.get(throw_dead=False)
+            except mitogen.core.ChannelError:
+                break
+            if chunk.is_dead:
+                reason = chunk.data.decode('utf-8', 'replace')
+                truncated = reason == mitogen.core.FileRegion.truncated_msg
+                break
+            if raw:
+                s = chunk.data
+            else:
+                s = chunk.unpickle()
             LOG.debug('get_file(%r): received %d bytes', path, len(s))
-            context.call_service_async(
-                service_name=cls.name(),
-                method_name='acknowledge',
-                size=len(s),
-            ).close()
+            if ack_sender is None:
+                context.call_service_async(
+                    service_name=cls.name(),
+                    method_name='acknowledge',
+                    size=len(s),
+                ).close()
+            else:
+                ack_sender.send(len(s))
+            if is_delta and not block_remaining and pending:
+                # Fill the gap before the next sent block from the base file.
+                offset = pending.pop() * block_size
+                cls._copy_range(base_fp, out_fp, digest, written_bytes,
+                                offset - written_bytes)
+                written_bytes = offset
+                block_remaining = min(block_size, metadata['size'] - offset)
             out_fp.write(s)
+            if is_delta:
+                digest.update(s)
             received_bytes += len(s)
-
-        ok = received_bytes == metadata['size']
-        if received_bytes < metadata['size']:
+            written_bytes += len(s)
+            block_remaining -= len(s)
+
+        ok = received_bytes == expected_bytes and not truncated
+        if truncated:
+            LOG.error('get_file(%r): the file was truncated while transfer '
+                      'was in progress.', path)
+        elif received_bytes < expected_bytes:
             LOG.error('get_file(%r): receiver was closed early, controller '
                       'may be shutting down, or the file was truncated '
                       'during transfer. Expected %d bytes, received %d.',
-                      path, metadata['size'], received_bytes)
-        elif received_bytes > metadata['size']:
+                      path, expected_bytes, received_bytes)
+        elif received_bytes > expected_bytes:
             LOG.error('get_file(%r): the file appears to have grown '
                       'while transfer was in progress. Expected %d '
                       'bytes, received %d.',
-                      path, metadata['size'], received_bytes)
+                      path, expected_bytes, received_bytes)
+
+        if ok and is_delta and not metadata['unchanged']:
+            cls._copy_range(base_fp, out_fp, digest, written_bytes,
+                            metadata['size'] - written_bytes)
+            if mitogen.core.to_text(digest.hexdigest()) != metadata['digest']:
+                LOG.error('get_file(%r): reconstructed file does not match '
+                          'the digest of the original', path)
+                ok = False
+
+        LOG.debug('target.get_file(): fetched %d bytes of %r from %r',
+                  received_bytes, path, context)
+        return ok
+
+    @classmethod
+    def _digest_prefix(cls, fp, size):
+        """
+        Return the hex SHA-1 digest of the first `size` bytes of `fp`.
+        """
+        fp.seek(0)
+        digest = sha1()
+        while size > 0:
+            s = fp.read(min(size, cls.IO_SIZE))
+            if not s:
+                break
+            digest.update(s)
+            size -= len(s)
+        return mitogen.core.to_text(digest.hexdigest())
+
+    @classmethod
+    def get(cls, context, path, out_fp, base_fp=None, relays=None, offset=0):
+        """
+        Streamily download a file from the connection multiplexer process in
+        the controller.
 
-        LOG.debug('target.get_file(): fetched %d bytes of %r from %r in %dms',
-                  metadata['size'], path, context,
-                  1000 * (mitogen.core.now() - t0))
+        :param mitogen.core.Context context:
+            Reference to the context hosting the FileService that will be used
+            to fetch the file.
+        :param bytes path:
+            FileService registered name of the input file.
+        :param bytes out_path:
+            Name of the output path on the local disk.
+        :param base_fp:
+            If not :data:`None`, a file object open for reading on an existing
+            copy of the file, usually an older version. Only blocks that
+            differ from it are transferred, and the rest are copied from it.
+            If the returned metadata has ``unchanged`` set, nothing was written
+            to `out_fp`.
+        :param list relays:
+            If not empty, IDs of the contexts between this one and `context`,
+            nearest first, that should cache the file and relay it. `base_fp`
+            is ignored by relays.
+        :param int offset:
+            If nonzero, `out_fp` is open for reading and writing, and holds
+            the first `offset` bytes of a previous attempt at the transfer.
+            When they match the file, only the remainder is transferred and
+            appended, otherwise `out_fp` is truncated and the file is
+            transferred in full. May not be combined with `base_fp` or
+            `relays`.
+        :returns:
+            Tuple of (`ok`, `metadata`), where `ok` is :data:`True` on success,
+            or :data:`False` if the transfer was interrupted and the output
+            should be discarded.
+
+            `metadata` is a dictionary of file metadata as documented in
+            :meth:`fetch`.
+        """
+        LOG.debug('get_file(): fetching %r from %r', path, context)
+        t0 = mitogen.core.now()
+        kwargs = {}
+        if base_fp is not None:
+            kwargs['block_digests'] = cls._digest_fp(base_fp)[1]
+        if relays:
+            kwargs['relays'] = relays
+        if offset:
+            kwargs['offset'] = offset
+            kwargs['prefix_digest'] = cls._digest_prefix(out_fp, offset)
+        recv, metadata = cls._request(context, path, **kwargs)
+        if offset:
+            LOG.debug('get_file(%r): resuming at %d of %d bytes',
+                      path, metadata[u'offset'], offset)
+            out_fp.seek(metadata[u'offset'])
+            out_fp.truncate()
+        ok = cls._receive(context, path, recv, metadata, out_fp, base_fp)
+        elapsed = mitogen.core.now() - t0
+        rate = 0.0
+        if elapsed > 0:
+            rate = metadata[u'size'] / elapsed
+        LOG.debug('target.get_file(): fetched %r from %r in %dms '
+                  '(%.2f MiB/s)', path, context, 1000 * elapsed,
+                  rate / 1048576)
         return ok, metadata
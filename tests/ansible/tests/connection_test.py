@@ -11,6 +11,7 @@ import mitogen.core
 import ansible_mitogen.connection
 import ansible_mitogen.plugins.connection.mitogen_local
 import ansible_mitogen.process
+import ansible_mitogen.target
 
 import testlib
 
@@ -101,6 +102,81 @@ class OptionalIntTest(testlib.TestCase):
         self.assertEqual(None, self.func({1:2}))
 
 
+class LineBufferTest(testlib.TestCase):
+    klass = ansible_mitogen.connection.LineBuffer
+
+    def setUp(self):
+        super(LineBufferTest, self).setUp()
+        self.lines = []
+        self.buf = self.klass('stdout', lambda *args: self.lines.append(args))
+
+    def test_split(self):
+        self.buf.feed(b'a\nb')
+        self.buf.feed(b'c\n\nd')
+        self.assertEqual([('stdout', b'a\n'), ('stdout', b'bc\n'),
+                          ('stdout', b'\n')], self.lines)
+        self.buf.flush()
+        self.assertEqual(('stdout', b'd'), self.lines[-1])
+
+    def test_max_size(self):
+        self.buf.max_size = 4
+        self.buf.feed(b'abcdef')
+        self.assertEqual([('stdout', b'abcdef')], self.lines)
+
+
+class ExecCommandTest(ConnectionMixin, testlib.TestCase):
+    def setUp(self):
+        super(ExecCommandTest, self).setUp()
+        self.conn._play_context.remote_addr = 'localhost'
+
+    def test_exec_command(self):
+        rc, stdout, stderr = self.conn.exec_command(
+            'echo out; echo err >&2; exit 3', in_data=b'x'
+        )
+        self.assertEqual(3, rc)
+        self.assertEqual(b'out\n', stdout)
+        self.assertTrue(stderr.startswith(b'err\n'))
+
+    def test_in_data(self):
+        data = b'x' * (ansible_mitogen.target.STREAM_WINDOW_SIZE * 2)
+        rc, stdout, stderr = self.conn.exec_command('cat', in_data=data)
+        self.assertEqual(0, rc)
+        self.assertEqual(data, stdout)
+
+    def test_streaming_exceeds_window(self):
+        size = ansible_mitogen.target.STREAM_WINDOW_SIZE * 3
+        lines = []
+        rc = self.conn.exec_command_streaming(
+            'head -c %d /dev/zero | tr "\\0" "\\n"' % (size,),
+            on_line=lambda name, line: lines.append(line),
+        )
+        self.assertEqual(0, rc)
+        self.assertEqual(size, len(lines))
+
+    def test_streaming_emulate_tty(self):
+        chunks = []
+        rc = self.conn.exec_command_streaming(
+            'echo a; echo b >&2',
+            on_output=lambda name, data: chunks.append((name, data)),
+        )
+        self.assertEqual(0, rc)
+        self.assertEqual(set(['stdout']), set(name for name, _ in chunks))
+        self.assertEqual(b'a\r\nb\r\n', b''.join(data for _, data in chunks))
+
+    def test_pipelined_failure(self):
+        path = tempfile.mktemp(prefix='mitotest', suffix='/missing')
+        self.conn.get_chain().call_no_reply(os.mkdir, path)
+        self.assertRaises(mitogen.core.CallError,
+                          lambda: self.conn.exec_command('true'))
+
+    def test_streaming_pipelined_failure(self):
+        # The command never runs, so only the call's reply can end the wait.
+        path = tempfile.mktemp(prefix='mitotest', suffix='/missing')
+        self.conn.get_chain().call_no_reply(os.mkdir, path)
+        self.assertRaises(mitogen.core.CallError,
+                          lambda: self.conn.exec_command_streaming('true'))
+
+
 class FetchFileTest(ConnectionMixin, testlib.TestCase):
     def test_success(self):
         with tempfile.NamedTemporaryFile(prefix='mitotest') as ifp:
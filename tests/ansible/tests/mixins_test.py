@@ -0,0 +1,179 @@
+from __future__ import absolute_import
+
+import unittest
+
+import ansible.plugins.action
+import mock
+
+import ansible_mitogen.mixins
+import ansible_mitogen.planner
+import testlib
+
+
+class ExecuteRemoteStatTest(testlib.TestCase):
+    klass = ansible_mitogen.mixins.ActionModuleMixin
+
+    def setUp(self):
+        super(ExecuteRemoteStatTest, self).setUp()
+        self.action = mock.Mock(spec=self.klass)
+        self.action._execute_remote_stat_batch.return_value = [
+            {'exists': True},
+        ]
+
+    def call(self):
+        return self.klass._execute_remote_stat(self.action, '/tmp/x', {},
+                                               follow=False)
+
+    @mock.patch.object(ansible.plugins.action.ActionBase,
+                       '_execute_remote_stat')
+    def test_default_runs_module(self, base):
+        base.return_value = {'exists': False, 'checksum': '1'}
+        with mock.patch.object(ansible_mitogen.mixins, 'FAST_STAT', 0):
+            self.assertEqual(base.return_value, self.call())
+        base.assert_called_once_with('/tmp/x', {}, False, tmp=None,
+                                     checksum=True)
+        self.assertFalse(self.action._execute_remote_stat_batch.called)
+
+    @mock.patch.object(ansible.plugins.action.ActionBase,
+                       '_execute_remote_stat')
+    def test_fast_stat(self, base):
+        with mock.patch.object(ansible_mitogen.mixins, 'FAST_STAT', 1):
+            self.assertEqual({'exists': True}, self.call())
+        self.assertFalse(base.called)
+        self.action._execute_remote_stat_batch.assert_called_once_with(
+            ['/tmp/x'], {}, False, True
+        )
+
+
+class TransferFileTest(testlib.TestCase):
+    klass = ansible_mitogen.mixins.ActionModuleMixin
+
+    def setUp(self):
+        super(TransferFileTest, self).setUp()
+        self.action = mock.Mock(spec=self.klass)
+        self.action._delta_base_path = None
+        self.action._connection = mock.Mock()
+
+    def stat(self, dct):
+        self.action._execute_remote_stat_batch.return_value = [dct]
+        with mock.patch.object(ansible_mitogen.mixins, 'FAST_STAT', 1):
+            self.klass._execute_remote_stat(self.action, '/dest', {},
+                                            follow=False)
+
+    def transfer(self):
+        self.assertEqual('/tmp/source', self.klass._transfer_file(
+            self.action, '/local', '/tmp/source'
+        ))
+        return self.action._connection.put_file.call_args
+
+    def test_existing_destination(self):
+        self.stat({'exists': True, 'isreg': True})
+        self.assertEqual(
+            mock.call('/local', '/tmp/source', base_path='/dest'),
+            self.transfer()
+        )
+        # Only the next transfer uses it.
+        self.assertEqual(
+            mock.call('/local', '/tmp/source', base_path=None),
+            self.transfer()
+        )
+
+    def test_missing_destination(self):
+        self.stat({'exists': False})
+        self.assertEqual(
+            mock.call('/local', '/tmp/source', base_path=None),
+            self.transfer()
+        )
+
+    def test_directory_destination(self):
+        self.stat({'exists': True, 'isreg': False})
+        self.assertEqual(
+            mock.call('/local', '/tmp/source', base_path=None),
+            self.transfer()
+        )
+
+
+class ExecuteModuleTest(testlib.TestCase):
+    klass = ansible_mitogen.mixins.ActionModuleMixin
+
+    def setUp(self):
+        super(ExecuteModuleTest, self).setUp()
+        self.action = mock.Mock(spec=self.klass)
+        self.action.ASYNC_STATUS_MODULES = self.klass.ASYNC_STATUS_MODULES
+        self.action._connection = mock.Mock()
+        self.action._finish_module_result.side_effect = lambda result: result
+        self.action._get_async_status.return_value = {'finished': 1}
+
+    def invocation(self, module_name):
+        invocation = mock.Mock()
+        invocation.module_name = module_name
+        invocation.module_args = {'jid': '1'}
+        self.action._make_invocation.return_value = invocation
+
+    def test_default_async_status(self):
+        # The async_status action runs its own module by passing no name.
+        self.invocation(u'ansible.legacy.async_status')
+        with mock.patch.object(ansible_mitogen.planner, 'invoke') as invoke:
+            self.assertEqual({'finished': 1},
+                             self.klass._execute_module(self.action))
+        self.action._get_async_status.assert_called_once_with({'jid': '1'})
+        self.assertFalse(invoke.called)
+
+    def test_other_module(self):
+        self.invocation(u'ansible.legacy.command')
+        with mock.patch.object(ansible_mitogen.planner, 'invoke') as invoke:
+            invoke.return_value = {'rc': 0}
+            self.assertEqual({'rc': 0},
+                             self.klass._execute_module(self.action))
+        self.assertFalse(self.action._get_async_status.called)
+
+
+class ExecuteModuleBatchTest(testlib.TestCase):
+    klass = ansible_mitogen.mixins.ActionModuleMixin
+
+    def setUp(self):
+        super(ExecuteModuleBatchTest, self).setUp()
+        self.action = mock.Mock(spec=self.klass)
+        self.action._connection = mock.Mock()
+        self.action._make_invocation.side_effect = (
+            lambda module_name, module_args, task_vars, wrap_async:
+                module_name
+        )
+        self.action._finish_module_result.side_effect = (
+            lambda result: dict(result, finished=True)
+        )
+
+    def test_order_and_failure(self):
+        batch = [
+            ('ansible.legacy.copy', {'dest': '/x'}),
+            ('ansible.legacy.command', {'_raw_params': 'false'}),
+            ('ansible.legacy.stat', {'path': '/x'}),
+        ]
+        with mock.patch.object(ansible_mitogen.planner,
+                               'invoke_batch') as invoke_batch:
+            invoke_batch.return_value = [
+                {'changed': True},
+                {'rc': 1, 'failed': True},
+                {'stat': {'exists': True}},
+            ]
+            self.assertEqual(
+                [
+                    {'changed': True, 'finished': True},
+                    {'rc': 1, 'failed': True, 'finished': True},
+                    {'stat': {'exists': True}, 'finished': True},
+                ],
+                self.klass._execute_module_batch(self.action, batch, {})
+            )
+        invoke_batch.assert_called_once_with(
+            [module_name for module_name, _ in batch]
+        )
+        self.assertEqual(
+            [mock.call(module_name, module_args, {}, wrap_async=False)
+             for module_name, module_args in batch],
+            self.action._make_invocation.call_args_list
+        )
+        self.action._connection._connect.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
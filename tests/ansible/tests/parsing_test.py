@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+import unittest
+
+import ansible_mitogen.parsing
+
+
+class ParseFileOpsTest(unittest.TestCase):
+    func = staticmethod(ansible_mitogen.parsing.parse_file_ops)
+
+    def test_rm(self):
+        self.assertEqual(
+            [(';', True, 'rm', (['/tmp/a b'], True, True))],
+            self.func("rm -f -r '/tmp/a b' > /dev/null 2>&1"),
+        )
+
+    def test_rm_without_force(self):
+        self.assertEqual(
+            [(';', False, 'rm', (['/tmp/a'], False, False))],
+            self.func('rm /tmp/a'),
+        )
+
+    def test_chmod(self):
+        self.assertEqual(
+            [(';', False, 'chmod', ('u+x', ['/tmp/x', '/tmp/y']))],
+            self.func("chmod u+x '/tmp/x' '/tmp/y'"),
+        )
+
+    def test_connectors(self):
+        self.assertEqual(
+            [(';', False, 'mkdir', (['/tmp/q'], '0700', True)),
+             ('&&', False, 'exists', ('/tmp/q',)),
+             (';', False, 'rm', (['/tmp/q'], False, True))],
+            self.func("mkdir -p -m 0700 /tmp/q && test -e /tmp/q; rm -f /tmp/q"),
+        )
+
+    def test_echo_tilde(self):
+        self.assertEqual(
+            [(';', False, 'expanduser', ('~root',))],
+            self.func('echo ~root'),
+        )
+
+    def test_needs_shell(self):
+        for cmd in [
+            '',
+            'ls /',
+            'rm -f /tmp/$HOME',
+            "rm -f 'relative'",
+            'rm -f /a &',
+            'rm -f /a >/x',
+            'rm -f /a && ',
+            'rm -i /a',
+            'chmod -R 755 /x',
+            'rm -f "/a"',
+            "rm -f '/unterminated",
+            'echo ~/*',
+        ]:
+            self.assertEqual(None, self.func(cmd), cmd)
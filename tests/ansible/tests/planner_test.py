@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+
+import unittest
+
+import mock
+
+import ansible_mitogen.planner
+import testlib
+
+
+class InvokeBatchTest(testlib.TestCase):
+    func = staticmethod(ansible_mitogen.planner.invoke_batch)
+
+    def setUp(self):
+        super(InvokeBatchTest, self).setUp()
+        self.patches = [
+            mock.patch.object(ansible_mitogen.planner, name)
+            for name in ('_get_planner_for', '_invoke_pipelined',
+                         '_invoke_isolated_task', '_invoke_async_task')
+        ]
+        (self.get_planner_for, self.invoke_pipelined,
+         self.invoke_isolated_task, self.invoke_async_task) = [
+            patch.start() for patch in self.patches
+        ]
+        self.get_planner_for.side_effect = self.get_planner
+        self.invoke_pipelined.side_effect = lambda pairs: [
+            {'name': invocation.module_name} for invocation, _ in pairs
+        ]
+        self.invoke_isolated_task.side_effect = (
+            lambda invocation, planner: {'name': invocation.module_name}
+        )
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        super(InvokeBatchTest, self).tearDown()
+
+    def get_planner(self, invocation):
+        planner = mock.Mock()
+        planner.should_fork.return_value = invocation.fork
+        return planner
+
+    def invocation(self, module_name, fork=False):
+        invocation = mock.Mock()
+        invocation.module_name = module_name
+        invocation.fork = fork
+        invocation.wrap_async = False
+        invocation.action._postprocess_response.side_effect = (
+            lambda result: dict(result, postprocessed=True)
+        )
+        return invocation
+
+    def names(self, pairs):
+        return [invocation.module_name for invocation, _ in pairs]
+
+    def test_order(self):
+        invocations = [
+            self.invocation('a'),
+            self.invocation('b'),
+            self.invocation('c', fork=True),
+            self.invocation('d'),
+        ]
+        self.assertEqual(
+            [{'name': name, 'postprocessed': True} for name in 'abcd'],
+            self.func(invocations)
+        )
+        self.assertEqual(
+            [['a', 'b'], ['d']],
+            [self.names(call[0][0])
+             for call in self.invoke_pipelined.call_args_list]
+        )
+        self.invoke_isolated_task.assert_called_once_with(
+            invocations[2], mock.ANY
+        )
+        self.assertFalse(self.invoke_async_task.called)
+
+    def test_failed_item(self):
+        # A failing module does not affect the results of its neighbours.
+        self.invoke_pipelined.side_effect = lambda pairs: [
+            {'name': 'a'},
+            {'name': 'b', 'rc': 1, 'failed': True},
+            {'name': 'c'},
+        ]
+        invocations = [self.invocation(name) for name in 'abc']
+        self.assertEqual(
+            [
+                {'name': 'a', 'postprocessed': True},
+                {'name': 'b', 'rc': 1, 'failed': True, 'postprocessed': True},
+                {'name': 'c', 'postprocessed': True},
+            ],
+            self.func(invocations)
+        )
+        for invocation in invocations:
+            self.assertEqual(
+                1, invocation.action._postprocess_response.call_count
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+
+import unittest
+
+import mock
+
+import ansible_mitogen.process
+import testlib
+
+
+class AssignTest(testlib.TestCase):
+    klass = ansible_mitogen.process.ClassicWorkerModel
+
+    def make_model(self, contexts):
+        model = self.klass.__new__(self.klass)
+        model._muxes = [
+            mock.Mock(index=i, path='/tmp/mux%d' % (i,))
+            for i in range(len(contexts))
+        ]
+        model._index_by_name = {}
+        model._count_by_index = [0] * len(contexts)
+        model.get_stats = lambda: [
+            {'contexts': n, 'routed_bytes': 0}
+            for n in contexts
+        ]
+        return model
+
+    def test_via_group_shares_mux(self):
+        model = self.make_model([0, 0, 0])
+        model.assign({
+            'web1': 'bastion',
+            'web2': 'bastion',
+            'web3': 'bastion',
+            'db1': 'db1',
+        })
+        index = model._index_by_name['bastion']
+        self.assertEqual(index, model._index_by_name['web1'])
+        self.assertEqual(index, model._index_by_name['web2'])
+        self.assertEqual(index, model._index_by_name['web3'])
+        self.assertNotEqual(index, model._index_by_name['db1'])
+
+    def test_least_loaded(self):
+        model = self.make_model([5, 0, 3])
+        model.assign({'a': 'a'})
+        self.assertEqual(1, model._index_by_name['a'])
+
+    def test_spread(self):
+        model = self.make_model([0, 0])
+        model.assign(dict((name, name) for name in 'abcd'))
+        self.assertEqual([2, 2], model._count_by_index)
+
+    def test_placed_hosts_do_not_move(self):
+        model = self.make_model([0, 0])
+        model.assign({'a': 'a'})
+        index = model._index_by_name['a']
+        model.get_stats = lambda: [
+            {'contexts': 10 * (i == index), 'routed_bytes': 0}
+            for i in range(2)
+        ]
+        model.assign({'a': 'a', 'b': 'a'})
+        self.assertEqual(index, model._index_by_name['a'])
+        self.assertEqual(index, model._index_by_name['b'])
+
+    def test_unassigned_stable(self):
+        model = self.make_model([0, 0, 0])
+        self.assertEqual(model._listener_for_name('x'),
+                         model._listener_for_name('x'))
+
+
+class WorkerModelDefaultsTest(testlib.TestCase):
+    klass = ansible_mitogen.process.WorkerModel
+
+    def test_defaults(self):
+        model = self.klass()
+        self.assertEqual(None, model.prewarm({'a': []}, 1))
+        self.assertEqual(None, model.assign({'a': 'a'}))
+        self.assertEqual([], model.get_stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
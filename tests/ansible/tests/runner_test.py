@@ -0,0 +1,136 @@
+import os
+import sys
+import tempfile
+import threading
+
+import testlib
+
+import ansible_mitogen.runner
+
+
+class PhaseTimerTest(testlib.TestCase):
+    klass = ansible_mitogen.runner.PhaseTimer
+
+    def test_format(self):
+        timer = self.klass()
+        timer.mark('setup')
+        timer.mark('run')
+        self.assertEqual(['setup', 'run'],
+                         [name for name, _ in timer.phases])
+        s = timer.format()
+        self.assertTrue(s.startswith('setup='))
+        self.assertTrue(', run=' in s)
+
+
+class TemporaryEnvironmentTest(testlib.TestCase):
+    klass = ansible_mitogen.runner.TemporaryEnvironment
+
+    def setUp(self):
+        self.original_env = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.original_env)
+
+    def test_revert(self):
+        os.environ['RUNNER_TEST_KEEP'] = '1'
+        env = self.klass({'RUNNER_TEST_NEW': '1'})
+        self.assertEqual('1', os.environ['RUNNER_TEST_NEW'])
+        os.environ['RUNNER_TEST_KEEP'] = '2'
+        os.environ['RUNNER_TEST_MODULE'] = '1'
+        env.revert()
+        self.assertEqual('1', os.environ['RUNNER_TEST_KEEP'])
+        self.assertFalse('RUNNER_TEST_NEW' in os.environ)
+        self.assertFalse('RUNNER_TEST_MODULE' in os.environ)
+
+
+class ModuleUtilsImporterTest(testlib.TestCase):
+    klass = ansible_mitogen.runner.ModuleUtilsImporter
+
+    def tearDown(self):
+        sys.modules.pop('runner_test_mod', None)
+
+    def test_update_discards_changed(self):
+        importer = self.klass(None, [('runner_test_mod', '/a.py', False)])
+        try:
+            sys.modules['runner_test_mod'] = object()
+            importer._loaded.add('runner_test_mod')
+            importer.update(None, [('runner_test_mod', '/a.py', False)])
+            self.assertTrue('runner_test_mod' in sys.modules)
+            importer.update(None, [('runner_test_mod', '/b.py', False)])
+            self.assertFalse('runner_test_mod' in sys.modules)
+            self.assertEqual(set(), importer._loaded)
+        finally:
+            importer.revert()
+
+
+class RecycledHooksTest(testlib.TestCase):
+    klass = ansible_mitogen.runner.RecycledHooks
+
+    def setUp(self):
+        self.hooks = self.klass()
+
+    def tearDown(self):
+        if self.hooks.temp_watcher:
+            self.hooks.temp_watcher.revert()
+        if self.hooks.importer:
+            self.hooks.importer.revert()
+
+    def test_temp_watcher_reused(self):
+        watcher = self.hooks.get_temp_watcher()
+        fd, path = tempfile.mkstemp()
+        try:
+            self.assertTrue(self.hooks.get_temp_watcher() is watcher)
+            # Leaked descriptor was closed by the second call.
+            self.assertRaises(OSError, os.fstat, fd)
+        finally:
+            os.unlink(path)
+
+    def test_temp_watcher_ignores_other_threads(self):
+        self.hooks.get_temp_watcher()
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(tempfile.mkstemp())
+        )
+        thread.start()
+        thread.join()
+        fd, path = result[0]
+        try:
+            self.hooks.get_temp_watcher()
+            os.fstat(fd)
+        finally:
+            os.close(fd)
+            os.unlink(path)
+
+    def test_temp_watcher_idle_between_runs(self):
+        self.hooks.get_temp_watcher().check()
+        fd, path = tempfile.mkstemp()
+        try:
+            self.hooks.get_temp_watcher()
+            os.fstat(fd)
+        finally:
+            os.close(fd)
+            os.unlink(path)
+
+    def test_importer_reused(self):
+        importer = self.hooks.get_importer(None, [])
+        self.assertTrue(self.hooks.get_importer(None, []) is importer)
+        self.assertEqual(1, sys.meta_path.count(importer))
+
+    def test_res_init_only_on_change(self):
+        calls = []
+        tf = tempfile.NamedTemporaryFile()
+        self.hooks.resolv_conf_path = tf.name
+        original = ansible_mitogen.runner.libc__res_init
+        ansible_mitogen.runner.libc__res_init = lambda: calls.append(1)
+        try:
+            self.hooks.res_init()
+            self.hooks.res_init()
+            self.assertEqual(1, len(calls))
+            tf.write(b'nameserver 127.0.0.1\n')
+            tf.flush()
+            self.hooks.res_init()
+            self.assertEqual(2, len(calls))
+        finally:
+            ansible_mitogen.runner.libc__res_init = original
+            tf.close()
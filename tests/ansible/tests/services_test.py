@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+import time
+
+import ansible_mitogen.services
+import testlib
+
+
+def send_result(sender, dct):
+    sender.send(dct)
+
+
+def close_sender(sender):
+    sender.close()
+
+
+class AsyncJobServiceTest(testlib.RouterMixin, testlib.TestCase):
+    klass = ansible_mitogen.services.AsyncJobService
+
+    def setUp(self):
+        super(AsyncJobServiceTest, self).setUp()
+        self.service = self.klass(router=self.router)
+        self.context = self.router.local()
+
+    def wait_for(self, job_id, func):
+        deadline = time.time() + 5.0
+        while time.time() < deadline:
+            status = self.service.get(job_id)
+            if func(status):
+                return status
+            time.sleep(0.05)
+        self.fail('timed out waiting for job %r' % (job_id,))
+
+    def test_unknown(self):
+        self.assertEqual(None, self.service.get(u'nope'))
+
+    def test_running(self):
+        self.service.register(u'job', self.context)
+        self.assertEqual({'finished': False}, self.service.get(u'job'))
+
+    def test_finished(self):
+        sender = self.service.register(u'job', self.context)
+        self.context.call(send_result, sender, {'rc': 0, 'finished': 1})
+        status = self.wait_for(u'job', lambda s: s['finished'])
+        self.assertEqual({'rc': 0, 'finished': 1}, status['result'])
+
+    def test_unexpected_sender(self):
+        sender = self.service.register(u'job', self.context)
+        sender.send({'rc': 0})
+        time.sleep(0.2)
+        self.assertEqual({'finished': False}, self.service.get(u'job'))
+
+    def test_closed(self):
+        sender = self.service.register(u'job', self.context)
+        self.context.call(close_sender, sender)
+        self.wait_for(u'job', lambda s: s is None)
+
+    def test_lost(self):
+        self.service.register(u'job', self.context)
+        self.context.shutdown(wait=True)
+        self.wait_for(u'job', lambda s: s is None)
+
+    def test_forget(self):
+        sender = self.service.register(u'job', self.context)
+        self.context.call(send_result, sender, {'rc': 0})
+        self.wait_for(u'job', lambda s: s['finished'])
+        self.service.forget(u'job')
+        self.assertEqual(None, self.service.get(u'job'))
+
+    def test_max_finished(self):
+        self.service.max_finished = 1
+        for job_id in u'job1', u'job2':
+            sender = self.service.register(job_id, self.context)
+            self.context.call(send_result, sender, {'rc': 0})
+            self.wait_for(job_id, lambda s: s['finished'])
+        self.assertEqual(None, self.service.get(u'job1'))
+
+
+class FactsCacheServiceTest(testlib.RouterMixin, testlib.TestCase):
+    klass = ansible_mitogen.services.FactsCacheService
+
+    def setUp(self):
+        super(FactsCacheServiceTest, self).setUp()
+        self.service = self.klass(router=self.router)
+
+    def test_empty(self):
+        self.assertEqual(None, self.service.get_digest(u'host1'))
+        self.assertEqual(None, self.service.get(u'host1', u'abc'))
+
+    def test_put(self):
+        self.service.put(u'host1', u'abc', {'a': 1})
+        self.assertEqual(u'abc', self.service.get_digest(u'host1'))
+        self.assertEqual({'a': 1}, self.service.get(u'host1', u'abc'))
+        self.assertEqual(None, self.service.get(u'host1', u'def'))
+
+    def test_compressed(self):
+        facts = {'a': [u'x' * 1000]}
+        self.service.put(u'host1', u'abc', facts)
+        _, encoded = self.service._entry_by_host[u'host1']
+        self.assertTrue(len(encoded) < 100)
+        self.assertEqual(facts, self.service.get(u'host1', u'abc'))
+
+    def test_many_hosts(self):
+        for i in range(300):
+            self.service.put(u'host%d' % (i,), u'%d' % (i,), {'a': i})
+        self.assertEqual(u'0', self.service.get_digest(u'host0'))
+        self.assertEqual({'a': 299}, self.service.get(u'host299', u'299'))
+
+    def test_replace(self):
+        self.service.put(u'host1', u'abc', {'a': 1})
+        self.service.put(u'host1', u'def', {'a': 2})
+        self.assertEqual(None, self.service.get(u'host1', u'abc'))
+        self.assertEqual({'a': 2}, self.service.get(u'host1', u'def'))
@@ -0,0 +1,160 @@
+from __future__ import absolute_import
+
+import unittest
+
+import mock
+
+import ansible_mitogen.strategy
+import testlib
+
+
+class ViaRootTest(testlib.TestCase):
+    func = staticmethod(ansible_mitogen.strategy._via_root)
+
+    def test_direct(self):
+        self.assertEqual(None, self.func({}))
+
+    def test_chain(self):
+        self.assertEqual('bastion', self.func({
+            'mitogen_via': 'root@jump',
+            'hostvars': {
+                'jump': {'mitogen_via': 'bastion'},
+                'bastion': {},
+            },
+        }))
+
+    def test_cycle(self):
+        self.assertEqual('b', self.func({
+            'mitogen_via': 'a',
+            'hostvars': {
+                'a': {'mitogen_via': 'b'},
+                'b': {'mitogen_via': 'a'},
+            },
+        }))
+
+
+class NeedsInterpreterDiscoveryTest(testlib.TestCase):
+    func = staticmethod(ansible_mitogen.strategy._needs_interpreter_discovery)
+
+    def test_unset(self):
+        self.assertTrue(self.func({}))
+
+    def test_auto(self):
+        self.assertTrue(self.func({'ansible_python_interpreter': 'auto'}))
+
+    def test_explicit(self):
+        self.assertFalse(self.func({
+            'ansible_python_interpreter': '/usr/bin/python3',
+        }))
+
+    def test_discovered(self):
+        self.assertFalse(self.func({
+            'ansible_facts': {
+                'discovered_interpreter_python': '/usr/bin/python3',
+            },
+        }))
+
+    def test_via_unset(self):
+        self.assertTrue(self.func({
+            'ansible_python_interpreter': '/usr/bin/python3',
+            'mitogen_via': 'root@bastion',
+            'hostvars': {
+                'bastion': {},
+            },
+        }))
+
+    def test_via_explicit(self):
+        self.assertFalse(self.func({
+            'ansible_python_interpreter': '/usr/bin/python3',
+            'mitogen_via': 'bastion',
+            'hostvars': {
+                'bastion': {
+                    'ansible_python_interpreter': '/usr/bin/python',
+                },
+            },
+        }))
+
+    def test_via_unknown_host(self):
+        self.assertTrue(self.func({
+            'ansible_python_interpreter': '/usr/bin/python3',
+            'mitogen_via': 'bastion',
+            'hostvars': {},
+        }))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class StripBecomeTest(testlib.TestCase):
+    func = staticmethod(ansible_mitogen.strategy._strip_become)
+
+    def stack(self, *methods):
+        return tuple({'method': method, 'kwargs': {}} for method in methods)
+
+    def test_become_hop(self):
+        self.assertEqual(self.stack('ssh'),
+                         self.func(self.stack('ssh', 'sudo')))
+
+    def test_same_user(self):
+        # No become hop was added, so the login hop must remain.
+        self.assertEqual(self.stack('ssh'), self.func(self.stack('ssh')))
+
+    def test_via_become_hop(self):
+        stack = self.stack('ssh', 'sudo', 'ssh')
+        self.assertEqual(stack, self.func(stack))
+
+    def test_become_login(self):
+        stack = self.stack('sudo')
+        self.assertEqual(stack, self.func(stack))
+
+
+class AssignMultiplexersTest(testlib.TestCase):
+    klass = ansible_mitogen.strategy.StrategyMixin
+
+    def setUp(self):
+        host = mock.Mock()
+        host.name = 'a'
+        self.strategy = mock.Mock(spec=self.klass)
+        self.strategy._inventory = mock.Mock()
+        self.strategy._inventory.get_hosts.return_value = [host]
+        self.strategy._variable_manager = mock.Mock()
+        self.strategy._variable_manager.get_vars.return_value = {}
+        self.strategy._worker_model = mock.Mock()
+
+    def test_disabled(self):
+        with mock.patch.object(ansible_mitogen.strategy,
+                               'ASSIGN_MULTIPLEXERS', 0):
+            self.klass._assign_multiplexers(self.strategy, mock.Mock())
+        self.assertFalse(self.strategy._variable_manager.get_vars.called)
+        self.assertFalse(self.strategy._worker_model.assign.called)
+
+    def test_enabled(self):
+        with mock.patch.object(ansible_mitogen.strategy,
+                               'ASSIGN_MULTIPLEXERS', 1):
+            self.klass._assign_multiplexers(self.strategy, mock.Mock())
+        self.strategy._worker_model.assign.assert_called_once_with({'a': 'a'})
+
+
+class LogMultiplexerStatsTest(testlib.TestCase):
+    klass = ansible_mitogen.strategy.StrategyMixin
+
+    def setUp(self):
+        self.strategy = mock.Mock(spec=self.klass)
+        self.strategy._worker_model = mock.Mock()
+        self.strategy._worker_model.get_stats.return_value = []
+
+    def call(self, assign):
+        with mock.patch.object(ansible_mitogen.strategy,
+                               'ASSIGN_MULTIPLEXERS', assign):
+            with mock.patch.object(ansible_mitogen.strategy.LOG,
+                                   'isEnabledFor', return_value=True):
+                self.klass._log_multiplexer_stats(self.strategy)
+
+    def test_disabled(self):
+        self.call(0)
+        self.assertFalse(self.strategy._worker_model.get_stats.called)
+
+    def test_enabled(self):
+        self.call(1)
+        self.strategy._worker_model.get_stats.assert_called_once_with()
@@ -1,11 +1,16 @@
 from __future__ import absolute_import
+import hashlib
+import json
 import os.path
 import subprocess
 import tempfile
+import time
 import unittest
+import zlib
 
 import mock
 
+import mitogen.service
 import ansible_mitogen.target
 import testlib
 
@@ -105,3 +110,389 @@ class IsGoodTempDirTest(unittest.TestCase):
         os_access.return_value = False
         with NamedTemporaryDirectory() as temp_path:
             self.assertFalse(self.func(temp_path))
+
+
+class AsyncJobWatcherTest(unittest.TestCase):
+    klass = ansible_mitogen.target.AsyncJobWatcher
+
+    def setUp(self):
+        self.async_dir = tempfile.mkdtemp()
+        self.watcher = self.klass()
+
+    def tearDown(self):
+        subprocess.check_call(['rm', '-rf', self.async_dir])
+
+    def check(self, dct):
+        if dct is not None:
+            with open(os.path.join(self.async_dir, 'job'), 'w') as fp:
+                json.dump(dct, fp)
+        with mock.patch.dict(os.environ, ANSIBLE_ASYNC_DIR=self.async_dir):
+            return self.watcher._check('job')
+
+    def test_running(self):
+        dct = {'started': 1, 'finished': 0, 'pid': os.getpid()}
+        self.assertEqual(None, self.check(dct))
+
+    def test_finished(self):
+        dct = {'rc': 0, 'ansible_job_id': 'job'}
+        self.assertEqual(dict(dct, finished=1), self.check(dct))
+
+    def test_missing(self):
+        self.assertEqual(False, self.check(None))
+
+    def test_dead(self):
+        proc = subprocess.Popen(['true'])
+        proc.wait()
+        dct = {'started': 1, 'finished': 0, 'pid': proc.pid}
+        self.assertEqual(False, self.check(dct))
+
+
+class RunFileOpsTest(unittest.TestCase):
+    func = staticmethod(ansible_mitogen.target.run_file_ops)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        subprocess.check_call(['rm', '-rf', self.tmpdir])
+
+    def test_mkdir_chmod_rm(self):
+        path = os.path.join(self.tmpdir, 'a', 'b')
+        rc, stdout, stderr = self.func([
+            (';', False, 'mkdir', ([path], '0700', True)),
+            ('&&', False, 'chmod', ('u+x,g+r', [path])),
+        ])
+        self.assertEqual((0, '', ''), (rc, stdout, stderr))
+        self.assertEqual(0o740, os.stat(path).st_mode & 0o777)
+
+        rc, stdout, stderr = self.func([
+            (';', False, 'rm', ([os.path.join(self.tmpdir, 'a')], True, True)),
+        ])
+        self.assertEqual(0, rc)
+        self.assertFalse(os.path.exists(path))
+
+    def test_mkdir_mode(self):
+        old_umask = os.umask(0o077)
+        try:
+            path = os.path.join(self.tmpdir, 'a', 'b')
+            self.assertEqual((0, '', ''), self.func([
+                (';', False, 'mkdir', ([path], '0755', True)),
+            ]))
+            self.assertEqual(0o077, os.umask(0o077))
+        finally:
+            os.umask(old_umask)
+        self.assertEqual(0o755, os.stat(path).st_mode & 0o777)
+        # Like mkdir -p -m, missing parents get the default mode.
+        parent = os.path.dirname(path)
+        self.assertEqual(0o700, os.stat(parent).st_mode & 0o777)
+
+    def test_rm_missing(self):
+        path = os.path.join(self.tmpdir, 'missing')
+        self.assertEqual((0, '', ''), self.func([
+            (';', False, 'rm', ([path], False, True)),
+        ]))
+
+    def test_rm_missing_without_force(self):
+        path = os.path.join(self.tmpdir, 'missing')
+        rc, stdout, stderr = self.func([
+            (';', False, 'rm', ([path], False, False)),
+        ])
+        self.assertEqual(1, rc)
+        self.assertIn(path, stderr)
+
+    def test_rm_dir_not_recursive(self):
+        rc, stdout, stderr = self.func([
+            (';', False, 'rm', ([self.tmpdir], False, True)),
+        ])
+        self.assertEqual(1, rc)
+        self.assertIn(self.tmpdir, stderr)
+
+    def test_quiet(self):
+        self.assertEqual((1, '', ''), self.func([
+            (';', True, 'rm', ([self.tmpdir], False, True)),
+        ]))
+
+    def test_and_skips_after_failure(self):
+        path = os.path.join(self.tmpdir, 'x')
+        rc, stdout, stderr = self.func([
+            (';', False, 'exists', (path,)),
+            ('&&', False, 'mkdir', ([path], None, False)),
+            (';', False, 'expanduser', ('~',)),
+        ])
+        self.assertEqual(0, rc)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.path.expanduser('~') + '\n', stdout)
+
+
+class StatPathsTest(unittest.TestCase):
+    func = staticmethod(ansible_mitogen.target.stat_paths)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'file')
+        self.write(b'hello')
+        ansible_mitogen.target._checksum_cache.clear()
+
+    def tearDown(self):
+        subprocess.check_call(['rm', '-rf', self.tmpdir])
+
+    def write(self, s, mtime=1000000000):
+        with open(self.path, 'wb') as fp:
+            fp.write(s)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_missing(self):
+        path = os.path.join(self.tmpdir, 'missing')
+        self.assertEqual([{'changed': False, 'stat': {'exists': False}}],
+                         self.func([path]))
+
+    def test_stat(self):
+        link = os.path.join(self.tmpdir, 'link')
+        os.symlink(self.path, link)
+        dct, link_dct = [r['stat'] for r in self.func([self.path, link])]
+        self.assertTrue(dct['isreg'])
+        self.assertEqual(5, dct['size'])
+        self.assertEqual(hashlib.sha1(b'hello').hexdigest(), dct['checksum'])
+        self.assertTrue(link_dct['islnk'])
+        self.assertEqual(self.path, link_dct['lnk_target'])
+        self.assertNotIn('checksum', link_dct)
+
+    def test_follow(self):
+        link = os.path.join(self.tmpdir, 'link')
+        os.symlink(self.path, link)
+        dct, = [r['stat'] for r in self.func([link], follow=True)]
+        self.assertTrue(dct['isreg'])
+        self.assertIn('checksum', dct)
+
+    def hash_later(self):
+        # Hash as if the file's change time was long enough ago to cache it.
+        with mock.patch('time.time', return_value=time.time() + 10):
+            return self.func([self.path])[0]['stat']
+
+    def test_checksum_cached(self):
+        self.hash_later()
+        self.assertIn(self.path, ansible_mitogen.target._checksum_cache)
+        with mock.patch('ansible_mitogen.target.sha1') as sha1:
+            dct = self.func([self.path])[0]['stat']
+        self.assertEqual(0, sha1.call_count)
+        self.assertEqual(hashlib.sha1(b'hello').hexdigest(), dct['checksum'])
+
+    def test_checksum_invalidated(self):
+        self.hash_later()
+        # Same size and mtime; change time differs.
+        self.write(b'world')
+        dct = self.func([self.path])[0]['stat']
+        self.assertEqual(hashlib.sha1(b'world').hexdigest(), dct['checksum'])
+
+    def test_recent_file_not_cached(self):
+        self.write(b'hello', mtime=time.time())
+        self.func([self.path])
+        self.assertNotIn(self.path, ansible_mitogen.target._checksum_cache)
+
+
+class EncodeResultTest(unittest.TestCase):
+    def setUp(self):
+        ansible_mitogen.target._facts_digest = None
+        ansible_mitogen.target._facts = None
+
+    def encode(self, stdout, compress_size=0, facts_delta=False,
+               facts_digest=None, parse_result=False):
+        result = {'rc': 0, 'stdout': stdout}
+        ansible_mitogen.target._encode_result(result, compress_size,
+                                              facts_delta, facts_digest,
+                                              parse_result)
+        return result
+
+    def run_facts(self, facts, base_digest):
+        result = self.encode(json.dumps({'ansible_facts': facts}),
+                             facts_delta=True, facts_digest=base_digest)
+        return result, json.loads(result['stdout'])['ansible_facts']
+
+    def test_not_json(self):
+        result = self.encode('junk', facts_delta=True, parse_result=True)
+        self.assertEqual({'rc': 0, 'stdout': 'junk'}, result)
+
+    def test_full(self):
+        facts = {'a': 1, 'b': 2}
+        result, sent = self.run_facts(facts, None)
+        self.assertEqual(facts, sent)
+        self.assertEqual(None, result['facts_delta']['base'])
+
+    def test_delta(self):
+        first, _ = self.run_facts({'a': 1, 'b': 2, 'c': 3}, None)
+        digest = first['facts_delta']['digest']
+        result, sent = self.run_facts({'a': 1, 'b': 4, 'd': 5}, digest)
+        self.assertEqual({'b': 4, 'd': 5}, sent)
+        self.assertEqual(digest, result['facts_delta']['base'])
+        self.assertEqual(['c'], result['facts_delta']['removed'])
+
+    def test_stale_digest(self):
+        self.run_facts({'a': 1}, None)
+        result, sent = self.run_facts({'a': 1}, 'stale')
+        self.assertEqual({'a': 1}, sent)
+        self.assertEqual(None, result['facts_delta']['base'])
+
+    def test_compress(self):
+        stdout = u'x' * 100
+        result = self.encode(stdout, compress_size=101)
+        self.assertEqual(stdout, result['stdout'])
+        result = self.encode(stdout, compress_size=100)
+        self.assertEqual(u'', result['stdout'])
+        self.assertEqual(stdout.encode('utf-8'),
+                         zlib.decompress(result['stdout_zlib']))
+
+    def test_parse(self):
+        dct = {u'changed': False, u'list': [1, 2.5, None, True, u'x']}
+        result = self.encode(json.dumps(dct) + '\n', parse_result=True)
+        self.assertEqual(u'', result['stdout'])
+        self.assertEqual(dct, result['parsed'])
+
+    def test_parse_not_object(self):
+        result = self.encode(u'[1]', parse_result=True)
+        self.assertEqual(u'[1]', result['stdout'])
+        self.assertNotIn('parsed', result)
+
+    def test_parse_trailing_junk(self):
+        result = self.encode(u'{}\njunk', parse_result=True)
+        self.assertEqual(u'{}\njunk', result['stdout'])
+        self.assertNotIn('parsed', result)
+
+    def test_parse_delta(self):
+        first = self.encode(json.dumps({'ansible_facts': {'a': 1, 'b': 2}}),
+                            facts_delta=True, parse_result=True)
+        result = self.encode(json.dumps({'ansible_facts': {'a': 1, 'b': 3}}),
+                             facts_delta=True, parse_result=True,
+                             facts_digest=first['facts_delta']['digest'])
+        self.assertEqual({'ansible_facts': {'b': 3}}, result['parsed'])
+
+
+class IsJsonValueTest(unittest.TestCase):
+    func = staticmethod(ansible_mitogen.target._is_json_value)
+
+    def test_valid(self):
+        self.assertTrue(self.func({u'a': [1, 2.5, None, True, {u'b': u'c'}]}))
+
+    def test_bytes(self):
+        self.assertFalse(self.func({u'a': [b'x']}))
+        self.assertFalse(self.func({b'a': 1}))
+
+    def test_tuple(self):
+        self.assertFalse(self.func({u'a': (1,)}))
+
+
+class TransferFileResumeTest(testlib.RouterMixin, testlib.TestCase):
+    def setUp(self):
+        super(TransferFileResumeTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.in_path = os.path.join(self.tmpdir, 'in')
+        self.out_path = os.path.join(self.tmpdir, 'out')
+        self.partial_path = ansible_mitogen.target._get_partial_path(
+            self.out_path
+        )
+        self.content = os.urandom(300000)
+        with open(self.in_path, 'wb') as fp:
+            fp.write(self.content)
+        service = mitogen.service.FileService(self.router)
+        service.register(self.in_path)
+        self.pool = mitogen.service.Pool(self.router, services=[service],
+                                         size=1)
+        self.child = self.router.local()
+
+    def tearDown(self):
+        self.pool.stop()
+        subprocess.check_call(['rm', '-rf', self.tmpdir])
+        super(TransferFileResumeTest, self).tearDown()
+
+    def transfer(self):
+        self.child.call(ansible_mitogen.target.transfer_file,
+                        context=self.router.myself(),
+                        in_path=self.in_path,
+                        out_path=self.out_path,
+                        resumable=True)
+        with open(self.out_path, 'rb') as fp:
+            self.assertEqual(self.content, fp.read())
+        self.assertFalse(os.path.exists(self.partial_path))
+
+    def write_partial(self, s):
+        with open(self.partial_path, 'wb') as fp:
+            fp.write(s)
+
+    def test_resume(self):
+        self.write_partial(self.content[:100000])
+        self.transfer()
+
+    def test_resume_mismatch(self):
+        self.write_partial(os.urandom(100000))
+        self.transfer()
+
+    def test_interrupted(self):
+        def get(out_fp, **kwargs):
+            out_fp.write(self.content[:1000])
+            return False, {}
+
+        with mock.patch('mitogen.service.FileService.get', side_effect=get):
+            self.assertRaises(IOError,
+                              ansible_mitogen.target.transfer_file,
+                              context=None,
+                              in_path=self.in_path,
+                              out_path=self.out_path,
+                              resumable=True)
+        with open(self.partial_path, 'rb') as fp:
+            self.assertEqual(self.content[:1000], fp.read())
+        self.assertEqual(sorted([os.path.basename(self.in_path),
+                                 os.path.basename(self.partial_path)]),
+                         sorted(os.listdir(self.tmpdir)))
+
+
+class TransferFileDeltaTest(testlib.RouterMixin, testlib.TestCase):
+    def setUp(self):
+        super(TransferFileDeltaTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.in_path = os.path.join(self.tmpdir, 'in')
+        self.out_path = os.path.join(self.tmpdir, 'out')
+        self.base_path = os.path.join(self.tmpdir, 'base')
+        self.content = os.urandom(300000)
+        with open(self.in_path, 'wb') as fp:
+            fp.write(self.content)
+        service = mitogen.service.FileService(self.router)
+        service.register(self.in_path)
+        self.pool = mitogen.service.Pool(self.router, services=[service],
+                                         size=1)
+        self.child = self.router.local()
+
+    def tearDown(self):
+        self.pool.stop()
+        subprocess.check_call(['rm', '-rf', self.tmpdir])
+        super(TransferFileDeltaTest, self).tearDown()
+
+    def write(self, path, s):
+        with open(path, 'wb') as fp:
+            fp.write(s)
+
+    def transfer(self, base_path):
+        self.child.call(ansible_mitogen.target.transfer_file,
+                        context=self.router.myself(),
+                        in_path=self.in_path,
+                        out_path=self.out_path,
+                        base_path=base_path)
+        with open(self.out_path, 'rb') as fp:
+            self.assertEqual(self.content, fp.read())
+
+    def test_changed_base(self):
+        self.write(self.base_path, self.content[:200000] + b'x' * 100000)
+        self.transfer(self.base_path)
+
+    def test_unchanged_base(self):
+        self.write(self.base_path, self.content)
+        self.transfer(self.base_path)
+        with open(self.base_path, 'rb') as fp:
+            self.assertEqual(self.content, fp.read())
+
+    def test_unchanged_in_place(self):
+        self.write(self.out_path, self.content)
+        ino = os.stat(self.out_path).st_ino
+        self.transfer(self.out_path)
+        self.assertEqual(ino, os.stat(self.out_path).st_ino)
+
+    def test_missing_base(self):
+        self.transfer(self.base_path)
@@ -0,0 +1,83 @@
+"""
+Measure mitogen.core.is_blacklisted_import() with the prefix lists Ansible
+installs, and with a long user-supplied blacklist, against the per-prefix
+str.startswith() scan it replaced.
+
+Usage: blacklist.py [extra_prefixes]
+
+Defaults to 200 extra blacklisted prefixes for the long list.
+"""
+
+import sys
+import timeit
+
+import mitogen.core
+
+
+# As installed by ansible_mitogen.process._setup_responder().
+WHITELIST = ['mitogen', 'ansible', 'ansible_mitogen', 'simplejson']
+
+NAMES = [
+    'ansible',
+    'ansible.module_utils.basic',
+    'ansible.module_utils.common.text.converters',
+    'ansible.module_utils.six.moves',
+    'ansible_mitogen.runner',
+    'ansible_mitogen.target',
+    'mitogen.core',
+    'mitogen.service',
+    'simplejson.decoder',
+    'encodings.idna',
+    'json',
+    'os.path',
+]
+
+
+class Importer(object):
+    whitelist = mitogen.core.prefix_list('whitelist')
+    blacklist = mitogen.core.prefix_list('blacklist')
+
+    def __init__(self, whitelist, blacklist):
+        self.whitelist = whitelist
+        self.blacklist = blacklist
+
+
+def linear(importer, fullname):
+    return ((not any(fullname.startswith(s) for s in importer.whitelist)) or
+            (any(fullname.startswith(s) for s in importer.blacklist)))
+
+
+def measure(func, importer):
+    number = 2000
+    secs = min(timeit.repeat(
+        lambda: [func(importer, name) for name in NAMES],
+        number=number,
+        repeat=5,
+    ))
+    return 1e9 * secs / (number * len(NAMES))
+
+
+def main():
+    extra = int((sys.argv[1:] or [200])[0])
+    blacklist = list(mitogen.core.Importer.ALWAYS_BLACKLIST)
+    long_blacklist = blacklist + [
+        'vendor%d_pkg.internal' % (n,) for n in range(extra)
+    ]
+
+    for label, importer in (
+        ('ansible lists', Importer(WHITELIST, blacklist)),
+        ('%d prefixes' % (len(long_blacklist),),
+         Importer(WHITELIST, long_blacklist)),
+    ):
+        for name in NAMES:
+            assert (linear(importer, name) ==
+                    mitogen.core.is_blacklisted_import(importer, name))
+        print('%s: linear %.0f ns, trie %.0f ns per name' % (
+            label,
+            measure(linear, importer),
+            measure(mitogen.core.is_blacklisted_import, importer),
+        ))
+
+
+if __name__ == '__main__':
+    main()
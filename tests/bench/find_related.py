@@ -0,0 +1,55 @@
+"""
+Measure ModuleFinder.find_related() over every importable module of a large
+package tree, as ModuleResponder does for each module a child requests.
+
+Usage: find_related.py [package ...]
+
+Defaults to ansible.module_utils and ansible.plugins, falling back to mitogen
+itself when Ansible is not installed.
+"""
+
+import importlib
+import pkgutil
+import sys
+import time
+
+import mitogen.master
+
+
+def import_tree(pkgname):
+    names = [pkgname]
+    pkg = importlib.import_module(pkgname)
+    for _, name, _ in pkgutil.walk_packages(pkg.__path__, pkgname + '.'):
+        try:
+            importlib.import_module(name)
+        except Exception:
+            continue
+        names.append(name)
+    return names
+
+
+def main():
+    pkgnames = sys.argv[1:] or ['ansible.module_utils', 'ansible.plugins']
+    names = []
+    for pkgname in pkgnames:
+        try:
+            names.extend(import_tree(pkgname))
+        except ImportError:
+            names.extend(import_tree('mitogen'))
+            break
+
+    finder = mitogen.master.ModuleFinder()
+    t0 = time.time()
+    edges = sum(len(finder.find_related(name)) for name in names)
+    t1 = time.time()
+    for name in names:
+        finder.find_related(name)
+    t2 = time.time()
+
+    print('%d modules, %d related' % (len(names), edges))
+    print('cold: %.1f ms' % (1000 * (t1 - t0),))
+    print('warm: %.1f ms' % (1000 * (t2 - t1),))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Measure controller CPU spent decoding 1,000 fact-sized module results, when
+the target returns the module's JSON output as text, and when it returns the
+output already decoded, as with MITOGEN_PARSE_RESULTS=1.
+"""
+
+import json
+import time
+
+from ansible.module_utils.json_utils import _filter_non_json_lines
+
+import mitogen.core
+
+
+COUNT = 1000
+
+
+def make_facts():
+    """
+    Build a dict resembling setup module output from a busy host.
+    """
+    facts = {}
+    for n in range(40):
+        facts['ansible_eth%d' % (n,)] = {
+            'device': 'eth%d' % (n,),
+            'active': True,
+            'mtu': 1500,
+            'macaddress': '52:54:00:12:34:%02x' % (n,),
+            'ipv4': {'address': '10.0.%d.1' % (n,), 'netmask': '255.255.0.0'},
+            'features': dict(('feature_%d' % (x,), 'off [fixed]')
+                             for x in range(40)),
+        }
+    facts['ansible_mounts'] = [
+        {'mount': '/mnt/%d' % (n,), 'device': '/dev/sd%d' % (n,),
+         'size_total': 1 << 40, 'size_available': 1 << 39,
+         'options': 'rw,relatime'}
+        for n in range(50)
+    ]
+    facts['ansible_env'] = dict(('VAR_%d' % (n,), 'x' * 40)
+                                for n in range(100))
+    return {'ansible_facts': facts, 'changed': False}
+
+
+def text_result(data):
+    result = mitogen.core.Message(data=data).unpickle()
+    filtered, _ = _filter_non_json_lines(result['stdout'], objects_only=True)
+    return json.loads(filtered)
+
+
+def parsed_result(data):
+    return mitogen.core.Message(data=data).unpickle()['parsed']
+
+
+def measure(func, arg):
+    clock = getattr(time, 'process_time', None) or time.clock
+    t0 = clock()
+    for x in range(COUNT):
+        func(arg)
+    return clock() - t0
+
+
+def main():
+    stdout = json.dumps(make_facts())
+    text_msg = mitogen.core.Message.pickled({
+        'rc': 0, 'stdout': stdout, 'stderr': '',
+    })
+    parsed_msg = mitogen.core.Message.pickled({
+        'rc': 0, 'stdout': '', 'stderr': '', 'parsed': json.loads(stdout),
+    })
+    text_secs = measure(text_result, text_msg.data)
+    parsed_secs = measure(parsed_result, parsed_msg.data)
+    print('%d results of %d bytes' % (COUNT, len(stdout)))
+    print('text:   %.2f ms CPU' % (1000 * text_secs,))
+    print('parsed: %.2f ms CPU' % (1000 * parsed_secs,))
+    print('saved:  %.2f ms CPU' % (1000 * (text_secs - parsed_secs),))
+
+
+if __name__ == '__main__':
+    main()
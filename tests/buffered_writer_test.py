@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+import mock
+
+import mitogen.core
+
+import testlib
+
+from mitogen.core import b
+
+
+@unittest.skipIf(not mitogen.core.FileRegion.supported,
+                 'FileRegion unsupported on this platform')
+class WriteRegionTest(testlib.TestCase):
+    klass = mitogen.core.BufferedWriter
+
+    def setUp(self):
+        super(WriteRegionTest, self).setUp()
+        self.content = os.urandom(mitogen.core.CHUNK_SIZE * 2 + 100)
+        self.fp = tempfile.TemporaryFile()
+        self.fp.write(self.content)
+        self.fp.flush()
+        rfd, wfd = os.pipe()
+        self.rfp = os.fdopen(rfd, 'rb', 0)
+        self.stream = mock.Mock()
+        self.stream.transmit_side = mitogen.core.Side(
+            self.stream, os.fdopen(wfd, 'wb', 0)
+        )
+        self.broker = mock.Mock()
+        protocol = mock.Mock()
+        protocol.stream = self.stream
+        self.writer = self.klass(self.broker, protocol)
+
+    def tearDown(self):
+        self.stream.transmit_side.close()
+        self.rfp.close()
+        self.fp.close()
+        super(WriteRegionTest, self).tearDown()
+
+    def drain(self, n):
+        """
+        Read `n` bytes from the pipe, pumping the writer as it would be when
+        the stream becomes writeable.
+        """
+        chunks = []
+        while n:
+            # Empty the pipe, so it is writeable.
+            s = self.rfp.read(min(n, 65536))
+            chunks.append(s)
+            n -= len(s)
+            if self.writer._len:
+                self.writer.on_transmit(self.broker)
+        return b('').join(chunks)
+
+    def test_region_follows_bytes(self):
+        region = mitogen.core.FileRegion(self.fp, 100, len(self.content) - 100)
+        self.writer.write(b('header'))
+        self.writer.write_region(region)
+        expect = b('header') + self.content[100:]
+        self.assertEqual(expect, self.drain(len(expect)))
+        self.assertEqual(None, region.fd)
+        self.assertEqual(0, self.writer._len)
+
+    def test_sendfile_unsupported(self):
+        self.stream.transmit_side._sendfile_ok = False
+        region = mitogen.core.FileRegion(self.fp, 0, len(self.content))
+        self.writer.write_region(region)
+        self.assertEqual(self.content, self.drain(len(self.content)))
+        self.assertEqual(None, region.fd)
+
+    def test_truncated(self):
+        region = mitogen.core.FileRegion(self.fp, 0, len(self.content) + 10)
+        region.trailer = b('trailer')
+        self.writer.write_region(region)
+        self.assertEqual(self.content, self.drain(len(self.content)))
+        # Replace the missing bytes, then write them.
+        self.writer.on_transmit(self.broker)
+        expect = b('\x00') * 10 + b('trailer')
+        self.assertEqual(expect, self.drain(len(expect)))
+        self.assertEqual(0, self.stream.on_disconnect.call_count)
+        self.assertEqual(None, region.fd)
+        self.assertEqual(0, self.writer._len)
@@ -1,10 +1,514 @@
+import hashlib
+import io
+import os
+import shutil
 import sys
+import tempfile
+import time
+import unittest
 
+import mock
+
+import mitogen.core
 import mitogen.service
 
 import testlib
 
 
+def get_whole(context, path):
+    fp = io.BytesIO()
+    ok, metadata = mitogen.service.FileService.get(
+        context=context,
+        path=path,
+        out_fp=fp,
+    )
+    return ok, metadata, fp.getvalue()
+
+
+def get_with_base(context, path, base):
+    fp = io.BytesIO()
+    base_fp = io.BytesIO(base)
+    ok, metadata = mitogen.service.FileService.get(
+        context=context,
+        path=path,
+        out_fp=fp,
+        base_fp=base_fp,
+    )
+    return ok, metadata, fp.getvalue()
+
+
+def get_resumed(context, path, partial):
+    fp = io.BytesIO(partial)
+    ok, metadata = mitogen.service.FileService.get(
+        context=context,
+        path=path,
+        out_fp=fp,
+        offset=len(partial),
+    )
+    return ok, metadata, fp.getvalue()
+
+
+def fetch_with_offset(context, path, offset):
+    recv = mitogen.core.Receiver(router=context.router)
+    return context.call_service(
+        service_name=mitogen.service.FileService.name(),
+        method_name='fetch',
+        path=path,
+        sender=recv.to_sender(),
+        offset=offset,
+    )
+
+
+def get_relayed(context, path, relays):
+    fp = io.BytesIO()
+    ok, metadata = mitogen.service.FileService.get(
+        context=context,
+        path=path,
+        out_fp=fp,
+        relays=relays,
+    )
+    digest = hashlib.sha1(fp.getvalue()).hexdigest()
+    return ok, metadata['size'], digest
+
+
+class DeltaReaderTest(testlib.TestCase):
+    klass = mitogen.service.DeltaReader
+
+    def test_selected_blocks(self):
+        fp = io.BytesIO(mitogen.core.b('aaabbbcccdd'))
+        reader = self.klass(fp, 3, [1, 3])
+        self.assertEqual(mitogen.core.b('bb'), reader.read(2))
+        self.assertEqual(mitogen.core.b('b'), reader.read(10))
+        self.assertEqual(mitogen.core.b('dd'), reader.read(10))
+        self.assertEqual(mitogen.core.b(''), reader.read(10))
+
+    def test_no_blocks(self):
+        fp = io.BytesIO(mitogen.core.b('aaabbb'))
+        reader = self.klass(fp, 3, [])
+        self.assertEqual(mitogen.core.b(''), reader.read(10))
+
+
+class ServeFileMixin(testlib.RouterMixin):
+    klass = mitogen.service.FileService
+
+    def setUp(self):
+        super(ServeFileMixin, self).setUp()
+        self.block_size = self.klass.delta_block_size
+        self.content = os.urandom(self.block_size * 3 + 100)
+        fd, self.path = tempfile.mkstemp(prefix='file_service_test')
+        os.write(fd, self.content)
+        os.close(fd)
+        self.service = self.klass(self.router)
+        self.service.register(self.path)
+        self.pool = mitogen.service.Pool(
+            router=self.router,
+            services=[self.service],
+            size=1,
+        )
+        self.l1 = self.router.local()
+
+    def tearDown(self):
+        self.pool.stop()
+        os.unlink(self.path)
+        super(ServeFileMixin, self).tearDown()
+
+
+class DeltaFetchTest(ServeFileMixin, testlib.TestCase):
+    def get(self, base):
+        return self.l1.call(get_with_base, self.router.myself(),
+                            self.path, base)
+
+    def test_unchanged(self):
+        ok, metadata, data = self.get(self.content)
+        self.assertTrue(ok)
+        self.assertTrue(metadata['unchanged'])
+        self.assertEqual([], metadata['blocks'])
+        self.assertEqual(mitogen.core.b(''), data)
+
+    def test_changed_block(self):
+        bs = self.block_size
+        base = (self.content[:bs] + os.urandom(bs) + self.content[2*bs:])
+        ok, metadata, data = self.get(base)
+        self.assertTrue(ok)
+        self.assertFalse(metadata['unchanged'])
+        self.assertEqual([1], metadata['blocks'])
+        self.assertEqual(self.content, data)
+
+    def test_base_shorter(self):
+        ok, metadata, data = self.get(self.content[:self.block_size + 5])
+        self.assertTrue(ok)
+        self.assertEqual([1, 2, 3], metadata['blocks'])
+        self.assertEqual(self.content, data)
+
+    def test_base_longer(self):
+        ok, metadata, data = self.get(self.content + os.urandom(10))
+        self.assertTrue(ok)
+        self.assertFalse(metadata['unchanged'])
+        self.assertEqual([3], metadata['blocks'])
+        self.assertEqual(self.content, data)
+
+    def age(self):
+        # utime() cannot move st_ctime back, so move the service's clock on.
+        clock = mock.Mock(time=lambda: time.time() + 10)
+        patcher = mock.patch.object(mitogen.service, 'time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_digests_cached(self):
+        self.age()
+        self.get(self.content)
+        cached = self.service._digests_by_path[self.path]
+        self.get(self.content)
+        self.assertIs(cached, self.service._digests_by_path[self.path])
+
+    def test_recent_not_cached(self):
+        self.get(self.content)
+        self.assertNotIn(self.path, self.service._digests_by_path)
+
+    def test_replaced_same_size_and_mtime(self):
+        self.age()
+        self.get(self.content)
+        st = os.stat(self.path)
+        content = os.urandom(len(self.content))
+        fd, tmp_path = tempfile.mkstemp(prefix='file_service_test',
+                                        dir=os.path.dirname(self.path))
+        os.write(fd, content)
+        os.close(fd)
+        os.utime(tmp_path, (st.st_atime, st.st_mtime))
+        os.rename(tmp_path, self.path)
+        ok, metadata, data = self.get(self.content)
+        self.assertFalse(metadata['unchanged'])
+        self.assertEqual(content, data)
+
+    def test_cache_bounded(self):
+        self.service.max_cached_digests = 1
+        self.service._digests_by_path['/other'] = None
+        self.age()
+        self.get(self.content)
+        self.assertEqual([self.path], list(self.service._digests_by_path))
+
+
+class ResumeFetchTest(ServeFileMixin, testlib.TestCase):
+    def get(self, partial):
+        return self.l1.call(get_resumed, self.router.myself(),
+                            self.path, partial)
+
+    def test_resumed(self):
+        ok, metadata, data = self.get(self.content[:1000])
+        self.assertTrue(ok)
+        self.assertEqual(1000, metadata['offset'])
+        self.assertEqual(self.content, data)
+
+    def test_mismatch(self):
+        ok, metadata, data = self.get(os.urandom(1000))
+        self.assertTrue(ok)
+        self.assertEqual(0, metadata['offset'])
+        self.assertEqual(self.content, data)
+
+    def test_bad_offset(self):
+        e = self.assertRaises(mitogen.core.CallError,
+            lambda: self.l1.call(fetch_with_offset, self.router.myself(),
+                                 self.path, '1000'))
+        self.assertIn("Argument 'offset' type incorrect", e.args[0])
+
+    def test_partial_longer(self):
+        ok, metadata, data = self.get(self.content + os.urandom(10))
+        self.assertTrue(ok)
+        self.assertEqual(0, metadata['offset'])
+        self.assertEqual(self.content, data)
+
+
+class ZeroCopyTest(ServeFileMixin, testlib.TestCase):
+    def get(self):
+        return self.l1.call(get_whole, self.router.myself(), self.path)
+
+    @unittest.skipIf(not mitogen.core.FileRegion.supported,
+                     'FileRegion unsupported on this platform')
+    def test_raw(self):
+        ok, metadata, data = self.get()
+        self.assertTrue(ok)
+        self.assertTrue(metadata['raw'])
+        self.assertEqual(self.content, data)
+
+    def setUp(self):
+        super(ZeroCopyTest, self).setUp()
+        self.service.zero_copy = True
+
+    @unittest.skipIf(not mitogen.core.FileRegion.supported,
+                     'FileRegion unsupported on this platform')
+    def test_truncated(self):
+        # Shrink the file once the service has stat()ed it.
+        real_generate_stat = self.service._generate_stat
+        def generate_stat(path):
+            metadata = real_generate_stat(path)
+            os.truncate(path, len(self.content) // 2)
+            return metadata
+        self.service._generate_stat = generate_stat
+        ok, metadata, data = self.get()
+        self.assertFalse(ok)
+        # The stream survived.
+        self.assertEqual(1, self.l1.call(int, 1))
+
+    def test_disabled(self):
+        self.service.zero_copy = False
+        ok, metadata, data = self.get()
+        self.assertTrue(ok)
+        self.assertFalse('raw' in metadata)
+        self.assertEqual(self.content, data)
+
+    def test_resumed_raw(self):
+        ok, metadata, data = self.l1.call(get_resumed, self.router.myself(),
+                                          self.path, self.content[:1000])
+        self.assertTrue(ok)
+        self.assertEqual(1000, metadata['offset'])
+        self.assertEqual(mitogen.core.FileRegion.supported,
+                         bool(metadata.get('raw')))
+        self.assertEqual(self.content, data)
+
+
+class WindowTest(testlib.TestCase):
+    klass = mitogen.service.FileService
+
+    def setUp(self):
+        self.service = self.klass.__new__(self.klass)
+        self.state = mitogen.service.FileStreamState(
+            self.klass.window_size_bytes
+        )
+        self.state.ssthresh = self.klass.max_window_size_bytes
+        self.now = 100.0
+
+    def update(self, size):
+        with mock.patch('mitogen.core.now', return_value=self.now):
+            self.service._update_window(self.state, size)
+
+    def simulate(self, bandwidth, rtt, acks=2000):
+        """
+        Send chunks over a link of `bandwidth` bytes per second and `rtt`
+        seconds propagation delay, whenever the window permits, until `acks`
+        acknowledgements arrive. Return the largest window seen.
+        """
+        size = self.klass.IO_SIZE
+        link_free = self.now
+        pending = []
+        largest = 0
+        for x in range(acks):
+            while self.state.unacked < self.state.window:
+                link_free = max(link_free, self.now) + size / float(bandwidth)
+                pending.append(link_free + rtt)
+                self.state.unacked += size
+                self.state.in_flight.append((self.now, size))
+            self.now = pending.pop(0)
+            self.state.unacked -= size
+            self.update(size)
+            largest = max(largest, self.state.window)
+        return largest
+
+    def test_fast_link_reaches_maximum(self):
+        # 100MiB/s with 100ms RTT: 10MiB in flight fills the link.
+        self.simulate(100 * 1048576, rtt=0.1)
+        self.assertEqual(self.klass.max_window_size_bytes, self.state.window)
+
+    def test_slow_start(self):
+        window = self.state.window
+        self.state.unacked = window
+        self.state.in_flight.append((self.now - 0.1, window))
+        self.state.unacked -= window
+        self.update(window)
+        self.assertEqual(2 * window, self.state.window)
+
+    def test_slow_link_backs_off(self):
+        # 1MiB/s with 100ms RTT: the window only fills the link's queue.
+        largest = self.simulate(1048576, rtt=0.1)
+        self.assertTrue(self.state.ssthresh < self.klass.max_window_size_bytes)
+        self.assertTrue(self.state.window <= 4 * 1048576)
+        self.assertTrue(largest < self.klass.max_window_size_bytes)
+        self.assertTrue(self.state.window >= self.klass.window_size_bytes)
+
+    def test_idle_does_not_grow(self):
+        # Acknowledgements while far below the window do not grow it.
+        window = self.state.window
+        for x in range(20):
+            self.now += 0.01
+            self.state.in_flight.append((self.now - 0.001, 1000))
+            self.update(1000)
+        self.assertEqual(window, self.state.window)
+
+    def test_idle_resets_rate_clock(self):
+        self.state.unacked = 0
+        self.state.in_flight.append((self.now, 1000))
+        self.update(1000)
+        self.assertEqual(None, self.state.last_ack)
+        self.assertFalse(self.state.in_flight)
+
+
+class MemoryCapTest(testlib.TestCase):
+    klass = mitogen.service.FileService
+
+    def setUp(self):
+        self.service = self.klass.__new__(self.klass)
+        self.service._buffered = 0
+        self.state = mitogen.service.FileStreamState(
+            self.klass.max_window_size_bytes
+        )
+
+    def test_below_cap(self):
+        self.state.unacked = self.klass.window_size_bytes
+        self.service._buffered = self.klass.max_buffered_bytes - 1
+        self.assertTrue(self.service._may_send(self.state))
+
+    def test_at_cap(self):
+        self.state.unacked = self.klass.window_size_bytes
+        self.service._buffered = self.klass.max_buffered_bytes
+        self.assertFalse(self.service._may_send(self.state))
+
+    def test_minimum_window_exempt(self):
+        self.state.unacked = self.klass.window_size_bytes - 1
+        self.service._buffered = self.klass.max_buffered_bytes
+        self.assertTrue(self.service._may_send(self.state))
+
+
+class StatsTest(ServeFileMixin, testlib.TestCase):
+    def test_completed(self):
+        ok, metadata, data = self.l1.call(get_with_base, self.router.myself(),
+                                          self.path, mitogen.core.b(''))
+        self.assertTrue(ok)
+        # The final acknowledgement may still be in flight.
+        deadline = mitogen.core.now() + 10.0
+        while self.service._buffered and mitogen.core.now() < deadline:
+            time.sleep(0.01)
+        stats = self.service.get_stats()
+        self.assertEqual(1, len(stats['streams']))
+        stream_stats = list(stats['streams'].values())[0]
+        self.assertEqual(0, stream_stats['unacked'])
+        self.assertEqual([], stream_stats['transfers'])
+        transfer, = stats['completed']
+        self.assertEqual(self.path, transfer['path'])
+        self.assertEqual(len(self.content), transfer['sent'])
+        self.assertEqual(0, self.service._buffered)
+
+
+class RelayTest(testlib.RouterMixin, testlib.TestCase):
+    klass = mitogen.service.FileService
+
+    def setUp(self):
+        super(RelayTest, self).setUp()
+        self.content = os.urandom(1048576 + 100)
+        self.digest = hashlib.sha1(self.content).hexdigest()
+        fd, self.path = tempfile.mkstemp(prefix='file_service_test')
+        os.write(fd, self.content)
+        os.close(fd)
+        self.service = self.klass(self.router)
+        self.service.register(self.path)
+        self.pool = mitogen.service.Pool(
+            router=self.router,
+            services=[self.service],
+            size=2,
+        )
+        self.relay = self.router.local()
+
+    def tearDown(self):
+        self.pool.stop()
+        os.unlink(self.path)
+        super(RelayTest, self).tearDown()
+
+    def get(self, context, relays):
+        return context.call(get_relayed, self.router.myself(), self.path,
+                            relays)
+
+    def test_relayed(self):
+        child = self.router.local(via=self.relay)
+        ok, size, digest = self.get(child, [self.relay.context_id])
+        self.assertTrue(ok)
+        self.assertEqual(len(self.content), size)
+        self.assertEqual(self.digest, digest)
+
+    def test_link_carries_file_once(self):
+        children = [self.router.local(via=self.relay) for _ in range(3)]
+        self.get(children[0], [self.relay.context_id])
+        routed_bytes = self.router.routed_bytes
+        for child in children[1:]:
+            ok, size, digest = self.get(child, [self.relay.context_id])
+            self.assertTrue(ok)
+            self.assertEqual(self.digest, digest)
+        # Later requests only revalidate the relay's copy using a delta.
+        self.assertLess(self.router.routed_bytes - routed_bytes,
+                        len(self.content) // 2)
+
+    def test_relayed_twice(self):
+        relay2 = self.router.local(via=self.relay)
+        child = self.router.local(via=relay2)
+        relays = [relay2.context_id, self.relay.context_id]
+        ok, size, digest = self.get(child, relays)
+        self.assertTrue(ok)
+        self.assertEqual(self.digest, digest)
+
+    def test_relay_not_on_route(self):
+        child = self.router.local()
+        e = self.assertRaises(mitogen.core.CallError,
+            lambda: self.get(child, [self.relay.context_id]))
+        self.assertIn(self.klass.relay_mismatch_msg, e.args[0])
+
+    def test_unregistered(self):
+        child = self.router.local(via=self.relay)
+        e = self.assertRaises(mitogen.core.CallError,
+            lambda: child.call(get_relayed, self.router.myself(),
+                               '/etc/shadow', [self.relay.context_id]))
+        self.assertIn(self.klass.unregistered_msg % ('/etc/shadow',),
+                      e.args[0])
+
+
+class RelayEvictionTest(testlib.TestCase):
+    klass = mitogen.service.FileService
+
+    def setUp(self):
+        super(RelayEvictionTest, self).setUp()
+        self.service = self.klass(mock.Mock())
+        self.service._relay_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.service._relay_dir)
+        super(RelayEvictionTest, self).tearDown()
+
+    def add(self, name, size, last_used, done=True):
+        fd, path = tempfile.mkstemp(dir=self.service._relay_dir)
+        os.close(fd)
+        relayed = mitogen.service.RelayedFile(path)
+        relayed.available = size
+        relayed.last_used = last_used
+        relayed.done = done
+        self.service._relayed_by_path[name] = relayed
+        return relayed
+
+    def evict(self):
+        self.service._evict_relayed()
+        return sorted(self.service._relayed_by_path)
+
+    def test_count(self):
+        self.service.max_relayed_files = 2
+        old = self.add('a', 1, 1.0)
+        self.add('b', 1, 3.0)
+        self.add('c', 1, 2.0)
+        self.assertEqual(['b', 'c'], self.evict())
+        self.assertFalse(os.path.exists(old.path))
+
+    def test_size(self):
+        self.service.max_relayed_bytes = 100
+        self.add('a', 60, 2.0)
+        self.add('b', 60, 1.0)
+        self.assertEqual(['a'], self.evict())
+
+    def test_downloading_kept(self):
+        self.service.max_relayed_files = 1
+        self.add('a', 1, 1.0, done=False)
+        self.add('b', 1, 2.0)
+        self.assertEqual(['a'], self.evict())
+
+    def test_within_limits(self):
+        self.add('a', 1, 1.0)
+        self.add('b', 1, 2.0)
+        self.assertEqual(['a', 'b'], self.evict())
+
+
 class FetchTest(testlib.RouterMixin, testlib.TestCase):
     klass = mitogen.service.FileService
 
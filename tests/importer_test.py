@@ -1,11 +1,17 @@
+import os
+import random
+import shutil
 import sys
+import tempfile
 import threading
 import types
+import unittest
 import zlib
 
 import mock
 
 import mitogen.core
+import mitogen.module_store
 import mitogen.utils
 from mitogen.core import b
 
@@ -13,6 +19,30 @@ import testlib
 import simple_pkg.imports_replaces_self
 
 
+def import_lazy_test_module():
+    import lazy_test_module
+    before = type(lazy_test_module).__name__
+    assert lazy_test_module.x == 1
+    return before, type(lazy_test_module).__name__
+
+
+def has_find_spec():
+    return [hasattr(finder, 'find_spec') for finder in sys.meta_path
+            if isinstance(finder, mitogen.core.Importer)]
+
+
+def import_prefetch_root():
+    import prefetch_root
+    return prefetch_root.result
+
+
+def get_bytecode_state():
+    import bytecode_test_module
+    importer = bytecode_test_module.__loader__
+    tup = importer._cache['bytecode_test_module']
+    return importer.bytecode_magic, bool(tup[5]), bytecode_test_module.x
+
+
 class ImporterMixin(testlib.RouterMixin):
     modname = None
 
@@ -207,6 +237,237 @@ class ImporterBlacklistTest(testlib.TestCase):
         self.assertTrue(mitogen.core.is_blacklisted_import(importer, '__builtin__'))
         self.assertTrue(mitogen.core.is_blacklisted_import(importer, 'builtins'))
 
+    def test_is_blacklisted_import_list_changed(self):
+        importer = mitogen.core.Importer(
+            router=mock.Mock(), context=None, core_src='',
+            whitelist=('mypkg', 'otherpkg'),
+        )
+        self.assertFalse(mitogen.core.is_blacklisted_import(importer, 'otherpkg'))
+        importer.whitelist = ['mypkg']
+        self.assertTrue(mitogen.core.is_blacklisted_import(importer, 'otherpkg'))
+        importer.blacklist = importer.blacklist + ['mypkg.sub']
+        self.assertTrue(mitogen.core.is_blacklisted_import(importer, 'mypkg.sub'))
+        self.assertFalse(mitogen.core.is_blacklisted_import(importer, 'mypkg'))
+
+
+class CompilePrefixesTest(testlib.TestCase):
+    func = staticmethod(mitogen.core.compile_prefixes)
+
+    def test_empty(self):
+        self.assertFalse(self.func([])('mypkg'))
+        self.assertFalse(self.func([])(''))
+
+    def test_empty_prefix(self):
+        self.assertTrue(self.func(['', 'mypkg'])('otherpkg'))
+
+    def test_string_prefix(self):
+        # Like str.startswith(), not limited to whole package names.
+        match = self.func(['ansible', 'ansible_mitogen', 'thread'])
+        self.assertTrue(match('ansible_mitogen.target'))
+        self.assertTrue(match('threading'))
+        self.assertFalse(match('ansibl'))
+        self.assertFalse(match('mitogen.ansible'))
+
+    def test_special_characters(self):
+        match = self.func(['a.b', 'c*'])
+        self.assertTrue(match('a.b.c'))
+        self.assertFalse(match('axb'))
+        self.assertTrue(match('c*d'))
+        self.assertFalse(match('cd'))
+
+    def test_matches_startswith(self):
+        rand = random.Random(1)
+        for _ in range(500):
+            prefixes = [''.join(rand.choice('ab._') for _ in range(rand.randint(0, 4)))
+                        for _ in range(rand.randint(0, 6))]
+            s = ''.join(rand.choice('ab._') for _ in range(rand.randint(0, 6)))
+            self.assertEqual(any(s.startswith(p) for p in prefixes),
+                             bool(self.func(prefixes)(s)))
+
+
+class ModuleStoreTest(testlib.TestCase):
+    klass = mitogen.module_store.ModuleStore
+    store_id = u'0123456789abcdef'
+    tup = (u'plain_old_module', None, u'plain_old_module.py',
+           zlib.compress(b('x = 1\n')), ())
+
+    def setUp(self):
+        super(ModuleStoreTest, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.patcher = mock.patch.object(self.klass, '_get_base_dir',
+                                         return_value=self.tmpdir)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmpdir)
+        super(ModuleStoreTest, self).tearDown()
+
+    def test_round_trip(self):
+        store = self.klass.open(self.store_id)
+        self.assertEqual(None, store.get(self.tup[0]))
+        store.put(self.tup)
+        self.assertEqual(self.tup, self.klass.open(self.store_id).get(self.tup[0]))
+        self.assertEqual([self.tup[0]], os.listdir(store.path))
+
+    def test_mismatched_name(self):
+        store = self.klass.open(self.store_id)
+        store.put(self.tup)
+        os.rename(os.path.join(store.path, self.tup[0]),
+                  os.path.join(store.path, 'other'))
+        self.assertEqual(None, store.get(u'other'))
+
+    def test_invalid_id(self):
+        self.assertEqual(None, self.klass.open(u'../etc'))
+        self.assertEqual(None, self.klass.open(None))
+
+    def test_unsafe_permissions(self):
+        root = os.path.join(self.tmpdir, 'mitogen-modules-%d' % (os.getuid(),))
+        os.mkdir(root)
+        os.chmod(root, int('0777', 8))
+        self.assertEqual(None, self.klass.open(self.store_id))
+
+    def test_prune(self):
+        old = self.klass.open(u'aa')
+        old.put(self.tup)
+        os.utime(old.path, (0, 0))
+        fresh = self.klass.open(u'bb')
+        self.assertFalse(os.path.exists(old.path))
+        self.assertTrue(os.path.exists(fresh.path))
+
+
+class ModuleStoreImporterTest(ImporterMixin, testlib.TestCase):
+    modname = 'plain_old_module'
+
+    def test_hit_skips_parent(self):
+        store = mock.Mock()
+        store.get.return_value = ModuleStoreTest.tup
+        self.importer.store = store
+        mod = self.importer.load_module(self.modname)
+        self.assertEqual(1, mod.x)
+        self.assertFalse(self.context.send.called)
+
+    def test_miss_fills_store(self):
+        store = mock.Mock()
+        store.get.return_value = None
+        self.importer.store = store
+        self.set_get_module_response(ModuleStoreTest.tup)
+        self.importer.load_module(self.modname)
+        store.put.assert_called_once_with(ModuleStoreTest.tup)
+
+
+class LazyImportTest(testlib.RouterMixin, testlib.TestCase):
+    def setUp(self):
+        super(LazyImportTest, self).setUp()
+        # Served only by the master, never found on the child's sys.path.
+        self.router.responder.add_source_override(
+            'lazy_test_module', 'lazy_test_module.py', b('x = 1\n'), False
+        )
+
+    def test_eager_by_default(self):
+        c = self.router.local()
+        self.assertEqual(('module', 'module'),
+                         c.call(import_lazy_test_module))
+        self.assertEqual([False], c.call(has_find_spec))
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'requires LazyLoader')
+    def test_executed_on_first_access(self):
+        c = self.router.local(lazy_imports=True)
+        self.assertEqual(('_LazyModule', 'module'),
+                         c.call(import_lazy_test_module))
+        self.assertEqual([True], c.call(has_find_spec))
+
+    def test_self_replacing_module_not_deferred(self):
+        c = self.router.local(lazy_imports=True)
+        self.assertEqual(0,
+            c.call(simple_pkg.imports_replaces_self.subtract_one, 1))
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'requires LazyLoader')
+    def test_router_default(self):
+        self.router.lazy_imports = True
+        c = self.router.local()
+        self.assertEqual(('_LazyModule', 'module'),
+                         c.call(import_lazy_test_module))
+
+
+class PrefetchTest(ImporterMixin, testlib.TestCase):
+    modname = 'prefetch_test_module'
+
+    def get_requested(self):
+        return [call[0][0].data for call in self.context.send.call_args_list]
+
+    def test_prefetch(self):
+        self.importer.prefetch(['prefetch_a', 'prefetch_b', 'os', 'sys'])
+        self.assertEqual([b('prefetch_a'), b('prefetch_b')],
+                         self.get_requested())
+
+    def test_prefetch_in_flight(self):
+        self.importer.prefetch(['prefetch_a'])
+        self.importer.prefetch(['prefetch_a'])
+        self.assertEqual([b('prefetch_a')], self.get_requested())
+
+    def test_listed_imports(self):
+        requested = []
+
+        def on_context_send(msg):
+            requested.append(msg.data)
+            if msg.data == b(self.modname):
+                self.importer._on_load_module(mitogen.core.Message.pickled(
+                    (self.modname, None, self.modname + '.py',
+                     zlib.compress(b('x = 1\n')), [], None, False,
+                     ['os', 'prefetch_a', 'prefetch_a.sub'])
+                ))
+        self.context.send = on_context_send
+        self.importer.load_module(self.modname)
+        self.assertEqual([b(self.modname), b('prefetch_a'),
+                          b('prefetch_a.sub')],
+                         requested)
+
+    def test_child(self):
+        responder = self.router.responder
+        responder.enable_prefetch()
+        for name, source in [
+                ('prefetch_root', 'import prefetch_a, prefetch_b\n'
+                                  'result = prefetch_a.x + prefetch_b.x\n'),
+                ('prefetch_a', 'x = 1\n'),
+                ('prefetch_b', 'x = 2\n')]:
+            responder.add_source_override(name, name + '.py', b(source), False)
+        c = self.router.local()
+        self.assertEqual(3, c.call(import_prefetch_root))
+
+
+class BytecodeTest(testlib.RouterMixin, testlib.TestCase):
+    def setUp(self):
+        super(BytecodeTest, self).setUp()
+        self.router.responder.add_source_override(
+            'bytecode_test_module', 'bytecode_test_module.py', b('x = 1\n'),
+            False
+        )
+
+    def test_disabled(self):
+        c = self.router.local()
+        self.assertEqual((None, False, 1), c.call(get_bytecode_state))
+
+    def test_enabled(self):
+        self.router.responder.enable_bytecode()
+        c = self.router.local()
+        self.assertEqual((mitogen.core.get_bytecode_magic(), True, 1),
+                         c.call(get_bytecode_state))
+
+    def test_other_interpreter(self):
+        self.router.responder.enable_bytecode()
+        self.router.responder.bytecode_magic = u'deadbeef-O0'
+        c = self.router.local()
+        self.assertEqual((None, False, 1), c.call(get_bytecode_state))
+
+    def test_invalid_code(self):
+        importer = mitogen.core.Importer(self.router, mock.Mock(), '')
+        importer.bytecode_magic = mitogen.core.get_bytecode_magic()
+        importer._cache['mod'] = ('mod', None, 'mod.py',
+                                  zlib.compress(b('x = 1\n')), [],
+                                  (importer.bytecode_magic, b('junk')))
+        self.assertEqual(None, importer._get_code('mod'))
+
 
 class Python24LineCacheTest(testlib.TestCase):
     # TODO: mitogen.core.Importer._update_linecache()
@@ -23,3 +23,19 @@ class ScanCodeImportsTest(testlib.TestCase):
         with open(source_path) as f:
             co = compile(f.read(), source_path, 'exec')
         self.assertEqual(list(self.func(co)), self.SIMPLE_EXPECT)
+
+    def test_relative(self):
+        co = compile('from . import a\nfrom ..b import c, d\n', 'x', 'exec')
+        self.assertEqual(list(self.func(co)), [
+            (1, '', ('a',)),
+            (2, 'b', ('c', 'd')),
+        ])
+
+    def test_extended_arg(self):
+        # Over 256 constants and names need EXTENDED_ARG prefixes.
+        source = ''.join('v%d = %d\n' % (i, i) for i in range(300))
+        co = compile(source + 'from a import b\n', 'x', 'exec')
+        self.assertEqual([(self.level, 'a', ('b',))], list(self.func(co)))
+
+    def test_empty(self):
+        self.assertEqual([], list(self.func(compile('', 'x', 'exec'))))
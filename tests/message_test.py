@@ -1,5 +1,6 @@
 import sys
 import struct
+import tempfile
 import unittest
 
 import mock
@@ -123,6 +124,41 @@ class PackTest(testlib.TestCase):
         self.assertEqual(b('hello'), data)
 
 
+    def test_region_length(self):
+        fp = tempfile.TemporaryFile()
+        try:
+            fp.write(b('hello world'))
+            region = mitogen.core.FileRegion(fp, 6, 5)
+            s = self.klass(dst_id=11, handle=77, data=b('hi'),
+                           region=region).pack()
+            data_length, = struct.unpack('>L', s[22:26])
+            self.assertEqual(7, data_length)
+            self.assertEqual(b('hi'), s[26:])
+            region.close()
+        finally:
+            fp.close()
+
+
+class ReadRegionTest(testlib.TestCase):
+    klass = mitogen.core.Message
+
+    @unittest.skipIf(not mitogen.core.FileRegion.supported,
+                     'FileRegion unsupported on this platform')
+    def test_read_region(self):
+        fp = tempfile.TemporaryFile()
+        try:
+            fp.write(b('hello world'))
+            fp.flush()
+            region = mitogen.core.FileRegion(fp, 6, 5)
+            msg = self.klass(data=b('hi '), region=region)
+            msg.read_region()
+            self.assertEqual(b('hi world'), msg.data)
+            self.assertEqual(None, msg.region)
+            self.assertEqual(None, region.fd)
+        finally:
+            fp.close()
+
+
 class IsDeadTest(testlib.TestCase):
     klass = mitogen.core.Message
 
@@ -1,11 +1,17 @@
 import codecs
 import glob
+import os
 import pprint
+import shutil
 import sys
+import tempfile
+import unittest
 
 import mitogen.minify
 import testlib
 
+from mitogen.core import b
+
 
 def read_sample(fname):
     sample_path = testlib.data_path('minimize_samples/' + fname)
@@ -110,3 +116,95 @@ class MitogenCoreTest(testlib.TestCase):
             self._test_syntax_valid(minified, name)
             self._test_line_counts_match(original, minified)
             self._test_non_blank_lines_match(name, original, minified)
+
+
+class GenerateTokensTest(testlib.TestCase):
+    # Verify the fast tokenizer yields output identical to tokenize.
+    func = staticmethod(mitogen.minify.generate_tokens)
+
+    def minimize(self, tokens):
+        tokens = mitogen.minify.strip_comments(tokens)
+        tokens = mitogen.minify.strip_docstrings(tokens)
+        tokens = mitogen.minify.reindent(tokens)
+        return mitogen.minify.tokenize.untokenize(tokens)
+
+    def slow(self, source):
+        readline = mitogen.minify.StringIO(source).readline
+        return self.minimize(
+            mitogen.minify.tokenize.generate_tokens(readline)
+        )
+
+    def assertIdentical(self, source):
+        try:
+            tokens = self.func(source)
+        except mitogen.minify.UnsupportedSource:
+            return
+        self.assertEqual(self.slow(source), self.minimize(tokens))
+
+    def test_samples(self):
+        for path in glob.glob(testlib.data_path('minimize_samples/*.py')):
+            self.assertIdentical(read_sample(os.path.basename(path)))
+
+    def test_mitogen(self):
+        for name in glob.glob('mitogen/*.py'):
+            fp = codecs.open(name, encoding='utf-8')
+            try:
+                source = fp.read()
+            finally:
+                fp.close()
+            self.assertIdentical(source)
+
+    def test_fast_path_taken(self):
+        if sys.version_info >= (3, 12):
+            raise unittest.SkipTest('tokenize is used on Python 3.12+')
+        self.func(read_sample('obstacle_course.py'))
+
+    def test_unsupported(self):
+        for source in ['x = 1', 'if 1:\n\tpass\n', 'x = "\n',
+                       'x = (\n', 'x = 1\r\n', ')\n']:
+            self.assertRaises(mitogen.minify.UnsupportedSource,
+                              lambda: self.func(source))
+
+    def test_fallback(self):
+        source = u'\n\nif 1:\n\tx = 1  # c\n'
+        self.assertEqual(self.slow(source),
+                         mitogen.minify.minimize_source(source))
+
+
+class CacheTest(testlib.TestCase):
+    func = staticmethod(mitogen.minify.minimize_source)
+
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        mitogen.minify.cache_dir = self.dir
+
+    def tearDown(self):
+        mitogen.minify.cache_dir = None
+        mitogen.minify._cache.clear()
+        shutil.rmtree(self.dir)
+        super(CacheTest, self).tearDown()
+
+    def test_memory(self):
+        source = u'x = 1  # %s\n' % (self.dir,)
+        self.assertTrue(self.func(source) is self.func(source))
+
+    def test_disk(self):
+        source = u'\n\nx = 2  # comment\n'
+        expect = self.func(source)
+        paths = glob.glob(os.path.join(self.dir, 'minify-*'))
+        self.assertEqual(1, len(paths))
+        # A process with an empty memory cache reads the stored result.
+        mitogen.minify._cache.clear()
+        fp = open(paths[0], 'wb')
+        fp.write(b('y = 2\n'))
+        fp.close()
+        self.assertEqual(u'y = 2\n', self.func(source))
+        self.assertEqual(u'\n\nx = 2\n', expect)
+
+    def test_unwritable(self):
+        os.rmdir(self.dir)
+        try:
+            self.assertEqual(u'\n\nx = 3\n', self.func(u'\n\nx = 3  # c\n'))
+        finally:
+            os.mkdir(self.dir)
@@ -50,6 +50,29 @@ class IsStdlibNameTest(testlib.TestCase):
         self.assertFalse(self.func('mitogen.fakessh'))
 
 
+class IsStdlibPathTest(testlib.TestCase):
+    func = staticmethod(mitogen.master.is_stdlib_path)
+
+    def test_stdlib(self):
+        self.assertTrue(self.func(os.path.abspath(inspect.getsourcefile(inspect))))
+
+    def test_not_stdlib(self):
+        self.assertFalse(self.func(os.path.abspath(mitogen.master.__file__)))
+
+    def test_sibling_prefix(self):
+        # A directory merely named like a stdlib directory is not inside it.
+        for libpath in mitogen.master._STDLIB_PATHS:
+            if libpath:
+                self.assertTrue(self.func(os.path.join(libpath, 'x.py')))
+                self.assertFalse(self.func(libpath + '-extra/x.py'))
+
+    def test_site_packages(self):
+        for libpath in mitogen.master._STDLIB_PATHS:
+            if libpath:
+                path = os.path.join(libpath, 'site-packages', 'x.py')
+                self.assertFalse(self.func(path))
+
+
 class GetMainModuleDefectivePython3x(testlib.TestCase):
     klass = mitogen.master.DefectivePython3xMainMethod
 
@@ -271,6 +294,25 @@ class FakeSshTest(testlib.TestCase):
         ])
 
 
+class SourceOverrideTest(testlib.TestCase):
+    klass = mitogen.master.ModuleFinder
+
+    def test_override_scanned(self):
+        # The loader's code object must not be used for overridden source.
+        import mitogen.fakessh
+        finder = self.klass()
+        self.assertTrue('mitogen.parent' in
+                        finder.find_related_imports('mitogen.fakessh'))
+        finder.add_source_override(
+            fullname='mitogen.fakessh',
+            path=mitogen.fakessh.__file__,
+            source=b('import mitogen.core\n'),
+            is_pkg=False,
+        )
+        self.assertEqual(['mitogen', 'mitogen.core'],
+                         finder.find_related_imports('mitogen.fakessh'))
+
+
 class FindRelatedTest(testlib.TestCase):
     klass = mitogen.master.ModuleFinder
 
@@ -1,10 +1,17 @@
+import marshal
 import mock
+import os
+import shutil
+import struct
 import textwrap
 import subprocess
 import sys
+import tempfile
 import unittest
+import zlib
 
 import mitogen.master
+import mitogen.module_store
 import testlib
 
 import plain_old_module
@@ -99,24 +106,47 @@ class GoodModulesTest(testlib.RouterMixin, testlib.TestCase):
         self.assertEqual(b_stdout.decode(), "['__main__', 50]\n")
 
 
-class BrokenModulesTest(testlib.TestCase):
-    def test_obviously_missing(self):
-        # Ensure we don't crash in the case of a module legitimately being
-        # unavailable. Should never happen in the real world.
-
-        stream = mock.Mock()
-        stream.protocol.sent_modules = set()
-        router = mock.Mock()
-        router.stream_by_id = lambda n: stream
-
+class ResponderMixin(object):
+    """
+    Drive a :class:`mitogen.master.ModuleResponder` attached to a mock router,
+    running calls its workers defer to the broker on the test thread.
+    """
+    def setUp(self):
+        super(ResponderMixin, self).setUp()
+        self.stream = mock.Mock()
+        self.stream.protocol.sent_modules = set()
+        self.router = mock.Mock()
+        self.router.stream_by_id = lambda n: self.stream
+        self.deferred = mitogen.core.Latch()
+        self.router.broker.defer = lambda func, *args: \
+            self.deferred.put((func, args))
+        self.responder = mitogen.master.ModuleResponder(self.router)
+
+    def tearDown(self):
+        mitogen.core.fire(self.router.broker, 'exit')
+        super(ResponderMixin, self).tearDown()
+
+    def request(self, fullname):
         msg = mitogen.core.Message(
-            data=mitogen.core.b('non_existent_module'),
+            data=mitogen.core.b(fullname),
             reply_to=50,
         )
-        msg.router = router
+        msg.router = self.router
+        self.responder._on_get_module(msg)
+
+    def run_deferred(self):
+        func, args = self.deferred.get(timeout=10.0)
+        func(*args)
 
-        responder = mitogen.master.ModuleResponder(router)
-        responder._on_get_module(msg)
+
+class BrokenModulesTest(ResponderMixin, testlib.TestCase):
+    def test_obviously_missing(self):
+        # Ensure we don't crash in the case of a module legitimately being
+        # unavailable. Should never happen in the real world.
+        router = self.router
+        responder = self.responder
+        self.request('non_existent_module')
+        self.run_deferred()
         self.assertEqual(1, len(router._async_route.mock_calls))
 
         self.assertEqual(1, responder.get_module_count)
@@ -142,19 +172,10 @@ class BrokenModulesTest(testlib.TestCase):
         # cause an attempt to request ansible.compat.six._six from the master.
         import six_brokenpkg
 
-        stream = mock.Mock()
-        stream.protocol.sent_modules = set()
-        router = mock.Mock()
-        router.stream_by_id = lambda n: stream
-
-        msg = mitogen.core.Message(
-            data=mitogen.core.b('six_brokenpkg._six'),
-            reply_to=50,
-        )
-        msg.router = router
-
-        responder = mitogen.master.ModuleResponder(router)
-        responder._on_get_module(msg)
+        router = self.router
+        responder = self.responder
+        self.request('six_brokenpkg._six')
+        self.run_deferred()
         self.assertEqual(1, len(router._async_route.mock_calls))
 
         self.assertEqual(1, responder.get_module_count)
@@ -169,6 +190,344 @@ class BrokenModulesTest(testlib.TestCase):
         self.assertIsInstance(tup, tuple)
 
 
+class WorkerTest(ResponderMixin, testlib.TestCase):
+    def test_reply_deferred_to_broker(self):
+        self.request('plain_old_module')
+        # Nothing was sent before the worker posted its result.
+        self.assertEqual(0, len(self.router._async_route.mock_calls))
+        self.run_deferred()
+        self.assertEqual(1, len(self.router._async_route.mock_calls))
+
+    def test_cached_reply_immediate(self):
+        self.request('plain_old_module')
+        self.run_deferred()
+        self.stream.protocol.sent_modules.clear()
+        self.request('plain_old_module')
+        self.assertEqual(2, len(self.router._async_route.mock_calls))
+        self.assertEqual(0, self.deferred.size())
+
+    def test_inflight_requests_share_build(self):
+        builds = []
+        release = mitogen.core.Latch()
+        build_tuples = self.responder._build_tuples
+        def blocking_build_tuples(fullname):
+            builds.append(fullname)
+            # Don't finish before both requests were received.
+            release.get(timeout=10.0)
+            return build_tuples(fullname)
+        self.responder._build_tuples = blocking_build_tuples
+
+        stream2 = mock.Mock()
+        stream2.protocol.sent_modules = set()
+        streams = [self.stream, stream2]
+        self.router.stream_by_id = lambda n: streams[n]
+        for src_id in (0, 1):
+            msg = mitogen.core.Message(
+                data=mitogen.core.b('plain_old_module'),
+                src_id=src_id,
+            )
+            msg.router = self.router
+            self.responder._on_get_module(msg)
+        release.put(None)
+        self.run_deferred()
+        self.assertEqual(['plain_old_module'], builds)
+        self.assertEqual(2, len(self.router._async_route.mock_calls))
+
+
+class PrefixTest(testlib.RouterMixin, testlib.TestCase):
+    def test_blacklist_prefix(self):
+        responder = mitogen.master.ModuleResponder(mock.Mock())
+        self.assertFalse(mitogen.core.is_blacklisted_import(responder, 'a.b'))
+        responder.blacklist_prefix('a')
+        self.assertTrue(mitogen.core.is_blacklisted_import(responder, 'a.b'))
+
+    def test_whitelist_prefix(self):
+        responder = mitogen.master.ModuleResponder(mock.Mock())
+        responder.whitelist_prefix('a')
+        self.assertFalse(mitogen.core.is_blacklisted_import(responder, 'a.b'))
+        self.assertFalse(mitogen.core.is_blacklisted_import(responder,
+                                                            'mitogen.core'))
+        self.assertTrue(mitogen.core.is_blacklisted_import(responder, 'b'))
+
+
+class EagerTest(testlib.RouterMixin, testlib.TestCase):
+    def test_plain(self):
+        tup = self.router.responder._build_tuple('plain_old_module')
+        self.assertFalse(tup[6])
+
+    def test_replaces_self(self):
+        tup = self.router.responder._build_tuple(
+            'simple_pkg.imports_replaces_self'
+        )
+        self.assertTrue(tup[6])
+
+
+class PrefetchTest(testlib.RouterMixin, testlib.TestCase):
+    def build(self, fullname, source, is_pkg=False):
+        responder = self.router.responder
+        responder.enable_prefetch()
+        responder.add_source_override(fullname, fullname + '.py',
+                                      mitogen.core.b(source), is_pkg)
+        return responder._build_tuple(fullname)
+
+    def test_disabled(self):
+        tup = self.router.responder._build_tuple('plain_old_module')
+        self.assertEqual(7, len(tup))
+
+    def test_nested(self):
+        tup = self.build('prefetch_mod', textwrap.dedent("""
+            import os
+            import prefetch_a.sub
+            def func():
+                from prefetch_b import name
+                class Class:
+                    import prefetch_c
+        """))
+        self.assertEqual([u'prefetch_a', u'prefetch_a.sub', u'prefetch_b',
+                          u'prefetch_c'], tup[7])
+
+    def test_relative(self):
+        tup = self.build('simple_pkg.prefetch_mod',
+                         'from . import a, nonexistent\n'
+                         'from .b import c\n'
+                         'from ... import too_far\n')
+        self.assertEqual([u'simple_pkg', u'simple_pkg.a', u'simple_pkg.b'],
+                         tup[7])
+
+    def test_package(self):
+        tup = self.build('prefetch_pkg', 'from .sub import x\n', True)
+        self.assertEqual([u'prefetch_pkg.sub'], tup[7])
+
+    def test_extended_arg(self):
+        # More than 256 constants and names need EXTENDED_ARG prefixes.
+        source = ''.join('v%d = %d\n' % (i, i) for i in range(300))
+        tup = self.build('prefetch_mod', source + 'import prefetch_a\n')
+        self.assertEqual([u'prefetch_a'], tup[7])
+
+    def test_blacklisted(self):
+        self.router.responder.blacklist_prefix('prefetch_a')
+        tup = self.build('prefetch_mod', 'import prefetch_a, prefetch_b\n')
+        self.assertEqual([u'prefetch_b'], tup[7])
+
+
+class BytecodeTest(ResponderMixin, testlib.TestCase):
+    def setUp(self):
+        super(BytecodeTest, self).setUp()
+        self.responder.enable_bytecode()
+        self.stream.protocol.remote_id = 0
+        self.stream.protocol.bytecode_magic = None
+
+    def request(self, fullname, magic=None):
+        data = fullname
+        if magic:
+            data += '\x00' + magic
+        super(BytecodeTest, self).request(data)
+        self.run_deferred()
+        msg = self.router._async_route.mock_calls[-1][1][0]
+        return msg.unpickle()
+
+    def test_matching_magic(self):
+        magic = mitogen.core.get_bytecode_magic()
+        tup = self.request('plain_old_module', magic)
+        self.assertEqual(magic, self.stream.protocol.bytecode_magic)
+        self.assertEqual(7, len(tup))
+        self.assertEqual(magic, tup[5][0])
+
+        code = marshal.loads(zlib.decompress(tup[5][1]))
+        self.assertEqual(u'master:' + tup[2], code.co_filename)
+        namespace = {}
+        exec(code, namespace)
+        self.assertEqual(256, namespace['pow'](2, 8))
+
+    def test_other_magic(self):
+        tup = self.request('plain_old_module', 'deadbeef-O0')
+        self.assertEqual(7, len(tup))
+        self.assertEqual(None, tup[5])
+
+    def test_no_magic(self):
+        tup = self.request('plain_old_module')
+        self.assertEqual(7, len(tup))
+        self.assertEqual(None, tup[5])
+
+    def test_save_bundle(self):
+        self.request('plain_old_module')
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self.responder.save_bundle(path)
+            bundle = mitogen.master.ModuleBundle(path)
+            self.assertIn(u'plain_old_module', bundle.index)
+        finally:
+            os.unlink(path)
+
+
+class BundleTest(ResponderMixin, testlib.TestCase):
+    def setUp(self):
+        super(BundleTest, self).setUp()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+        if os.path.exists(self.path + '.lock'):
+            os.unlink(self.path + '.lock')
+        super(BundleTest, self).tearDown()
+
+    def new_responder(self):
+        responder = mitogen.master.ModuleResponder(self.router)
+        responder.load_bundle(self.path)
+        return responder
+
+    def test_round_trip(self):
+        self.responder.save_bundle(self.path, ['simple_pkg.a'])
+        expect = self.responder._build_tuples('simple_pkg.a')
+        responder = self.new_responder()
+        self.assertEqual(expect, responder._build_tuples('simple_pkg.a'))
+        self.assertEqual(1 + len(expect[1]), responder.bundle_hit_count)
+        self.assertEqual(0, responder.bundle_miss_count)
+
+    def test_save_served(self):
+        self.request('plain_old_module')
+        self.run_deferred()
+        self.responder.save_bundle(self.path)
+        responder = self.new_responder()
+        responder._build_tuple('plain_old_module')
+        self.assertEqual(1, responder.bundle_hit_count)
+
+    def test_stale(self):
+        self.responder.save_bundle(self.path, ['plain_old_module'])
+        responder = self.new_responder()
+        responder.add_source_override(
+            fullname='plain_old_module',
+            path=plain_old_module.__file__.replace('.pyc', '.py'),
+            source=mitogen.core.b('x = 1\n'),
+            is_pkg=False,
+        )
+        tup = responder._build_tuple('plain_old_module')
+        self.assertEqual(0, responder.bundle_hit_count)
+        self.assertEqual(1, responder.bundle_miss_count)
+        self.assertEqual(mitogen.core.b('x = 1\n'),
+                         mitogen.core.zlib.decompress(tup[3]))
+
+    def test_merge(self):
+        self.responder.save_bundle(self.path, ['plain_old_module'])
+        responder = self.new_responder()
+        responder.save_bundle(self.path, ['simple_pkg.a'])
+        bundle = mitogen.master.ModuleBundle(self.path)
+        try:
+            self.assertEqual(
+                ['plain_old_module', 'simple_pkg', 'simple_pkg.a',
+                 'simple_pkg.b'],
+                sorted(bundle.index),
+            )
+        finally:
+            bundle.close()
+        responder._bundle.close()
+
+    def test_not_bundle(self):
+        fp = open(self.path, 'wb')
+        fp.write(mitogen.core.b('x') * 100)
+        fp.close()
+        self.assertRaises(mitogen.core.Error, self.new_responder)
+
+    def test_merge_unloaded(self):
+        # Another process saved since this responder started.
+        responder = mitogen.master.ModuleResponder(self.router)
+        responder.save_bundle(self.path, ['plain_old_module'])
+        self.responder.save_bundle(self.path, ['simple_pkg.a'])
+        bundle = mitogen.master.ModuleBundle(self.path)
+        try:
+            self.assertTrue('plain_old_module' in bundle.index)
+            self.assertTrue('simple_pkg.a' in bundle.index)
+        finally:
+            bundle.close()
+
+    def test_pickled_index(self):
+        index = mitogen.core.pickle__dumps({}, protocol=2)
+        fp = open(self.path, 'wb')
+        fp.write(mitogen.master.ModuleBundle.magic)
+        fp.write(struct.pack('>L', len(index)))
+        fp.write(index)
+        fp.close()
+        self.assertRaises(mitogen.core.Error, self.new_responder)
+
+
+class ProfileTest(ResponderMixin, testlib.TestCase):
+    def setUp(self):
+        super(ProfileTest, self).setUp()
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.unlink(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        super(ProfileTest, self).tearDown()
+
+    def context(self, context_id):
+        return mitogen.core.Context(self.router, context_id)
+
+    def test_record(self):
+        self.responder.profile_context(self.context(0), 'kind')
+        self.assertTrue(self.deferred.empty())
+        self.request('plain_old_module')
+        self.run_deferred()
+        self.assertEqual({'kind': ['plain_old_module']},
+                         self.responder._profiles)
+
+    def test_negative_ignored(self):
+        self.responder.profile_context(self.context(0), 'kind')
+        self.request('profile_test_nonexistent_module')
+        self.run_deferred()
+        self.assertEqual({}, self.responder._profiles)
+
+    def test_disconnect_forgotten(self):
+        context = self.context(0)
+        self.responder.profile_context(context, 'kind')
+        mitogen.core.fire(context, 'disconnect')
+        self.assertEqual({}, self.responder._profile_key_by_id)
+
+    def test_unprofiled_ignored(self):
+        self.responder.profile_context(self.context(1), 'kind')
+        self.request('plain_old_module')
+        self.run_deferred()
+        self.assertEqual({}, self.responder._profiles)
+
+    def test_forward(self):
+        self.responder._record_profile('kind', ['plain_old_module'])
+        context = self.context(2)
+        self.responder.profile_context(context, 'kind')
+        func, args = self.deferred.get()
+        self.assertEqual(self.responder._forward_modules, func)
+        self.assertEqual((context, ['plain_old_module']), args)
+        self.assertEqual(1, self.responder.profile_forward_count)
+
+    def test_max_size(self):
+        self.responder.max_profile_size = 2
+        self.responder._record_profile('kind', ['a', 'b', 'a', 'c'])
+        self.assertEqual({'kind': ['a', 'b']}, self.responder._profiles)
+
+    def test_save_load(self):
+        self.responder._record_profile('kind', ['a', 'b'])
+        self.responder.save_profiles(self.path)
+        other = mitogen.master.ModuleResponder(self.router)
+        other._record_profile('kind', ['c'])
+        other._record_profile('other', ['d'])
+        other.save_profiles(self.path)  # Merges with the first.
+
+        responder = mitogen.master.ModuleResponder(self.router)
+        responder.load_profiles(self.path)
+        self.assertEqual({'kind': ['a', 'b', 'c'], 'other': ['d']},
+                         responder._profiles)
+
+    def test_not_profiles(self):
+        fp = open(self.path, 'wb')
+        fp.write(mitogen.core.b('[1]'))
+        fp.close()
+        self.assertRaises(mitogen.core.Error,
+                          lambda: self.responder.load_profiles(self.path))
+
+
 class ForwardTest(testlib.RouterMixin, testlib.TestCase):
     def test_forward_to_nonexistent_context(self):
         nonexistent = mitogen.core.Context(self.router, 123)
@@ -196,6 +555,41 @@ class ForwardTest(testlib.RouterMixin, testlib.TestCase):
         self.assertGreater(40000, self.router.responder.good_load_module_size)
 
 
+@mitogen.core.takes_econtext
+def get_store_state(econtext):
+    return econtext.importer.store is not None
+
+
+class ModuleStoreTest(testlib.RouterMixin, testlib.TestCase):
+    def setUp(self):
+        super(ModuleStoreTest, self).setUp()
+        self.router.responder.enable_module_store()
+        self.store = mitogen.module_store.ModuleStore.open(
+            self.router.responder.store_id
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.store.path)
+        super(ModuleStoreTest, self).tearDown()
+
+    def test_sibling_skips_parent(self):
+        c1 = self.router.local()
+        self.assertEqual(256, c1.call(plain_old_module.pow, 2, 8))
+        count = self.router.responder.get_module_count
+        self.assertTrue(self.store.get(u'plain_old_module'))
+
+        c2 = self.router.local()
+        self.assertEqual(256, c2.call(plain_old_module.pow, 2, 8))
+        # Only mitogen.module_store itself, needed to read the store.
+        self.assertEqual(count + 1, self.router.responder.get_module_count)
+        self.assertTrue(c2.call(get_store_state))
+
+    def test_disabled(self):
+        self.router.responder.store_id = None
+        c1 = self.router.local()
+        self.assertFalse(c1.call(get_store_state))
+
+
 class BlacklistTest(testlib.TestCase):
     @unittest.skip('implement me')
     def test_whitelist_no_blacklist(self):
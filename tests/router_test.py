@@ -250,6 +250,15 @@ class MyselfTest(testlib.RouterMixin, testlib.TestCase):
         self.assertEqual(myself.name, 'self')
 
 
+class RoutedBytesTest(testlib.RouterMixin, testlib.TestCase):
+    def test_counts_payload(self):
+        recv = mitogen.core.Receiver(self.router)
+        before = self.router.routed_bytes
+        recv.to_sender().send(b('x') * 1000)
+        recv.get()
+        self.assertTrue(self.router.routed_bytes - before >= 1000)
+
+
 class MessageSizeTest(testlib.BrokerMixin, testlib.TestCase):
     klass = mitogen.master.Router
 
@@ -20,6 +20,15 @@ class MyService(mitogen.service.Service):
     def test_arg_spec(self, foo):
         return foo
 
+    @mitogen.service.expose(policy=mitogen.service.AllowParents())
+    @mitogen.service.arg_spec({
+        'foo': int
+    }, optional={
+        'bar': int
+    })
+    def test_optional_arg_spec(self, foo, bar=None):
+        return foo, bar
+
     @mitogen.service.expose(policy=mitogen.service.AllowParents())
     def privileged_op(self):
         return 'privileged!'
@@ -61,6 +70,32 @@ class CallTest(testlib.RouterMixin, testlib.TestCase):
             )
         )
 
+    def test_remote_bad_optional_arg(self):
+        c1 = self.router.local()
+        self.assertRaises(
+            mitogen.core.CallError,
+            lambda: mitogen.service.call(
+                MyService.name(),
+                'test_optional_arg_spec',
+                foo=1,
+                bar='x',
+                call_context=c1
+            )
+        )
+
+    def test_remote_optional_arg(self):
+        c1 = self.router.local()
+        for kwargs, expect in (({}, [1, None]),
+                               ({'bar': None}, [1, None]),
+                               ({'bar': 2}, [1, 2])):
+            self.assertEqual(expect, list(mitogen.service.call(
+                MyService.name(),
+                'test_optional_arg_spec',
+                foo=1,
+                call_context=c1,
+                **kwargs
+            )))
+
     def test_local_unicode(self):
         pool = mitogen.service.get_or_create_pool(router=self.router)
         self.assertEqual(